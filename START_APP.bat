@@ -1,9 +1,8 @@
 @echo off
-REM Batch file to start the CRM app with keep-alive monitor
-REM This ensures the app stays running and restarts automatically if it crashes
+REM Batch file to start the CRM app with the production server
 cd /d "%~dp0"
-echo Starting CRM application with keep-alive monitor...
-python keep_alive.py
+echo Starting CRM application...
+python serve.py
 pause
 
 
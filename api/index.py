@@ -8,7 +8,15 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from flask import Flask
+from crm.assets import init_assets
+from crm.audit import init_audit
+from crm.compression import init_compression
 from crm.db import init_db
+from crm.jobs import init_jobs
+from crm.metrics import init_metrics
+from crm.replicas import init_replicas
+from crm.scheduling import init_scheduling
+from crm.templating import init_templating
 from crm.routes import register_routes
 from datetime import datetime
 
@@ -37,6 +45,9 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Initialize database
 init_db(app)
 
+# Send GET reads to replicas when DATABASE_REPLICA_URLS is set
+init_replicas(app)
+
 # Custom Jinja2 date filter for templates
 @app.template_filter('date')
 def date_filter(value, format_string='Y'):
@@ -67,9 +78,30 @@ def replace_underscore_filter(s):
         return s
     return s.replace('_', ' ')
 
+# Request, database and process metrics at /metrics
+init_metrics(app)
+
+# Template bytecode cache and {% cache %} fragments
+init_templating(app)
+
+# Fingerprinted, precompressed static files
+init_assets(app)
+
+# gzip/brotli/zstd for HTML, JSON and CSV responses
+init_compression(app)
+
 # Register all routes
 register_routes(app)
 
+# Start background job workers
+init_jobs(app)
+
+# Persist audit entries in the background
+init_audit(app)
+
+# Reopen expired snoozes now and on a timer
+init_scheduling(app)
+
 # Create tables on startup (for serverless, this runs on cold start)
 with app.app_context():
     from crm.db import db
@@ -0,0 +1,218 @@
+"""
+Touchpoint activity rollups.
+
+``touchpoint_activity`` holds one count per (period, bucket, type, contact),
+with weekly (Monday-start) and monthly buckets. Database triggers on
+``touchpoints`` and on every archive year table adjust the two affected rows
+on each insert, update and delete, so bulk statements, ON DELETE cascades,
+contact merges and archiving (an insert into the archive plus a delete from
+the hot table) all keep the counts exact. Reports read only the rollups;
+their cost follows the number of buckets, not the number of touchpoints.
+
+A rebuild recomputes everything with one GROUP BY per period over the hot
+and archived touchpoints.
+"""
+from datetime import date, timedelta
+from sqlalchemy import text
+from crm.db import db
+from crm.jobs import job_handler
+from crm.models import Contact, TouchpointActivity
+
+PERIODS = ('week', 'month')
+
+# Report groupings and the rollup column each reads
+GROUPS = {
+    'bucket': TouchpointActivity.bucket,
+    'type': TouchpointActivity.touchpoint_type,
+    'contact': TouchpointActivity.contact_id,
+}
+
+# Buckets shown when a report does not give a start date
+DEFAULT_BUCKETS = {'week': 26, 'month': 12}
+
+# First day of a timestamp's bucket, per dialect and period ({0} is the column)
+_BUCKET_SQL = {
+    'sqlite': {
+        'week': "date({0}, '-' || ((CAST(strftime('%w', {0}) AS INTEGER) + 6) % 7) || ' days')",
+        'month': "date({0}, 'start of month')",
+    },
+    'postgresql': {
+        'week': "CAST(date_trunc('week', {0}) AS DATE)",
+        'month': "CAST(date_trunc('month', {0}) AS DATE)",
+    },
+}
+
+_KEY = 'period, bucket, touchpoint_type, contact_id'
+
+
+def _count_row(dialect: str, row: str, delta: int) -> str:
+    """Statement adding ``delta`` to both buckets of the trigger row ``row`` (NEW or OLD)."""
+    values = ', '.join(
+        f"('{period}', {_BUCKET_SQL[dialect][period].format(f'{row}.occurred_at')}, "
+        f'{row}.touchpoint_type, COALESCE({row}.contact_id, 0), {delta})'
+        for period in PERIODS
+    )
+    return (f'INSERT INTO touchpoint_activity ({_KEY}, touchpoints) VALUES {values} '
+            f'ON CONFLICT ({_KEY}) DO UPDATE '
+            'SET touchpoints = touchpoint_activity.touchpoints + excluded.touchpoints;')
+
+
+def _drop_empty(dialect: str, row: str) -> str:
+    """Statement removing the trigger row's buckets once their count reaches zero."""
+    buckets = ', '.join(_BUCKET_SQL[dialect][period].format(f'{row}.occurred_at') for period in PERIODS)
+    return ('DELETE FROM touchpoint_activity WHERE touchpoints <= 0 '
+            f'AND contact_id = COALESCE({row}.contact_id, 0) AND touchpoint_type = {row}.touchpoint_type '
+            f'AND bucket IN ({buckets});')
+
+
+def track_activity(conn, table: str):
+    """Install the triggers that count a touchpoint table's rows into the rollups."""
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        changed = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}'
+                              for column in ('occurred_at', 'touchpoint_type', 'contact_id'))
+        for name, body in (
+            ('insert', f'AFTER INSERT ON {table} BEGIN ' + _count_row(dialect, 'NEW', 1)),
+            ('delete', f'AFTER DELETE ON {table} BEGIN '
+             + _count_row(dialect, 'OLD', -1) + _drop_empty(dialect, 'OLD')),
+            ('update', f'AFTER UPDATE OF occurred_at, touchpoint_type, contact_id ON {table} '
+             f'WHEN {changed} BEGIN ' + _count_row(dialect, 'OLD', -1) + _drop_empty(dialect, 'OLD')
+             + _count_row(dialect, 'NEW', 1)),
+        ):
+            conn.execute(text(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_activity_{name} {body} END'))
+    elif dialect == 'postgresql':
+        exists = conn.execute(text(
+            f"SELECT 1 FROM pg_trigger WHERE tgname = 'trg_{table}_activity'"
+        )).first()
+        if not exists:
+            conn.execute(text(
+                f'CREATE TRIGGER trg_{table}_activity '
+                f'AFTER INSERT OR DELETE OR UPDATE OF occurred_at, touchpoint_type, contact_id ON {table} '
+                'FOR EACH ROW EXECUTE FUNCTION crm_touchpoint_activity()'
+            ))
+
+
+def _touchpoint_tables() -> list:
+    from crm.archive import archive_table, archived_years
+    return ['touchpoints'] + [archive_table(year).name for year in archived_years()]
+
+
+def _rebuild(conn):
+    """Replace every rollup row: one grouped INSERT ... SELECT per period."""
+    dialect = conn.dialect.name
+    tables = _touchpoint_tables()
+    if dialect == 'postgresql':
+        # Writers wait, so no touchpoint is counted twice or missed
+        conn.execute(text(f"LOCK TABLE {', '.join(tables)} IN SHARE MODE"))
+    source = ' UNION ALL '.join(
+        f'SELECT occurred_at, touchpoint_type, contact_id FROM {table}' for table in tables
+    )
+    conn.execute(TouchpointActivity.__table__.delete())
+    for period in PERIODS:
+        bucket = _BUCKET_SQL[dialect][period].format('occurred_at')
+        conn.execute(text(
+            f'INSERT INTO touchpoint_activity ({_KEY}, touchpoints) '
+            f"SELECT '{period}', {bucket}, touchpoint_type, COALESCE(contact_id, 0), COUNT(*) "
+            f'FROM ({source}) AS counted GROUP BY 2, 3, 4'
+        ))
+
+
+def ensure_activity(engine):
+    """Install the rollup triggers and build the rollups on databases that predate them."""
+    dialect = engine.dialect.name
+    if dialect not in _BUCKET_SQL:
+        print(f"Note: Touchpoint activity rollups are not supported on {dialect}")
+        return
+    try:
+        with engine.begin() as conn:
+            if dialect == 'postgresql':
+                conn.execute(text(
+                    'CREATE OR REPLACE FUNCTION crm_touchpoint_activity() RETURNS trigger AS $$ BEGIN '
+                    "IF TG_OP IN ('DELETE', 'UPDATE') THEN "
+                    + _count_row(dialect, 'OLD', -1) + _drop_empty(dialect, 'OLD') + ' END IF; '
+                    "IF TG_OP IN ('INSERT', 'UPDATE') THEN " + _count_row(dialect, 'NEW', 1) + ' END IF; '
+                    'RETURN NULL; END $$ LANGUAGE plpgsql'
+                ))
+            tables = _touchpoint_tables()
+            for table in tables:
+                track_activity(conn, table)
+            empty = conn.execute(db.select(TouchpointActivity.period).limit(1)).first() is None
+            if empty and (len(tables) > 1 or conn.execute(text('SELECT 1 FROM touchpoints LIMIT 1')).first()):
+                _rebuild(conn)
+    except Exception as e:
+        print(f"Note: Could not set up touchpoint activity rollups: {e}")
+
+
+def rebuild_activity():
+    """Recompute every rollup from hot and archived touchpoints. Does not commit."""
+    _rebuild(db.session.connection())
+
+
+@job_handler('rebuild_activity')
+def rebuild_activity_job(params: dict) -> dict:
+    """Recompute the touchpoint activity rollups."""
+    rebuild_activity()
+    db.session.commit()
+    count = db.session.query(db.func.count()).select_from(TouchpointActivity).scalar()
+    return {'message': f'Rebuilt {count} touchpoint activity rows.'}
+
+
+def bucket_start(period: str, day: date) -> date:
+    """First day of the week (Monday) or month containing ``day``."""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def buckets_between(period: str, start: date, end: date) -> list:
+    """Every bucket from the one containing ``start`` to the one containing ``end``."""
+    bucket, last, buckets = bucket_start(period, start), bucket_start(period, end), []
+    while bucket <= last:
+        buckets.append(bucket)
+        if period == 'week':
+            bucket += timedelta(days=7)
+        else:
+            bucket = (bucket + timedelta(days=32)).replace(day=1)
+    return buckets
+
+
+def default_start(period: str, end: date) -> date:
+    """First day of the last DEFAULT_BUCKETS buckets up to ``end``."""
+    first, back = bucket_start(period, end), DEFAULT_BUCKETS[period] - 1
+    if period == 'week':
+        return first - timedelta(weeks=back)
+    index = first.year * 12 + first.month - 1 - back
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def activity_counts(period: str, start: date, end: date, group_by=('bucket', 'type'),
+                    contact_id: int = None, touchpoint_type: str = None, limit: int = None) -> list:
+    """Summed counts over the buckets from ``start`` to ``end``, grouped by any of GROUPS.
+
+    Rows hold the grouped columns plus ``touchpoints``, ordered by bucket when
+    grouped by it and busiest first otherwise.
+    """
+    columns = [GROUPS[name] for name in group_by]
+    count = db.func.sum(TouchpointActivity.touchpoints).label('touchpoints')
+    stmt = (
+        db.select(*columns, count)
+        .where(TouchpointActivity.period == period,
+               TouchpointActivity.bucket.between(bucket_start(period, start), end))
+        .group_by(*columns)
+    )
+    if contact_id is not None:
+        stmt = stmt.where(TouchpointActivity.contact_id == contact_id)
+    if touchpoint_type:
+        stmt = stmt.where(TouchpointActivity.touchpoint_type == touchpoint_type)
+    stmt = stmt.order_by(*columns) if 'bucket' in group_by else stmt.order_by(count.desc(), *columns)
+    if limit:
+        stmt = stmt.limit(limit)
+    return db.session.execute(stmt).all()
+
+
+def contact_names(contact_ids) -> dict:
+    """Names of the given contacts, keyed by id."""
+    ids = [contact_id for contact_id in contact_ids if contact_id]
+    if not ids:
+        return {}
+    return dict(db.session.execute(db.select(Contact.id, Contact.name).where(Contact.id.in_(ids))).all())
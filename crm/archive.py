@@ -0,0 +1,190 @@
+"""
+Touchpoint archival.
+
+Touchpoints older than ARCHIVE_AFTER_DAYS are moved out of ``touchpoints``
+into one ``touchpoints_archive_<year>`` table per calendar year, a chunk of
+rows per transaction. The hot table and its indexes then only hold recent
+activity. Contact history and search read the hot table first and open
+archive years, newest first, only while they still need rows.
+"""
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import Column, ForeignKey, Index, MetaData, Table, inspect
+from crm.activity import track_activity
+from crm.changes import forget_deletes, last_tombstone_id
+from crm.db import db
+from crm.jobs import job_handler
+from crm.models import Contact, Deal, Touchpoint
+
+# Touchpoints older than this many days are archived (0 disables archival)
+ARCHIVE_AFTER_DAYS = int(os.environ.get('TOUCHPOINT_ARCHIVE_DAYS', 730))
+
+# Rows moved per transaction; keeps IN lists under SQLite limits
+CHUNK_SIZE = 500
+
+# Seconds the list of archive tables is cached (other workers may add years)
+YEARS_CACHE_SECONDS = 60.0
+
+TABLE_PREFIX = 'touchpoints_archive_'
+_TABLE_PATTERN = re.compile(rf'^{TABLE_PREFIX}(\d{{4}})$')
+
+# Columns copied from the hot table
+COLUMNS = ('id', 'deal_id', 'contact_id', 'touchpoint_type', 'occurred_at',
+           'summary', 'next_step', 'external_id', 'message_id', 'created_at')
+
+_metadata = MetaData()
+_lock = threading.Lock()
+_years = None
+_years_checked = 0.0
+
+
+def archive_table(year: int) -> Table:
+    """Table definition for one archive year."""
+    name = f'{TABLE_PREFIX}{year}'
+    with _lock:
+        table = _metadata.tables.get(name)
+        if table is None:
+            table = Table(
+                name, _metadata,
+                Column('id', db.Integer, primary_key=True, autoincrement=False),
+                Column('deal_id', db.Integer, ForeignKey(Deal.__table__.c.id, ondelete='CASCADE')),
+                Column('contact_id', db.Integer, ForeignKey(Contact.__table__.c.id, ondelete='CASCADE')),
+                Column('touchpoint_type', db.String(20), nullable=False),
+                Column('occurred_at', db.DateTime, nullable=False),
+                Column('summary', db.Text, nullable=False),
+                Column('next_step', db.Text),
+                Column('external_id', db.String(100)),
+                Column('message_id', db.String(255)),
+                Column('created_at', db.DateTime),
+                Column('archived_at', db.DateTime),
+                Index(f'ix_{name}_contact_occurred_at', 'contact_id', 'occurred_at'),
+                Index(f'ix_{name}_message_id', 'message_id'),
+            )
+        return table
+
+
+def archived_years() -> list:
+    """Years that have an archive table, newest first."""
+    global _years, _years_checked
+    if _years is None or time.monotonic() - _years_checked >= YEARS_CACHE_SECONDS:
+        names = inspect(db.engine).get_table_names()
+        _years = sorted((int(m.group(1)) for m in map(_TABLE_PATTERN.match, names) if m), reverse=True)
+        _years_checked = time.monotonic()
+    return _years
+
+
+def archive_touchpoints(days: int = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """Move touchpoints older than the horizon into archive tables.
+
+    Each chunk is copied and deleted in its own transaction, so the job can
+    be interrupted and rerun. Returns the number of rows moved.
+    """
+    global _years
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    if days <= 0:
+        return 0
+    hot = Touchpoint.__table__
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    # SQLite hands out max(rowid) + 1; keeping the newest row stops archived ids being reused
+    newest_id = db.session.execute(db.select(db.func.max(hot.c.id))).scalar()
+    created = set()
+    moved = 0
+    while True:
+        rows = db.session.execute(
+            db.select(hot.c.id, hot.c.occurred_at)
+            .where(hot.c.occurred_at < cutoff, hot.c.id != newest_id)
+            .order_by(hot.c.occurred_at)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        by_year = {}
+        for row in rows:
+            by_year.setdefault(row.occurred_at.year, []).append(row.id)
+        archived_at = db.literal(datetime.utcnow(), db.DateTime)
+        for year, ids in by_year.items():
+            table = archive_table(year)
+            if year not in created:
+                table.create(db.session.connection(), checkfirst=True)
+                # Archived rows keep counting towards activity reports
+                track_activity(db.session.connection(), table.name)
+                created.add(year)
+            db.session.execute(table.insert().from_select(
+                COLUMNS + ('archived_at',),
+                db.select(*(hot.c[c] for c in COLUMNS), archived_at).where(hot.c.id.in_(ids))
+            ))
+        ids = [row.id for row in rows]
+        tombstone_id = last_tombstone_id()
+        # Moved, not deleted: keep the move out of the audit log
+        db.session.execute(hot.delete().where(hot.c.id.in_(ids)).execution_options(skip_audit=True))
+        # Archived rows still exist; keep them out of the change feed's deletes
+        forget_deletes(hot.name, ids, tombstone_id)
+        db.session.commit()
+        moved += len(rows)
+    if created:
+        _years = None
+    return moved
+
+
+@job_handler('archive_touchpoints')
+def archive_touchpoints_job(params: dict) -> dict:
+    """Archive touchpoints past the configured horizon."""
+    days = int(params.get('days') or ARCHIVE_AFTER_DAYS)
+    moved = archive_touchpoints(days)
+    return {'message': f'Archived {moved} touchpoints older than {days} days.'}
+
+
+def reassign_contact(old_id: int, new_id: int):
+    """Move archived touchpoints to another contact (contact merges). Does not commit."""
+    for year in archived_years():
+        table = archive_table(year)
+        db.session.execute(table.update().where(table.c.contact_id == old_id).values(contact_id=new_id))
+
+
+def contact_touchpoints(contact_id: int, limit: int = 20) -> list:
+    """Newest touchpoints of a contact, reading archive years only as needed.
+
+    Hot rows are Touchpoint objects; archived rows are result rows with the
+    same column names plus ``archived_at``.
+    """
+    touchpoints = Touchpoint.query.filter_by(contact_id=contact_id).order_by(
+        Touchpoint.occurred_at.desc()
+    ).limit(limit).all()
+    for year in archived_years():
+        if len(touchpoints) >= limit:
+            break
+        table = archive_table(year)
+        touchpoints.extend(db.session.execute(
+            db.select(table).where(table.c.contact_id == contact_id)
+            .order_by(table.c.occurred_at.desc()).limit(limit - len(touchpoints))
+        ).all())
+    # Rows backdated past the horizon sit in the hot table until the next run
+    touchpoints.sort(key=lambda t: t.occurred_at, reverse=True)
+    return touchpoints
+
+
+def search_touchpoints(query: str, limit: int = 20) -> list:
+    """Touchpoints whose summary or next step matches, hot table first."""
+    pattern = f'%{query}%'
+
+    def matching(table, archived_at, remaining):
+        return (
+            db.select(table.c.id, table.c.contact_id, table.c.touchpoint_type, table.c.occurred_at,
+                      table.c.summary, Contact.name.label('contact_name'), archived_at.label('archived_at'))
+            .outerjoin(Contact, Contact.id == table.c.contact_id)
+            .where(db.or_(table.c.summary.ilike(pattern), table.c.next_step.ilike(pattern)))
+            .order_by(table.c.occurred_at.desc())
+            .limit(remaining)
+        )
+
+    hot = Touchpoint.__table__
+    results = db.session.execute(matching(hot, db.null(), limit)).all()
+    for year in archived_years():
+        if len(results) >= limit:
+            break
+        table = archive_table(year)
+        results.extend(db.session.execute(matching(table, table.c.archived_at, limit - len(results))).all())
+    return results
@@ -0,0 +1,248 @@
+"""
+Static asset pipeline.
+
+``flask --app app build-assets`` downloads the third-party CSS/JS (and the
+fonts their stylesheets reference) into ``crm/static/vendor``, then copies
+every static file into ``crm/static/dist`` under a content-hashed name with
+gzip (and, when the brotli package is installed, brotli) variants next to
+it. ``dist/manifest.json`` maps logical names to hashed ones.
+
+Templates keep calling ``url_for('static', filename=...)``: built assets
+resolve to their hashed names and are served with far-future immutable
+caching and the best precompressed variant the client accepts. Vercel
+runs ``python -m crm.assets`` as its build command (see vercel.json),
+which fails the deployment if a download fails. Vendor files that have not
+been downloaded yet (an unbuilt checkout) fall back to their CDN URLs,
+with a note printed the first time each one does.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import urllib.parse
+import urllib.request
+from flask import Flask, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip variants only
+    brotli = None
+
+# Local path under static/ -> upstream URL
+VENDOR_ASSETS = {
+    'vendor/bootstrap/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'vendor/bootstrap-icons/bootstrap-icons.css': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/bootstrap-icons.css',
+    'vendor/jquery/jquery.min.js': 'https://code.jquery.com/jquery-3.7.0.min.js',
+    'vendor/datatables/dataTables.bootstrap5.min.css': 'https://cdn.datatables.net/1.13.4/css/dataTables.bootstrap5.min.css',
+    'vendor/datatables/jquery.dataTables.min.js': 'https://cdn.datatables.net/1.13.4/js/jquery.dataTables.min.js',
+    'vendor/datatables/dataTables.bootstrap5.min.js': 'https://cdn.datatables.net/1.13.4/js/dataTables.bootstrap5.min.js',
+    'vendor/fonts/plus-jakarta-sans.css': 'https://fonts.googleapis.com/css2?family=Plus+Jakarta+Sans:wght@400;500;600;700&display=swap',
+}
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# Extensions worth storing precompressed (fonts and images are already compressed)
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map', '.html', '.ttf', '.eot'}
+
+# Precompressed variants in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Hashed files never change, so clients may cache them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Font CSS is served per browser; ask for the woff2 variant
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+_manifest = {}
+_static_folder = ''
+_cdn_fallbacks = set()  # vendor files already reported as served from their CDN
+
+
+def _fetch(url: str) -> bytes:
+    """Download one upstream file."""
+    req = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return response.read()
+
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def vendor_assets(static_folder: str, force: bool = False) -> list:
+    """Download VENDOR_ASSETS and the files their CSS references. Returns paths fetched."""
+    fetched = []
+    for name, url in VENDOR_ASSETS.items():
+        target = os.path.join(static_folder, name)
+        if os.path.exists(target) and not force:
+            continue
+        data = _fetch(url)
+        if name.endswith('.css'):
+            data = _vendor_css_references(static_folder, name, url, data.decode('utf-8')).encode('utf-8')
+        _write(target, data)
+        fetched.append(name)
+    return fetched
+
+
+def _vendor_css_references(static_folder: str, name: str, url: str, css: str) -> str:
+    """Download fonts/images a stylesheet points at and make its url()s local."""
+    base_dir = posixpath.dirname(name)
+
+    def replace(match):
+        ref = match.group(2).strip()
+        if ref.startswith(('data:', '#')):
+            return match.group(0)
+        absolute = urllib.parse.urljoin(url, ref)
+        path = urllib.parse.urlparse(absolute).path
+        if urllib.parse.urlparse(ref).netloc:
+            local = posixpath.join('files', posixpath.basename(path))
+        else:
+            local = posixpath.normpath(urllib.parse.urlparse(ref).path)
+        target = os.path.join(static_folder, base_dir, local)
+        if not os.path.exists(target):
+            _write(target, _fetch(absolute))
+        return f'url("{local}")'
+
+    return _CSS_URL.sub(replace, css)
+
+
+def _hashed_name(name: str, data: bytes) -> str:
+    root, ext = posixpath.splitext(name)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _rewrite_css(name: str, css: str, manifest: dict) -> str:
+    """Point relative url()s of a stylesheet at hashed names."""
+    base_dir = posixpath.dirname(name)
+
+    def replace(match):
+        ref = match.group(2).strip()
+        parsed = urllib.parse.urlparse(ref)
+        if parsed.scheme or parsed.netloc or ref.startswith(('data:', '#', '/')):
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(base_dir, parsed.path))
+        hashed = manifest.get(target)
+        if hashed is None:
+            return match.group(0)
+        suffix = f'#{parsed.fragment}' if parsed.fragment else ''
+        return f'url("{posixpath.relpath(hashed, posixpath.join(DIST_DIR, base_dir))}{suffix}")'
+
+    return _CSS_URL.sub(replace, css)
+
+
+def _emit(dist: str, hashed: str, data: bytes):
+    """Write a hashed file and its precompressed variants."""
+    target = os.path.join(dist, hashed)
+    _write(target, data)
+    if posixpath.splitext(hashed)[1] in COMPRESSIBLE:
+        _write(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(target + '.br', brotli.compress(data, quality=11))
+
+
+def build_assets(static_folder: str) -> dict:
+    """Fingerprint and precompress every static file into dist/. Returns the manifest."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist]
+        for filename in files:
+            path = os.path.join(root, filename)
+            sources.append(os.path.relpath(path, static_folder).replace(os.sep, '/'))
+
+    manifest = {}
+    # Stylesheets last, so the fonts and images they reference are already hashed
+    for name in sorted(sources, key=lambda n: (n.endswith('.css'), n)):
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            data = f.read()
+        if name.endswith('.css'):
+            data = _rewrite_css(name, data.decode('utf-8'), manifest).encode('utf-8')
+        hashed = posixpath.join(DIST_DIR, _hashed_name(name, data))
+        _emit(dist, posixpath.relpath(hashed, DIST_DIR), data)
+        manifest[name] = hashed
+    _write(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def _load_manifest(static_folder: str) -> dict:
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def static_url_for(endpoint: str, **values) -> str:
+    """``url_for`` that resolves static files to hashed or CDN URLs."""
+    if endpoint == 'static' and 'filename' in values:
+        filename = values['filename']
+        hashed = _manifest.get(filename)
+        if hashed:
+            values['filename'] = hashed
+        elif filename in VENDOR_ASSETS and not os.path.exists(os.path.join(_static_folder, filename)):
+            # Not vendored yet: use the upstream copy
+            if filename not in _cdn_fallbacks:
+                _cdn_fallbacks.add(filename)
+                print(f"Note: {filename} is not built; serving it from {VENDOR_ASSETS[filename]} "
+                      "(run flask --app app build-assets)")
+            return VENDOR_ASSETS[filename]
+    return url_for(endpoint, **values)
+
+
+def serve_static(filename: str):
+    """Static view: precompressed, immutable responses for hashed files."""
+    folder = _static_folder
+    if not filename.startswith(DIST_DIR + '/'):
+        return send_from_directory(folder, filename)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.exists(os.path.join(folder, filename + suffix)):
+            response = send_from_directory(folder, filename + suffix, mimetype=mimetype,
+                                           max_age=IMMUTABLE_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(folder, filename, max_age=IMMUTABLE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_assets(app: Flask):
+    """Serve built assets and make url_for('static') emit their hashed names."""
+    global _manifest, _static_folder
+    _static_folder = app.static_folder
+    _manifest = _load_manifest(app.static_folder)
+    app.view_functions['static'] = serve_static
+    app.jinja_env.globals['url_for'] = static_url_for
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Vendor CDN assets, then fingerprint and precompress static files."""
+        global _manifest
+        try:
+            fetched = vendor_assets(app.static_folder)
+            print(f"Vendored {len(fetched)} assets")
+        except OSError as e:
+            print(f"Note: Could not download vendor assets ({e}); building what is present")
+        _manifest = build_assets(app.static_folder)
+        print(f"Built {len(_manifest)} assets into {os.path.join(app.static_folder, DIST_DIR)}")
+
+
+if __name__ == '__main__':
+    # Deployment build step: unlike the CLI command, a failed download fails the build
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    print(f"Vendored {len(vendor_assets(folder))} assets")
+    print(f"Built {len(build_assets(folder))} assets into {os.path.join(folder, DIST_DIR)}")
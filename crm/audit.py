@@ -0,0 +1,326 @@
+"""
+Write-behind audit log.
+
+Field-level diffs are captured from every ORM flush and every set-based
+UPDATE or DELETE run through the session (the matching rows are read
+before the statement, and re-read after an update, in the same
+transaction). Set-based inserts and upserts report their rows with
+record_changes(). Entries are held on the session until commit and then
+handed to a bounded in-memory queue. A background
+thread drains the queue into ``audit_log`` with multi-row inserts, so a
+request only pays for building the diff and enqueueing it. When the queue
+is full the committing thread waits briefly (backpressure) and then writes
+its entries itself rather than dropping them. Pending entries are flushed
+at interpreter shutdown.
+
+Rows removed or nulled by ON DELETE rules in the database are not audited
+row by row; the entry for the deleted parent records the change.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+from flask import Flask, has_request_context, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from crm.db import db
+from crm.models import AuditEntry
+
+# Tables whose writes are bookkeeping rather than user data
+AUDIT_EXCLUDE = {'audit_log', 'jobs', 'contact_match_keys', 'owner_portfolios', 'dismissed_duplicates',
+                 'tombstones', 'touchpoint_activity', 'replica_heartbeat'}
+
+# Execution option that keeps a set-based statement out of the log (rows
+# moved or derived rather than changed by anyone)
+SKIP_AUDIT = 'skip_audit'
+
+# Columns that change on every write and add no information
+IGNORED_COLUMNS = {'updated_at'}
+
+# Entries buffered in memory before committing threads are slowed down
+QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', 10000))
+
+# Seconds a committing thread waits for queue space before writing inline
+PUT_TIMEOUT = 0.5
+
+# Rows per INSERT; the idle writer rechecks for shutdown this often
+BATCH_SIZE = 500
+FLUSH_SECONDS = 1.0
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_engine = None
+_writer = None
+_stopping = threading.Event()
+
+
+def init_audit(app: Flask):
+    """Start the background writer and flush pending entries at exit."""
+    global _engine
+    with app.app_context():
+        _engine = db.engine
+    if _writer is None:
+        _start_writer()
+        atexit.register(flush)
+        # Preforking servers copy this process without its threads
+        os.register_at_fork(after_in_child=_start_writer)
+
+
+def _start_writer():
+    """Start the writer thread with an empty queue."""
+    global _queue, _writer
+    _queue = queue.Queue(maxsize=QUEUE_SIZE)
+    _writer = threading.Thread(target=_writer_loop, name='crm-audit', daemon=True)
+    _writer.start()
+
+
+def _actor() -> str:
+    """Who is making the change: client address or background thread name."""
+    if has_request_context():
+        return (request.remote_addr or 'web')[:100]
+    return threading.current_thread().name[:100]
+
+
+def _plain(value):
+    """Make a column value JSON serializable."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _entry(entity: str, entity_id, action: str, changes: dict) -> dict:
+    """Build one audit row."""
+    return {
+        'occurred_at': datetime.utcnow(),
+        'entity': entity,
+        'entity_id': entity_id,
+        'action': action,
+        'changes': json.dumps(changes, default=str),
+        'actor': _actor(),
+    }
+
+
+def _audited(obj) -> bool:
+    """Check if an object's table is audited."""
+    return getattr(obj, '__tablename__', None) not in AUDIT_EXCLUDE
+
+
+def _snapshot(obj) -> dict:
+    """Current non-null column values as {field: value}."""
+    values = {}
+    for attr in inspect(obj).mapper.column_attrs:
+        value = getattr(obj, attr.key)
+        if value is not None and attr.key not in IGNORED_COLUMNS:
+            values[attr.key] = _plain(value)
+    return values
+
+
+@event.listens_for(Session, 'before_flush')
+def _capture_changes(session, flush_context, instances):
+    """Diff dirty and deleted objects; remember new ones until they have ids."""
+    pending = session.info.setdefault('audit_entries', [])
+    for obj in session.dirty:
+        if not _audited(obj) or not session.is_modified(obj, include_collections=False):
+            continue
+        state = inspect(obj)
+        changes = {}
+        for attr in state.mapper.column_attrs:
+            if attr.key in IGNORED_COLUMNS:
+                continue
+            history = state.attrs[attr.key].history
+            if history.has_changes():
+                old = history.deleted[0] if history.deleted else None
+                new = history.added[0] if history.added else None
+                if old != new:
+                    changes[attr.key] = [_plain(old), _plain(new)]
+        if changes:
+            pending.append(_entry(obj.__tablename__, getattr(obj, 'id', None), 'update', changes))
+    for obj in session.deleted:
+        if _audited(obj):
+            pending.append(_entry(obj.__tablename__, getattr(obj, 'id', None), 'delete',
+                                  {k: [v, None] for k, v in _snapshot(obj).items()}))
+    session.info.setdefault('audit_new', []).extend(obj for obj in session.new if _audited(obj))
+
+
+@event.listens_for(Session, 'after_flush')
+def _capture_inserts(session, flush_context):
+    """Record inserts now that primary keys are assigned."""
+    new = session.info.pop('audit_new', None)
+    if new:
+        session.info.setdefault('audit_entries', []).extend(
+            _entry(obj.__tablename__, getattr(obj, 'id', None), 'insert', {k: [None, v] for k, v in _snapshot(obj).items()})
+            for obj in new)
+
+
+def _rows(connection, table, where, params=None) -> dict:
+    """Values of a table's matching rows as {id: {column: value}}."""
+    stmt = db.select(table)
+    if where is not None:
+        stmt = stmt.where(where)
+    return {row.id: {key: _plain(value) for key, value in row._asdict().items() if key not in IGNORED_COLUMNS}
+            for row in connection.execute(stmt, params or {})}
+
+
+def _rows_by_id(connection, table, ids) -> dict:
+    """Values of the rows with the given ids, read BATCH_SIZE ids per query."""
+    ids, rows = list(ids), {}
+    for start in range(0, len(ids), BATCH_SIZE):
+        rows.update(_rows(connection, table, table.c.id.in_(ids[start:start + BATCH_SIZE])))
+    return rows
+
+
+def _row_entries(table, before: dict, after: dict) -> list:
+    """Insert, update and delete entries between two {id: values} states of a table."""
+    entries = []
+    for row_id, new in after.items():
+        old = before.get(row_id)
+        if old is None:
+            entries.append(_entry(table.name, row_id, 'insert',
+                                  {k: [None, v] for k, v in new.items() if v is not None}))
+            continue
+        changes = {k: [old.get(k), v] for k, v in new.items() if old.get(k) != v}
+        if changes:
+            entries.append(_entry(table.name, row_id, 'update', changes))
+    for row_id in before.keys() - after.keys():
+        entries.append(_entry(table.name, row_id, 'delete',
+                              {k: [v, None] for k, v in before[row_id].items() if v is not None}))
+    return entries
+
+
+def _audited_table(table) -> bool:
+    """Check if a statement's target table is audited."""
+    return table is not None and table.name not in AUDIT_EXCLUDE and 'id' in table.c
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _capture_statement(state):
+    """Diff the rows a set-based UPDATE or DELETE touches."""
+    if not (state.is_update or state.is_delete) or state.execution_options.get(SKIP_AUDIT):
+        return None
+    table = state.statement.table
+    if not _audited_table(table):
+        return None
+    connection = state.session.connection()
+    where = state.statement.whereclause
+    param_sets = state.parameters if isinstance(state.parameters, list) else [state.parameters]
+    before = {}
+    for params in param_sets:
+        before.update(_rows(connection, table, where, params))
+    result = state.invoke_statement()
+    if before:
+        after = _rows_by_id(connection, table, before) if state.is_update else {}
+        state.session.info.setdefault('audit_entries', []).extend(_row_entries(table, before, after))
+    return result
+
+
+def snapshot_rows(table, where) -> dict:
+    """Rows a set-based upsert may change, to pass to record_changes() as ``before``."""
+    if not _audited_table(table):
+        return {}
+    return _rows(db.session.connection(), table, where)
+
+
+def record_changes(table, ids, before: dict = None):
+    """Audit rows a set-based INSERT or upsert wrote (by id) against their earlier values."""
+    if not ids or not _audited_table(table):
+        return
+    after = _rows_by_id(db.session.connection(), table, ids)
+    db.session.info.setdefault('audit_entries', []).extend(_row_entries(table, before or {}, after))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish(session):
+    """Queue entries of a committed transaction for the writer thread."""
+    entries = session.info.pop('audit_entries', None)
+    session.info.pop('audit_new', None)
+    if not entries:
+        return
+    if _writer is None:
+        _write(entries, session.get_bind())
+        return
+    for index, item in enumerate(entries):
+        try:
+            _queue.put(item, timeout=PUT_TIMEOUT)
+        except queue.Full:
+            # Writer is behind: persist the rest on this thread instead of dropping
+            _write(entries[index:])
+            return
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    """Forget entries of a rolled-back transaction."""
+    session.info.pop('audit_entries', None)
+    session.info.pop('audit_new', None)
+
+
+def _write(rows: list, engine=None):
+    """Insert audit rows with one multi-row statement per batch."""
+    engine = engine or _engine
+    for start in range(0, len(rows), BATCH_SIZE):
+        with engine.begin() as conn:
+            conn.execute(AuditEntry.__table__.insert(), rows[start:start + BATCH_SIZE])
+
+
+def _drain(first=None) -> list:
+    """Take up to BATCH_SIZE queued rows without blocking."""
+    batch = [first] if first is not None else []
+    while len(batch) < BATCH_SIZE:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _writer_loop():
+    """Background thread: batch queued rows into audit_log."""
+    while not _stopping.is_set():
+        try:
+            first = _queue.get(timeout=FLUSH_SECONDS)
+        except queue.Empty:
+            continue
+        batch = _drain(first)
+        try:
+            _write(batch)
+        except Exception as e:
+            print(f"Note: Could not write {len(batch)} audit entries: {e}")
+
+
+def flush():
+    """Write everything still queued (called at shutdown)."""
+    _stopping.set()
+    while True:
+        batch = _drain()
+        if not batch:
+            break
+        try:
+            _write(batch)
+        except Exception as e:
+            print(f"Note: Could not write {len(batch)} audit entries: {e}")
+            break
+
+
+def query_audit(entity: str = None, entity_id: int = None, since: datetime = None,
+                until: datetime = None, before: tuple = None, limit: int = 100) -> list:
+    """Return audit entries newest first, filtered by entity and time range.
+
+    ``before`` is the (occurred_at, id) of the last entry of the previous
+    page, for keyset pagination.
+    """
+    query = db.select(AuditEntry)
+    if entity:
+        query = query.where(AuditEntry.entity == entity)
+        if entity_id is not None:
+            query = query.where(AuditEntry.entity_id == entity_id)
+    if since:
+        query = query.where(AuditEntry.occurred_at >= since)
+    if until:
+        query = query.where(AuditEntry.occurred_at < until)
+    if before:
+        query = query.where(db.tuple_(AuditEntry.occurred_at, AuditEntry.id) < db.tuple_(*before))
+    query = query.order_by(AuditEntry.occurred_at.desc(), AuditEntry.id.desc()).limit(limit)
+    return db.session.execute(query).scalars().all()
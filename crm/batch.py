@@ -0,0 +1,268 @@
+"""
+Batch create-or-update of records keyed on ``external_id``.
+
+All operations in a batch are validated up front, then written inside a
+single transaction. New records are written with dialect-specific
+``INSERT ... ON CONFLICT (external_id) DO UPDATE`` statements and must
+supply every required field; existing records are updated with only the
+fields sent, so a partial ``data`` object leaves the other columns as they are.
+"""
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import Date, DateTime, Float, Integer, Numeric, String
+from sqlalchemy.dialects import postgresql, sqlite
+from crm.audit import record_changes, snapshot_rows
+from crm.db import db
+from crm.dedupe import index_contacts
+from crm.geo import geocode_properties
+from crm.models import Contact, Property, Touchpoint, Task, TaskStatus
+from crm.portfolio import refresh_portfolios
+from crm.scheduling import note_snooze
+
+# Written in this order so later resources can reference earlier ones
+BATCH_MODELS = {
+    'contacts': Contact,
+    'properties': Property,
+    'touchpoints': Touchpoint,
+    'tasks': Task,
+}
+
+# Reference fields resolved from another resource's external_id
+EXTERNAL_REFERENCES = {
+    'contact_external_id': ('contact_id', Contact),
+    'property_external_id': ('property_id', Property),
+}
+
+# Columns managed by the server rather than the client
+READ_ONLY_COLUMNS = {'id', 'external_id', 'created_at', 'updated_at'}
+
+# Operations accepted in one request
+MAX_BATCH_SIZE = 5000
+
+# Rows per INSERT statement; keeps bound parameters under SQLite limits
+CHUNK_SIZE = 200
+
+
+class BatchItemError(ValueError):
+    """Raised when a single batch operation is invalid."""
+
+
+def _coerce(column, value):
+    """Convert a JSON value to the Python type a column expects."""
+    if value is None:
+        return None
+    kind = column.type
+    # bool is an int subclass, but true/false is never a valid number
+    number = isinstance(value, (int, float)) and not isinstance(value, bool)
+    try:
+        if isinstance(kind, DateTime):
+            if isinstance(value, str):
+                return datetime.fromisoformat(value)
+        elif isinstance(kind, Date):
+            if isinstance(value, str):
+                return date.fromisoformat(value[:10])
+        elif isinstance(kind, Integer):
+            if isinstance(value, str) or (number and float(value).is_integer()):
+                return int(value)
+        elif isinstance(kind, Float):
+            if number or isinstance(value, str):
+                return float(value)
+        elif isinstance(kind, Numeric):
+            if number or isinstance(value, str):
+                return Decimal(str(value))
+        elif isinstance(kind, String):
+            if isinstance(value, str):
+                return value
+        else:
+            return value
+    except (TypeError, ValueError, InvalidOperation):
+        pass
+    raise BatchItemError(f'Invalid value for {column.name}: {value!r}')
+
+
+def _validate(model, op: dict) -> dict:
+    """Turn one operation into a row dict, raising BatchItemError if invalid."""
+    external_id = op.get('external_id')
+    if not isinstance(external_id, str) or not external_id.strip():
+        raise BatchItemError('external_id is required')
+    data = op.get('data')
+    if not isinstance(data, dict):
+        raise BatchItemError('data must be an object')
+
+    columns = model.__table__.columns
+    row = {'external_id': external_id.strip()}
+    for key, value in data.items():
+        if key in EXTERNAL_REFERENCES:
+            # Only references to a column this resource actually has
+            if EXTERNAL_REFERENCES[key][0] not in columns:
+                raise BatchItemError(f'Unknown field for {model.__tablename__}: {key}')
+            row[key] = value
+            continue
+        if key not in columns or key in READ_ONLY_COLUMNS:
+            raise BatchItemError(f'Unknown or read-only field: {key}')
+        row[key] = _coerce(columns[key], value)
+
+    if model is Task and 'status' in row:
+        if row['status'] == TaskStatus.SNOOZED.value:
+            # A snooze without a time would never wake
+            if row.get('snoozed_until') is None:
+                raise BatchItemError('snoozed_until is required when status is Snoozed')
+        else:
+            row['snoozed_until'] = None
+    return row
+
+
+def _missing_fields(model, row: dict) -> list:
+    """NOT NULL columns without a default that a new record's row leaves out."""
+    return [c.name for c in model.__table__.columns
+            if not c.nullable and c.default is None and not c.primary_key and c.name not in row]
+
+
+def _existing_ids(model, external_ids: list) -> dict:
+    """Map the external_ids that already have a record to their ids."""
+    found = {}
+    for start in range(0, len(external_ids), CHUNK_SIZE):
+        found.update(db.session.execute(
+            db.select(model.external_id, model.id)
+            .where(model.external_id.in_(external_ids[start:start + CHUNK_SIZE]))
+        ).all())
+    return found
+
+
+def _resolve_references(items: list) -> tuple:
+    """Replace *_external_id references with ids, one IN query per kind.
+
+    Takes (index, row) pairs and returns (valid_items, errors) where errors
+    maps index to a message for rows whose reference could not be found.
+    """
+    errors = {}
+    for ref, (target, model) in EXTERNAL_REFERENCES.items():
+        wanted = {row[ref] for _, row in items if row.get(ref) is not None}
+        mapping = {}
+        if wanted:
+            mapping = dict(db.session.execute(
+                db.select(model.external_id, model.id).where(model.external_id.in_(wanted))
+            ).all())
+        for index, row in items:
+            if ref not in row:
+                continue
+            value = row.pop(ref)
+            if value is None:
+                row[target] = None
+            elif value in mapping:
+                row[target] = mapping[value]
+            else:
+                errors[index] = f'No {model.__tablename__} with external_id {value!r}'
+    return [(index, row) for index, row in items if index not in errors], errors
+
+
+def _upsert_statement(model, rows: list):
+    """Build INSERT ... ON CONFLICT (external_id) DO UPDATE for the dialect."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        insert = postgresql.insert
+    elif dialect == 'sqlite':
+        insert = sqlite.insert
+    else:
+        raise RuntimeError(f'Batch upserts are not supported on {dialect}')
+
+    stmt = insert(model.__table__).values(rows)
+    updated = {key: stmt.excluded[key] for key in rows[0] if key != 'external_id'}
+    if 'updated_at' in model.__table__.columns:
+        updated['updated_at'] = datetime.utcnow()
+    return stmt.on_conflict_do_update(
+        index_elements=['external_id'], set_=updated
+    ).returning(model.__table__.c.id, model.__table__.c.external_id)
+
+
+def _update_statement(model, keys: tuple):
+    """Build an executemany UPDATE of the given columns keyed on external_id.
+
+    Parameters are named ``b_<column>`` (SQLAlchemy reserves the bare names).
+    """
+    table = model.__table__
+    values = {key: db.bindparam(f'b_{key}') for key in keys if key != 'external_id'}
+    if 'updated_at' in table.columns:
+        values['updated_at'] = datetime.utcnow()
+    # record_changes() audits these rows against the snapshot taken first
+    return (table.update().where(table.c.external_id == db.bindparam('b_external_id'))
+            .values(values).execution_options(skip_audit=True))
+
+
+def apply_batch(operations: list) -> list:
+    """Validate and upsert a list of operations in one transaction.
+
+    Each operation is ``{"resource": ..., "external_id": ..., "data": {...}}``.
+    Returns one result dict per operation, in input order. Invalid items are
+    reported and skipped; database errors roll back the whole batch.
+    """
+    results = [None] * len(operations)
+    grouped = {name: [] for name in BATCH_MODELS}
+    seen = set()
+
+    for index, op in enumerate(operations):
+        try:
+            if not isinstance(op, dict) or op.get('resource') not in BATCH_MODELS:
+                raise BatchItemError(f"resource must be one of: {', '.join(BATCH_MODELS)}")
+            model = BATCH_MODELS[op['resource']]
+            row = _validate(model, op)
+            key = (op['resource'], row['external_id'])
+            if key in seen:
+                raise BatchItemError('Duplicate external_id in batch')
+            seen.add(key)
+            grouped[op['resource']].append((index, row))
+        except BatchItemError as e:
+            results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+
+    try:
+        for resource, items in grouped.items():
+            model = BATCH_MODELS[resource]
+            valid, errors = _resolve_references(items)
+            for index, message in errors.items():
+                results[index] = {'index': index, 'status': 'error', 'error': message}
+
+            # Existing records take only the fields sent; new ones need every required field
+            existing = _existing_ids(model, [row['external_id'] for _, row in valid])
+            by_shape = {}
+            for index, row in valid:
+                is_update = row['external_id'] in existing
+                missing = [] if is_update else _missing_fields(model, row)
+                if missing:
+                    results[index] = {'index': index, 'status': 'error',
+                                      'error': f"Missing required field(s): {', '.join(missing)}"}
+                    continue
+                # Rows written by one statement must share the same keys
+                by_shape.setdefault((is_update, tuple(sorted(row))), []).append((index, row))
+            table = model.__table__
+            for (is_update, keys), shape_items in by_shape.items():
+                for start in range(0, len(shape_items), CHUNK_SIZE):
+                    chunk = shape_items[start:start + CHUNK_SIZE]
+                    before = snapshot_rows(table, table.c.external_id.in_([row['external_id'] for _, row in chunk]))
+                    if is_update:
+                        db.session.execute(_update_statement(model, keys),
+                                           [{f'b_{key}': value for key, value in row.items()} for _, row in chunk])
+                        ids = {row['external_id']: existing[row['external_id']] for _, row in chunk}
+                    else:
+                        ids = {ext: pk for pk, ext in db.session.execute(
+                            _upsert_statement(model, [row for _, row in chunk])
+                        )}
+                    record_changes(table, ids.values(), before)
+                    for index, row in chunk:
+                        results[index] = {'index': index, 'status': 'ok', 'resource': resource,
+                                          'id': ids.get(row['external_id']),
+                                          'external_id': row['external_id']}
+        # Upserts bypass ORM events, so refresh derived data here
+        for index, op in enumerate(operations):
+            if results[index] and results[index]['status'] == 'ok' and op['resource'] == 'tasks':
+                until = op['data'].get('snoozed_until')
+                if until and op['data'].get('status') == TaskStatus.SNOOZED.value:
+                    note_snooze(_coerce(Task.__table__.c.snoozed_until, until))
+        property_ids = [r['id'] for r in results if r and r.get('resource') == 'properties']
+        index_contacts([r['id'] for r in results if r and r.get('resource') == 'contacts'])
+        geocode_properties(property_ids)
+        refresh_portfolios(property_ids=property_ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return results
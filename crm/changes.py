@@ -0,0 +1,208 @@
+"""
+Change feed.
+
+Every synced table has an indexed ``updated_at``, and database triggers
+record each deleted row in ``tombstones``, so deletes made by the ORM,
+by bulk statements and by ON DELETE cascades are all captured. Set-based
+UPDATEs of these tables must set ``updated_at`` themselves; rows nulled by
+an ON DELETE SET NULL foreign key are stamped by another trigger. A sync
+reads rows and tombstones past its cursor with keyset pagination on
+(updated_at, id): one index range scan per table, so its cost follows the
+number of changes rather than the size of the tables.
+
+A sync only reads up to a settled point, so a transaction that stamped its
+rows before committing is not skipped. On PostgreSQL that point is held
+back to the start of the oldest transaction still writing (less
+SETTLE_SECONDS for clock skew). Elsewhere it is SETTLE_SECONDS ago, so a
+write transaction that stays open longer than that can be missed for good.
+
+Archiving touchpoints moves rows without deleting them and leaves no
+tombstones. The feed reads only the hot ``touchpoints`` table (as
+``/api/v1/touchpoints`` does), so a first sync does not send archived
+touchpoints; clients that synced them before archival keep their copies.
+"""
+import base64
+import json
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from crm.db import db
+from crm.jobs import job_handler
+from crm.models import Tombstone
+
+FEED_TABLES = ('contacts', 'properties', 'deals', 'tasks', 'touchpoints', 'property_owners', 'deal_contact_roles')
+
+# Seconds a sync stays behind the newest changes (commits in flight, clock skew)
+SETTLE_SECONDS = float(os.environ.get('FEED_SETTLE_SECONDS', 5))
+
+# Tombstones are pruned after this many days; older cursors must resync
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 90))
+
+# Rows per batch fetched from the database while streaming
+YIELD_PER = 500
+
+
+def _utc_now_sql(engine):
+    """SQL for the current UTC time in the form SQLAlchemy stores DateTime, or None."""
+    if engine.dialect.name == 'sqlite':
+        # Text timestamps must match SQLAlchemy's microsecond format to compare correctly
+        return "strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'"
+    if engine.dialect.name == 'postgresql':
+        return "(clock_timestamp() AT TIME ZONE 'utc')"
+    return None
+
+
+def _set_null_columns(table: str) -> list:
+    """Columns of a feed table that the database nulls when their parent row is deleted."""
+    return [column.name for column in db.Model.metadata.tables[table].columns
+            if any(fk.ondelete == 'SET NULL' for fk in column.foreign_keys)]
+
+
+def ensure_change_tracking(engine):
+    """Backfill missing updated_at values and install the tombstone and stamp triggers."""
+    now = _utc_now_sql(engine)
+    if now is None:
+        print(f"Note: Change feed tombstones are not supported on {engine.dialect.name}")
+        return
+    try:
+        with engine.begin() as conn:
+            for table in FEED_TABLES:
+                conn.execute(text(
+                    f'UPDATE {table} SET updated_at = COALESCE(created_at, {now}) WHERE updated_at IS NULL'
+                ))
+            if engine.dialect.name == 'sqlite':
+                for table in FEED_TABLES:
+                    conn.execute(text(
+                        f'CREATE TRIGGER IF NOT EXISTS trg_{table}_tombstone AFTER DELETE ON {table} '
+                        f"BEGIN INSERT INTO tombstones (entity, entity_id, deleted_at) "
+                        f"VALUES ('{table}', OLD.id, {now}); END"
+                    ))
+                    columns = _set_null_columns(table)
+                    if columns:
+                        conn.execute(text(
+                            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_stamp AFTER UPDATE OF {", ".join(columns)} '
+                            f'ON {table} WHEN NEW.updated_at IS OLD.updated_at '
+                            f'BEGIN UPDATE {table} SET updated_at = {now} WHERE id = NEW.id; END'
+                        ))
+            else:
+                conn.execute(text(
+                    'CREATE OR REPLACE FUNCTION crm_record_tombstone() RETURNS trigger AS $$ BEGIN '
+                    f'INSERT INTO tombstones (entity, entity_id, deleted_at) VALUES (TG_TABLE_NAME, OLD.id, {now}); '
+                    'RETURN OLD; END $$ LANGUAGE plpgsql'
+                ))
+                conn.execute(text(
+                    'CREATE OR REPLACE FUNCTION crm_stamp_updated_at() RETURNS trigger AS $$ BEGIN '
+                    f'IF NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at THEN NEW.updated_at := {now}; END IF; '
+                    'RETURN NEW; END $$ LANGUAGE plpgsql'
+                ))
+                existing = set(conn.execute(text(
+                    "SELECT tgname FROM pg_trigger WHERE tgname LIKE 'trg_%_tombstone' OR tgname LIKE 'trg_%_stamp'"
+                )).scalars())
+                for table in FEED_TABLES:
+                    if f'trg_{table}_tombstone' not in existing:
+                        conn.execute(text(
+                            f'CREATE TRIGGER trg_{table}_tombstone AFTER DELETE ON {table} '
+                            'FOR EACH ROW EXECUTE FUNCTION crm_record_tombstone()'
+                        ))
+                    columns = _set_null_columns(table)
+                    if columns and f'trg_{table}_stamp' not in existing:
+                        conn.execute(text(
+                            f'CREATE TRIGGER trg_{table}_stamp BEFORE UPDATE OF {", ".join(columns)} ON {table} '
+                            'FOR EACH ROW EXECUTE FUNCTION crm_stamp_updated_at()'
+                        ))
+    except Exception as e:
+        print(f"Note: Could not set up change tracking: {e}")
+
+
+def last_tombstone_id() -> int:
+    """Highest tombstone id so far; pass it to forget_deletes after moving rows."""
+    return db.session.execute(db.select(db.func.max(Tombstone.id))).scalar() or 0
+
+
+def forget_deletes(table: str, ids: list, after_id: int):
+    """Drop the tombstones of rows that were moved, not deleted. Does not commit."""
+    db.session.execute(Tombstone.__table__.delete().where(
+        Tombstone.id > after_id, Tombstone.entity == table, Tombstone.entity_id.in_(ids)
+    ))
+
+
+def prune_tombstones(days: int = None) -> int:
+    """Delete tombstones past the retention period and commit. Returns rows deleted."""
+    cutoff = datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS if days is None else days)
+    deleted = 0
+    for table in FEED_TABLES:
+        deleted += db.session.execute(Tombstone.__table__.delete().where(
+            Tombstone.entity == table, Tombstone.deleted_at < cutoff
+        )).rowcount
+    db.session.commit()
+    return deleted
+
+
+@job_handler('prune_tombstones')
+def prune_tombstones_job(params: dict) -> dict:
+    """Drop tombstones older than the retention period."""
+    deleted = prune_tombstones(params.get('days'))
+    return {'message': f'Pruned {deleted} tombstones.'}
+
+
+def settled_until() -> datetime:
+    """Latest timestamp a sync may read up to without skipping a commit still in flight.
+
+    Rows and tombstones are stamped inside their transaction, so none can
+    commit later with a stamp before that transaction started.
+    """
+    until = datetime.utcnow()
+    if db.engine.dialect.name == 'postgresql':
+        oldest = db.session.execute(text(
+            "SELECT MIN(xact_start) AT TIME ZONE 'utc' FROM pg_stat_activity "
+            'WHERE datname = current_database() AND backend_xid IS NOT NULL AND pid <> pg_backend_pid()'
+        )).scalar()
+        if oldest is not None:
+            until = min(until, oldest)
+    return until - timedelta(seconds=SETTLE_SECONDS)
+
+
+def changed_rows(model, after: tuple, until: datetime, limit: int):
+    """Rows changed after the (updated_at, id) position ``after`` and up to ``until``, oldest first."""
+    table = model.__table__
+    stmt = db.select(table).where(table.c.updated_at <= until)
+    if after is not None:
+        stmt = stmt.where(db.tuple_(table.c.updated_at, table.c.id) > db.tuple_(*after))
+    stmt = stmt.order_by(table.c.updated_at, table.c.id).limit(limit)
+    return db.session.execute(stmt.execution_options(yield_per=YIELD_PER))
+
+
+def deleted_rows(model, after: tuple, until: datetime, limit: int):
+    """Tombstones of a model after the (deleted_at, id) position ``after``, oldest first."""
+    stmt = db.select(Tombstone.id, Tombstone.entity_id, Tombstone.deleted_at).where(
+        Tombstone.entity == model.__tablename__, Tombstone.deleted_at <= until
+    )
+    if after is not None:
+        stmt = stmt.where(db.tuple_(Tombstone.deleted_at, Tombstone.id) > db.tuple_(*after))
+    stmt = stmt.order_by(Tombstone.deleted_at, Tombstone.id).limit(limit)
+    return db.session.execute(stmt.execution_options(yield_per=YIELD_PER))
+
+
+def encode_cursor(positions: dict) -> str:
+    """Opaque cursor from {resource: (updated position, deleted position)}."""
+    payload = {name: [[stamp.isoformat(), last_id] for stamp, last_id in pair]
+               for name, pair in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor."""
+    if not cursor:
+        return {}
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return {name: tuple((datetime.fromisoformat(stamp), int(last_id)) for stamp, last_id in pair)
+                for name, pair in payload.items()}
+    except (TypeError, AttributeError, json.JSONDecodeError) as e:
+        raise ValueError(str(e))
+
+
+def cursor_expired(positions: dict) -> bool:
+    """True when tombstones the cursor has not seen may already be pruned."""
+    horizon = datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    return any(deleted[0] < horizon for _, deleted in positions.values())
@@ -0,0 +1,182 @@
+"""
+Dynamic response compression.
+
+Text responses (HTML pages, JSON, CSV downloads) above a size threshold are
+compressed with the best encoding the client accepts: brotli and zstd when
+their packages are installed, gzip otherwise. Streamed responses are
+compressed chunk by chunk, flushing after every chunk the view yields, so
+nothing is buffered beyond what the view itself produces.
+
+Compressed bodies get their own ETag (the encoding is appended), and the
+suffix is stripped from incoming If-None-Match headers so views comparing
+ETags keep matching; a 304 for such a request gets the suffix back, so it
+carries the validator the client cached.
+"""
+import os
+import re
+import zlib
+from flask import Flask, request
+from werkzeug.http import parse_etags
+
+try:
+    import brotli
+except ImportError:  # Optional encoding
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # Optional encoding
+    zstandard = None
+
+# Buffered bodies smaller than this are sent as-is (headers would dominate)
+MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/csv', 'text/plain', 'text/calendar', 'text/javascript',
+    'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml',
+    'image/svg+xml',
+}
+
+# Levels tuned for on-the-fly compression: most of the ratio for little CPU
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+_ETAG_SUFFIX = re.compile(r'-(?:gzip|br|zstd)(?="|$)')
+
+# environ key holding If-None-Match as the client sent it, before stripping
+_CLIENT_ETAGS_KEY = 'crm.if_none_match'
+
+
+class _Encoder:
+    """Incremental compressor with a common compress/flush/finish interface."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == 'zstd':
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        """Emit everything compressed so far without ending the stream."""
+        if self.encoding == 'br':
+            return self._obj.flush()
+        if self.encoding == 'zstd':
+            return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def available_encodings() -> list:
+    """Encodings this process can produce, most preferred first."""
+    encodings = []
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    encodings.append('gzip')
+    return encodings
+
+
+def _negotiate() -> str:
+    """Pick the encoding with the highest client quality; ties go to our order."""
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compress_stream(chunks, encoder: _Encoder, charset: str):
+    """Compress an iterable body chunk by chunk."""
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            if chunk:
+                out = encoder.compress(chunk) + encoder.flush()
+                if out:
+                    yield out
+        yield encoder.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def _strip_etag_suffix():
+    """Let views compare If-None-Match against their uncompressed ETags."""
+    value = request.environ.get('HTTP_IF_NONE_MATCH')
+    if value:
+        stripped = _ETAG_SUFFIX.sub('', value)
+        if stripped != value:
+            request.environ[_CLIENT_ETAGS_KEY] = value
+            request.environ['HTTP_IF_NONE_MATCH'] = stripped
+
+
+def _restore_etag_suffix(response):
+    """Give a 304 the encoded ETag the client matched, as its compressed 200 carried."""
+    client_etags = request.environ.get(_CLIENT_ETAGS_KEY)
+    etag, weak = response.get_etag()
+    if client_etags and etag:
+        client_etags = parse_etags(client_etags)
+        for encoding in ('br', 'zstd', 'gzip'):
+            if client_etags.contains_weak(f'{etag}-{encoding}'):
+                response.set_etag(f'{etag}-{encoding}', weak=weak)
+                response.vary.add('Accept-Encoding')
+                break
+    return response
+
+
+def compress_response(response):
+    """Compress an eligible response in place."""
+    if response.status_code == 304:
+        return _restore_etag_suffix(response)
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers or response.direct_passthrough
+            or 'no-transform' in (response.headers.get('Cache-Control') or '')):
+        return response
+    encoding = _negotiate()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, _Encoder(encoding), 'utf-8')
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        encoder = _Encoder(encoding)
+        compressed = encoder.compress(data) + encoder.finish()
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak=weak)
+    return response
+
+
+def init_compression(app: Flask):
+    """Compress responses of every view."""
+    app.before_request(_strip_etag_suffix)
+    app.after_request(compress_response)
@@ -0,0 +1,270 @@
+"""
+Comparable-property finder.
+
+Numeric property attributes are kept in an in-memory matrix (one row per
+property) so similarity against every property is one vectorized pass.
+The matrix is loaded lazily, then patched a row at a time from ORM events
+in this process, and from ``updated_at`` and the change feed's tombstones
+for writes and deletes made by other workers; running sums keep the
+per-feature scales current without a full pass. numpy (in requirements.txt)
+does the scoring; where it cannot be installed a pure-Python loop computes
+the same scores, more slowly.
+"""
+import math
+import threading
+import time
+import heapq
+from datetime import timedelta
+from sqlalchemy import event
+from crm.changes import SETTLE_SECONDS, last_tombstone_id
+from crm.db import db
+from crm.models import Property, Tombstone
+
+try:
+    import numpy as np
+except ImportError:  # Platforms without numpy wheels
+    np = None
+
+# Feature weights; location is the planar distance term
+DEFAULT_WEIGHTS = {
+    'units': 1.0,
+    'year_built': 0.5,
+    'property_class': 0.75,
+    'value': 1.0,
+    'location': 1.0,
+}
+
+# Scalar features in matrix column order (location uses the last two columns)
+SCALAR_FEATURES = ('units', 'year_built', 'property_class', 'value')
+
+CLASS_ORDINALS = {'A': 1.0, 'B': 2.0, 'C': 3.0, 'D': 4.0}
+
+# Normalized penalty when either property lacks a feature
+MISSING_PENALTY = 1.0
+
+# Miles that count as one unit of location difference
+LOCATION_SCALE_MILES = 10.0
+MILES_PER_DEGREE = 69.0
+
+# Seconds between checks for writes made by other processes
+SYNC_SECONDS = 5.0
+
+
+def _features(row) -> tuple:
+    """Convert a property row into (units, year, class, value, x_miles, y_miles)."""
+    nan = float('nan')
+    lo, hi = row.estimated_value_min, row.estimated_value_max
+    values = [float(v) for v in (lo, hi) if v is not None]
+    value = sum(values) / len(values) if values else nan
+    klass = CLASS_ORDINALS.get((row.property_class or '').strip().upper()[:1], nan)
+    if row.latitude is not None and row.longitude is not None:
+        x = row.longitude * MILES_PER_DEGREE * math.cos(math.radians(row.latitude))
+        y = row.latitude * MILES_PER_DEGREE
+    else:
+        x = y = nan
+    return (
+        float(row.units) if row.units is not None else nan,
+        float(row.year_built) if row.year_built is not None else nan,
+        klass,
+        value,
+        x,
+        y,
+    )
+
+
+def _query(*conditions):
+    """Select the columns the feature matrix is built from."""
+    return db.select(
+        Property.id, Property.units, Property.year_built, Property.property_class,
+        Property.estimated_value_min, Property.estimated_value_max,
+        Property.latitude, Property.longitude, Property.updated_at
+    ).where(*conditions)
+
+
+class CompsIndex:
+    """Array-backed cache of property features."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = []
+        self._position = {}  # property id -> row index
+        # Feature rows: a preallocated numpy array (first len(_ids) rows in use), else a list of tuples
+        self._rows = None
+        # Running count, sum and sum of squares of each scalar feature's known values
+        self._moments = None
+        self._dirty = set()  # ids changed by ORM writes in this process
+        self._loaded = False
+        self._last_updated_at = None
+        self._last_tombstone_id = 0
+        self._last_sync = 0.0
+
+    def mark_dirty(self, property_id: int):
+        """Record a changed property; applied on the next query."""
+        with self._lock:
+            self._dirty.add(property_id)
+
+    def _rebuild(self):
+        """Reload every property from the database."""
+        self._ids, self._position = [], {}
+        self._rows = np.empty((0, 6)) if np is not None else []
+        self._moments = [[0, 0.0, 0.0] for _ in SCALAR_FEATURES]
+        self._last_updated_at = None
+        self._last_tombstone_id = last_tombstone_id()
+        for row in db.session.execute(_query()):
+            self._apply(row)
+        self._dirty.clear()
+        self._loaded = True
+
+    def _count(self, features, sign: int):
+        """Add (sign=1) or remove (sign=-1) a row's known values from the running moments."""
+        for moment, value in zip(self._moments, features[:4]):
+            if not math.isnan(value):
+                moment[0] += sign
+                moment[1] += sign * value
+                moment[2] += sign * value * value
+
+    def _apply(self, row):
+        """Insert or replace one property's features in place."""
+        features = _features(row)
+        index = self._position.get(row.id)
+        if index is None:
+            index = self._position[row.id] = len(self._ids)
+            self._ids.append(row.id)
+            if np is not None:
+                if index == len(self._rows):
+                    # Grow by doubling so appends stay amortized O(1)
+                    grown = np.empty((max(64, 2 * index), 6))
+                    grown[:index] = self._rows
+                    self._rows = grown
+            else:
+                self._rows.append(features)
+        else:
+            self._count(self._rows[index], -1)
+            if np is None:
+                self._rows[index] = features
+        if np is not None:
+            self._rows[index] = features
+        self._count(features, 1)
+        if row.updated_at and (self._last_updated_at is None or row.updated_at > self._last_updated_at):
+            self._last_updated_at = row.updated_at
+
+    def _remove(self, property_id: int):
+        """Drop a property by moving the last row into its slot."""
+        index = self._position.pop(property_id, None)
+        if index is None:
+            return
+        self._count(self._rows[index], -1)
+        last = len(self._ids) - 1
+        last_id = self._ids.pop()
+        if index < last:
+            self._ids[index] = last_id
+            self._rows[index] = self._rows[last]
+            self._position[last_id] = index
+        if np is None:
+            self._rows.pop()
+
+    def _sync(self):
+        """Bring the cache up to date with local and remote writes."""
+        if not self._loaded:
+            self._rebuild()
+            self._last_sync = time.monotonic()
+            return
+
+        changed = set(self._dirty)
+        self._dirty.clear()
+        check_remote = time.monotonic() - self._last_sync >= SYNC_SECONDS
+        if check_remote:
+            if self._last_updated_at is not None:
+                # Overlap by the feed's settle time so rows stamped before a slow commit are not skipped
+                changed.update(db.session.execute(
+                    db.select(Property.id).where(
+                        Property.updated_at > self._last_updated_at - timedelta(seconds=SETTLE_SECONDS))
+                ).scalars())
+            for tombstone_id, property_id in db.session.execute(
+                db.select(Tombstone.id, Tombstone.entity_id)
+                .where(Tombstone.entity == Property.__tablename__, Tombstone.id > self._last_tombstone_id)
+            ):
+                changed.add(property_id)
+                self._last_tombstone_id = max(self._last_tombstone_id, tombstone_id)
+
+        if changed:
+            found = set()
+            for row in db.session.execute(_query(Property.id.in_(changed))):
+                self._apply(row)
+                found.add(row.id)
+            for property_id in changed - found:
+                self._remove(property_id)
+
+        if check_remote:
+            self._last_sync = time.monotonic()
+
+    def _scales(self) -> list:
+        """Population standard deviation of each scalar feature; 1 where it is unknown or zero."""
+        scales = []
+        for count, total, squares in self._moments:
+            std = 0.0
+            if count > 1:
+                mean = total / count
+                std = math.sqrt(max(squares / count - mean * mean, 0.0))
+            scales.append(std or 1.0)
+        return scales
+
+    def find(self, property_id: int, k: int = 10, weights: dict = None) -> list:
+        """Return [(property_id, distance)] of the k most similar properties."""
+        weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        with self._lock:
+            self._sync()
+            index = self._position.get(property_id)
+            if index is None:
+                return []
+            if np is not None:
+                return self._find_vectorized(index, k, weights)
+            return self._find_python(index, k, weights)
+
+    def _find_vectorized(self, index: int, k: int, weights: dict) -> list:
+        """Score every row in one numpy pass and select the top k."""
+        matrix = self._rows[:len(self._ids)]
+        target = matrix[index]
+        w = np.array([weights[f] for f in SCALAR_FEATURES])
+
+        diff = np.abs(matrix[:, :4] - target[:4]) / np.array(self._scales())
+        diff = np.where(np.isnan(diff), MISSING_PENALTY, diff)
+        score = diff @ w
+        location = np.hypot(matrix[:, 4] - target[4], matrix[:, 5] - target[5]) / LOCATION_SCALE_MILES
+        score += weights['location'] * np.where(np.isnan(location), MISSING_PENALTY, location)
+        score[index] = np.inf
+
+        k = min(k, len(score) - 1)
+        if k <= 0:
+            return []
+        top = np.argpartition(score, k - 1)[:k]
+        top = top[np.argsort(score[top])]
+        return [(self._ids[i], float(score[i])) for i in top]
+
+    def _find_python(self, index: int, k: int, weights: dict) -> list:
+        """Pure-Python fallback used when numpy is not installed."""
+        target = self._rows[index]
+        w = [weights[f] for f in SCALAR_FEATURES]
+        scales = self._scales()
+
+        def distance(row):
+            total = 0.0
+            for col in range(4):
+                d = abs(row[col] - target[col]) / scales[col]
+                total += w[col] * (MISSING_PENALTY if math.isnan(d) else d)
+            loc = math.hypot(row[4] - target[4], row[5] - target[5]) / LOCATION_SCALE_MILES
+            return total + weights['location'] * (MISSING_PENALTY if math.isnan(loc) else loc)
+
+        candidates = ((distance(row), self._ids[i]) for i, row in enumerate(self._rows) if i != index)
+        return [(pid, score) for score, pid in heapq.nsmallest(k, candidates)]
+
+
+comps_index = CompsIndex()
+
+
+@event.listens_for(Property, 'after_insert')
+@event.listens_for(Property, 'after_update')
+@event.listens_for(Property, 'after_delete')
+def _property_changed(mapper, connection, prop):
+    """Patch the cache for ORM writes made in this process."""
+    comps_index.mark_dirty(prop.id)
@@ -1,26 +1,147 @@
 """
 Database setup and initialization.
 """
-from flask import Flask
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from flask import Flask, request
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text, inspect
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, event, text, inspect
+from sqlalchemy.schema import CreateTable
 
-db = SQLAlchemy()
+try:
+    import fcntl
+except ImportError:  # Windows: writes are coordinated within one process only
+    fcntl = None
+
+
+
+class RoutingSession(Session):
+    """Session that sends plain SELECTs to the request's replica, if it has one.
+
+    Flushes, DML, raw SQL and everything after the first write go to the
+    primary, so a request always reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get(REPLICA_KEY)
+        if replica is not None and bind is None:
+            if self._flushing or getattr(clause, 'is_dml', False):
+                self.info.pop(REPLICA_KEY)
+                self.info[WROTE_KEY] = True
+            elif isinstance(clause, Select):
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Milliseconds a SQLite writer waits for another connection's lock
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+# Request methods that hold the SQLite write lock for the whole request
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# Read replicas (comma-separated URLs); each becomes bind 'replica_<n>'
+REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+
+# session.info keys: replica engine the request reads from, and whether it wrote
+REPLICA_KEY = 'crm.replica'
+WROTE_KEY = 'crm.wrote'
+
+_write_lock = threading.Lock()
+_write_lock_path = None
 
 
 def init_db(app: Flask):
     """Initialize database with Flask app."""
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for i, url in enumerate(REPLICA_URLS):
+        # Same postgres:// spelling fix as DATABASE_URL
+        if url.startswith('postgres://'):
+            url = url.replace('postgres://', 'postgresql://', 1)
+        binds[f'replica_{i}'] = url
     db.init_app(app)
     
     with app.app_context():
+        # SQLite only enforces foreign keys (and ON DELETE actions) when asked per connection
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _enable_sqlite_foreign_keys)
+            _coordinate_sqlite_writes(app, db.engine)
+        
+        # Forked workers (gunicorn --preload) must not share the parent's connections
+        engines = list(db.engines.values())
+        os.register_at_fork(after_in_child=lambda: [engine.dispose(close=False) for engine in engines])
+        
         # Import models to register them with SQLAlchemy
-        from crm.models import Contact, Property, Deal, DealContactRole, Touchpoint, Task, PropertyOwner
+        from crm.models import (Contact, Property, Deal, DealContactRole, Touchpoint, Task, PropertyOwner, Job,
+                                ContactMatchKey, DismissedDuplicate, OwnerPortfolio, AuditEntry,
+                                CalendarFeed, Tombstone, ReplicaHeartbeat, TouchpointActivity)
         
         # Create all tables
         db.create_all()
 
         # Database migration helpers - ensure new columns exist on existing databases
         _ensure_column(db.engine, 'tasks', 'property_id', 'INTEGER REFERENCES properties(id)')
+        _ensure_column(db.engine, 'tasks', 'recurrence_interval', 'INTEGER')
+        _ensure_column(db.engine, 'tasks', 'recurrence_unit', 'VARCHAR(10)')
+        _ensure_column(db.engine, 'tasks', 'recurrence_count', 'INTEGER')
+        _ensure_column(db.engine, 'tasks', 'recurrence_next', 'DATE')
+        _ensure_column(db.engine, 'tasks', 'series_id', 'INTEGER REFERENCES tasks(id) ON DELETE SET NULL')
+        _ensure_column(db.engine, 'tasks', 'snoozed_until', 'TIMESTAMP')
+        _ensure_column(db.engine, 'jobs', 'claimed_by', 'VARCHAR(100)')
+        _ensure_column(db.engine, 'jobs', 'heartbeat_at', 'TIMESTAMP')
+        _ensure_index(db.engine, 'ix_tasks_recurrence_next', 'tasks', 'recurrence_next')
+        _ensure_index(db.engine, 'ix_tasks_snoozed_until', 'tasks', 'snoozed_until')
+        _ensure_index(db.engine, 'ix_tasks_status_due_date', 'tasks', 'status, due_date')
+        _ensure_index(db.engine, 'ix_tasks_contact_id', 'tasks', 'contact_id')
+        for table in ('contacts', 'properties', 'touchpoints', 'tasks'):
+            _ensure_column(db.engine, table, 'external_id', 'VARCHAR(100)')
+            _ensure_index(db.engine, f'uq_{table}_external_id', table, 'external_id', unique=True)
+        
+        _ensure_column(db.engine, 'properties', 'latitude', 'FLOAT')
+        _ensure_column(db.engine, 'properties', 'longitude', 'FLOAT')
+        _ensure_index(db.engine, 'ix_properties_lat_lon', 'properties', 'latitude, longitude')
+        _ensure_index(db.engine, 'ix_properties_updated_at', 'properties', 'updated_at')
+        _ensure_index(db.engine, 'ix_touchpoints_contact_occurred_at', 'touchpoints', 'contact_id, occurred_at')
+        _ensure_index(db.engine, 'ix_touchpoints_occurred_at', 'touchpoints', 'occurred_at')
+        _ensure_column(db.engine, 'touchpoints', 'message_id', 'VARCHAR(255)')
+        _ensure_index(db.engine, 'uq_touchpoints_message_contact', 'touchpoints', 'message_id, contact_id', unique=True)
+        # Archive tables copy every touchpoint column
+        from crm.archive import archive_table, archived_years
+        for year in archived_years():
+            table = archive_table(year).name
+            _ensure_column(db.engine, table, 'message_id', 'VARCHAR(255)')
+            _ensure_index(db.engine, f'ix_{table}_message_id', table, 'message_id')
+        for table in ('touchpoints', 'property_owners', 'deal_contact_roles'):
+            _ensure_column(db.engine, table, 'updated_at', 'TIMESTAMP')
+        for table in ('contacts', 'deals', 'tasks', 'touchpoints', 'property_owners', 'deal_contact_roles'):
+            _ensure_index(db.engine, f'ix_{table}_updated_at_id', table, 'updated_at, id')
+        
+        # One ownership row per (property, contact); merge duplicates older code allowed
+        _ensure_unique(db.engine, 'uq_property_owners_property_contact', 'property_owners',
+                       ('property_id', 'contact_id'))
+        
+        # Schema-level ON DELETE actions so deletes don't load related rows
+        _ensure_foreign_keys(db.engine)
+        
+        # Change feed: backfill updated_at and record deletes as tombstones
+        from crm.changes import ensure_change_tracking
+        ensure_change_tracking(db.engine)
+        
+        # Touchpoint activity rollups: install their triggers and build them once
+        from crm.activity import ensure_activity
+        ensure_activity(db.engine)
+        
+        # Spatial index and coordinate backfill for radius search
+        from crm.geo import ensure_spatial_index
+        ensure_spatial_index(db.engine)
+        
+        # Populate ownership rollups on databases created before they existed
+        from crm.portfolio import ensure_portfolios
+        ensure_portfolios()
         
         # Seed initial stage values if needed
         from crm.models import seed_initial_data
@@ -46,3 +167,202 @@ def _ensure_column(engine, table_name: str, column_name: str, column_def: str):
         # Column might already exist or table might not exist - ignore
         print(f"Note: Could not add column {column_name} to {table_name}: {e}")
 
+
+
+def _ensure_index(engine, index_name: str, table_name: str, columns: str, unique: bool = False):
+    """Create an index if it is missing (both SQLite and PostgreSQL support IF NOT EXISTS)."""
+    try:
+        with engine.connect() as conn:
+            kind = 'UNIQUE INDEX' if unique else 'INDEX'
+            conn.execute(text(f'CREATE {kind} IF NOT EXISTS {index_name} ON {table_name} ({columns})'))
+            conn.commit()
+    except Exception as e:
+        print(f"Note: Could not create index {index_name} on {table_name}: {e}")
+
+
+def _ensure_unique(engine, index_name: str, table_name: str, columns: tuple):
+    """Create a unique index, first merging rows that repeat its columns.
+
+    Runs once: nothing is read when the index already exists. Of each set
+    of duplicates the row with the most non-null values is kept, its gaps
+    are filled from the others, and every removed row is printed.
+    """
+    try:
+        if index_name in {index['name'] for index in inspect(engine).get_indexes(table_name)}:
+            return
+        with engine.begin() as conn:
+            _merge_duplicates(conn, table_name, columns)
+    except Exception as e:
+        print(f"Note: Could not remove duplicate rows from {table_name}: {e}")
+        return
+    _ensure_index(engine, index_name, table_name, ', '.join(columns), unique=True)
+
+
+def _merge_duplicates(conn, table_name: str, columns: tuple):
+    """Collapse each group of rows sharing ``columns`` into its most complete row."""
+    keys = ', '.join(columns)
+    rows = conn.execute(text(
+        f'SELECT * FROM {table_name} WHERE ({keys}) IN '
+        f'(SELECT {keys} FROM {table_name} GROUP BY {keys} HAVING COUNT(*) > 1) ORDER BY id'
+    )).mappings().all()
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[c] for c in columns), []).append(dict(row))
+    data_columns = [c for c in (rows[0].keys() if rows else ())
+                    if c not in columns and c not in ('id', 'created_at', 'updated_at')]
+    for group in groups.values():
+        keep = max(group, key=lambda row: (sum(row[c] not in (None, '') for c in data_columns), -row['id']))
+        filled = {c: next((row[c] for row in group if row[c] not in (None, '')), None)
+                  for c in data_columns if keep[c] in (None, '')}
+        filled = {c: value for c, value in filled.items() if value is not None}
+        if filled and 'updated_at' in keep:
+            filled['updated_at'] = datetime.utcnow()
+        if filled:
+            assignments = ', '.join(f'{c} = :{c}' for c in filled)
+            conn.execute(text(f'UPDATE {table_name} SET {assignments} WHERE id = :id'), {**filled, 'id': keep['id']})
+        for row in group:
+            if row['id'] != keep['id']:
+                conn.execute(text(f'DELETE FROM {table_name} WHERE id = :id'), {'id': row['id']})
+                print(f"Note: Removed duplicate {table_name} row {row} (kept id {keep['id']})")
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Turn on foreign key enforcement for a new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the writer; busy_timeout makes writers queue."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
+@contextmanager
+def write_lock():
+    """Serialize SQLite write transactions across threads and worker processes.
+
+    No-op on other databases. Take it before the transaction's first read,
+    so the snapshot a writer reads from is never stale when it writes.
+    """
+    if _write_lock_path is None:
+        yield
+        return
+    with _write_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(_write_lock_path, 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _coordinate_sqlite_writes(app: Flask, engine):
+    """Enable WAL/busy_timeout and hold the write lock during mutating requests."""
+    global _write_lock_path
+    database = engine.url.database
+    if not database or database == ':memory:':
+        return
+    event.listen(engine, 'connect', _configure_sqlite_connection)
+    _write_lock_path = os.path.abspath(database) + '.write.lock'
+
+    def acquire():
+        if request.method in WRITE_METHODS:
+            lock = write_lock()
+            lock.__enter__()
+            request.environ['crm.write_lock'] = lock
+
+    def release(exc):
+        lock = request.environ.pop('crm.write_lock', None)
+        if lock is not None:
+            # The session is committed or rolled back before the lock is let go
+            db.session.remove()
+            lock.__exit__(None, None, None)
+
+    app.before_request(acquire)
+    app.teardown_request(release)
+
+
+def _ensure_foreign_keys(engine):
+    """Bring ON DELETE actions of existing tables in line with the models.
+
+    PostgreSQL constraints are dropped and re-added in place. SQLite cannot
+    alter constraints, so affected tables are rebuilt (create, copy, drop,
+    rename) with enforcement switched off. Rows whose parent is already
+    gone are removed or nulled the way the ON DELETE action would have.
+    """
+    try:
+        inspector = inspect(engine)
+        stale = {}
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {tuple(fk['constrained_columns']): fk for fk in inspector.get_foreign_keys(table.name)}
+            for fk in table.foreign_keys:
+                if not fk.ondelete:
+                    continue
+                current = existing.get((fk.parent.name,))
+                if current is None or (current.get('options', {}).get('ondelete') or '').upper() != fk.ondelete:
+                    stale.setdefault(table.name, []).append((fk, current))
+        if not stale:
+            return
+        
+        if engine.dialect.name == 'sqlite':
+            _rebuild_sqlite_tables(engine, [db.metadata.tables[name] for name in stale])
+        else:
+            with engine.begin() as conn:
+                for table_name, fks in stale.items():
+                    for fk, current in fks:
+                        name = (current or {}).get('name') or f'{table_name}_{fk.parent.name}_fkey'
+                        if current is not None:
+                            conn.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT {name}'))
+                        conn.execute(text(
+                            f'ALTER TABLE {table_name} ADD CONSTRAINT {name} FOREIGN KEY ({fk.parent.name}) '
+                            f'REFERENCES {fk.column.table.name} ({fk.column.name}) ON DELETE {fk.ondelete}'
+                        ))
+        print(f"Migrated ON DELETE rules for: {', '.join(stale)}")
+    except Exception as e:
+        print(f"Note: Could not migrate foreign keys: {e}")
+
+
+def _rebuild_sqlite_tables(engine, tables: list):
+    """Recreate SQLite tables from the models, keeping rows and indexes."""
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        conn.exec_driver_sql('BEGIN')
+        try:
+            for table in tables:
+                name = table.name
+                indexes = conn.exec_driver_sql(
+                    "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                    (name,)
+                ).scalars().all()
+                existing = {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info({name})')}
+                columns = ', '.join(c.name for c in table.columns if c.name in existing)
+                
+                ddl = str(CreateTable(table).compile(dialect=engine.dialect)).strip()
+                conn.exec_driver_sql(ddl.replace(f'CREATE TABLE {name} ', f'CREATE TABLE _new_{name} ', 1))
+                conn.exec_driver_sql(f'INSERT INTO _new_{name} ({columns}) SELECT {columns} FROM {name}')
+                for fk in table.foreign_keys:
+                    orphan = (f'{fk.parent.name} IS NOT NULL AND {fk.parent.name} NOT IN '
+                              f'(SELECT {fk.column.name} FROM {fk.column.table.name})')
+                    if fk.ondelete == 'CASCADE':
+                        conn.exec_driver_sql(f'DELETE FROM _new_{name} WHERE {orphan}')
+                    elif fk.ondelete == 'SET NULL':
+                        conn.exec_driver_sql(f'UPDATE _new_{name} SET {fk.parent.name} = NULL WHERE {orphan}')
+                conn.exec_driver_sql(f'DROP TABLE {name}')
+                conn.exec_driver_sql(f'ALTER TABLE _new_{name} RENAME TO {name}')
+                for sql in indexes:
+                    conn.exec_driver_sql(sql)
+            conn.exec_driver_sql('COMMIT')
+        except Exception:
+            conn.exec_driver_sql('ROLLBACK')
+            raise
+        finally:
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
@@ -0,0 +1,291 @@
+"""
+Contact de-duplication.
+
+Every contact gets a handful of blocking keys (normalized email, phone
+digits, phonetic and token-set name keys) stored in ``contact_match_keys``.
+Only contacts sharing a key are compared, so finding duplicates scales with
+the size of the blocks rather than the square of the contact count.
+"""
+import re
+from datetime import datetime
+from difflib import SequenceMatcher
+from sqlalchemy import event
+from crm.db import db
+from crm.jobs import job_handler
+from crm.models import (Contact, ContactMatchKey, DismissedDuplicate, PropertyOwner,
+                        DealContactRole, Touchpoint, Task)
+from crm.archive import reassign_contact
+from crm.graph import relationship_graph
+from crm.portfolio import refresh_portfolios
+
+# Blocks larger than this (e.g. a very common surname) are skipped
+MAX_BLOCK_SIZE = 100
+
+# Pairs scoring below this are not reported
+MIN_SCORE = 0.5
+
+# Candidates examined when checking a single new contact
+MAX_CANDIDATES = 25
+
+_NAME_NOISE = {'mr', 'mrs', 'ms', 'dr', 'jr', 'sr', 'ii', 'iii', 'inc', 'llc', 'co', 'corp'}
+_SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(
+    ['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for c in letters}
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, strip punctuation and honorifics/suffixes."""
+    tokens = re.sub(r'[^a-z0-9 ]+', ' ', (name or '').lower()).split()
+    return ' '.join(t for t in tokens if t not in _NAME_NOISE)
+
+
+def normalize_email(email: str) -> str:
+    """Lowercase and trim an email address."""
+    return (email or '').strip().lower()
+
+
+def normalize_phone(phone: str) -> str:
+    """Digits only, last 10 so a leading country code does not matter."""
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-10:] if len(digits) >= 7 else ''
+
+
+def soundex(word: str) -> str:
+    """Classic four-character Soundex code."""
+    word = re.sub(r'[^a-z]', '', word.lower())
+    if not word:
+        return ''
+    code = word[0].upper()
+    last = _SOUNDEX_CODES.get(word[0], '')
+    for ch in word[1:]:
+        digit = _SOUNDEX_CODES.get(ch, '')
+        if digit != '0' and digit != last:
+            code += digit
+        if ch not in 'hw':
+            last = digit
+    return (code + '000')[:4]
+
+
+def blocking_keys(name: str, email: str, phone: str) -> set:
+    """Compute the blocking keys for one contact's fields."""
+    keys = set()
+    email = normalize_email(email)
+    if email:
+        keys.add(f'e:{email}')
+    phone = normalize_phone(phone)
+    if phone:
+        keys.add(f'p:{phone}')
+    tokens = normalize_name(name).split()
+    if tokens:
+        keys.add('t:' + ' '.join(sorted(tokens)))
+        # Phonetic surname plus first initial catches spelling variants
+        keys.add(f'n:{soundex(tokens[-1])}{tokens[0][0]}')
+    return {k[:220] for k in keys}
+
+
+def score_pair(a, b) -> float:
+    """Score how likely two contacts (rows with name/email/phone/company) match."""
+    score = 0.5 * SequenceMatcher(None, normalize_name(a.name), normalize_name(b.name)).ratio()
+    if normalize_email(a.email) and normalize_email(a.email) == normalize_email(b.email):
+        score += 0.35
+    if normalize_phone(a.phone) and normalize_phone(a.phone) == normalize_phone(b.phone):
+        score += 0.25
+    if a.company and b.company and a.company.strip().lower() == b.company.strip().lower():
+        score += 0.1
+    return min(score, 1.0)
+
+
+def _write_keys(connection, contact_id: int, name, email, phone):
+    """Replace a contact's keys using the given connection."""
+    table = ContactMatchKey.__table__
+    connection.execute(table.delete().where(table.c.contact_id == contact_id))
+    keys = blocking_keys(name, email, phone)
+    if keys:
+        connection.execute(table.insert(), [{'contact_id': contact_id, 'key': k} for k in keys])
+
+
+@event.listens_for(Contact, 'after_insert')
+@event.listens_for(Contact, 'after_update')
+def _index_contact(mapper, connection, contact):
+    """Keep blocking keys current for ORM writes."""
+    _write_keys(connection, contact.id, contact.name, contact.email, contact.phone)
+
+
+@event.listens_for(Contact, 'after_delete')
+def _unindex_contact(mapper, connection, contact):
+    """Remove keys of a deleted contact (SQLite does not enforce FK cascades)."""
+    table = ContactMatchKey.__table__
+    connection.execute(table.delete().where(table.c.contact_id == contact.id))
+
+
+def index_contacts(contact_ids: list):
+    """Refresh keys for contacts written outside the ORM (bulk inserts, upserts)."""
+    if not contact_ids:
+        return
+    rows = db.session.execute(
+        db.select(Contact.id, Contact.name, Contact.email, Contact.phone).where(Contact.id.in_(contact_ids))
+    ).all()
+    connection = db.session.connection()
+    for row in rows:
+        _write_keys(connection, row.id, row.name, row.email, row.phone)
+
+
+@job_handler('rebuild_match_keys')
+def rebuild_match_keys_job(params: dict) -> dict:
+    """Background wrapper around rebuild_match_keys."""
+    return {'message': f'Indexed {rebuild_match_keys()} duplicate-matching keys.'}
+
+
+def rebuild_match_keys() -> int:
+    """Recompute every contact's blocking keys. Returns the number of keys."""
+    table = ContactMatchKey.__table__
+    db.session.execute(table.delete())
+    keys = []
+    for row in db.session.execute(db.select(Contact.id, Contact.name, Contact.email, Contact.phone)):
+        keys.extend({'contact_id': row.id, 'key': k} for k in blocking_keys(row.name, row.email, row.phone))
+    if keys:
+        db.session.execute(table.insert(), keys)
+    db.session.commit()
+    return len(keys)
+
+
+def _load_contacts(ids) -> dict:
+    """Load the fields used for scoring, keyed by id."""
+    rows = {}
+    ids = list(ids)
+    for start in range(0, len(ids), 500):
+        for row in db.session.execute(
+            db.select(Contact.id, Contact.name, Contact.company, Contact.email, Contact.phone)
+            .where(Contact.id.in_(ids[start:start + 500]))
+        ):
+            rows[row.id] = row
+    return rows
+
+
+def _dismissed_pairs() -> set:
+    """Pairs (low_id, high_id) users marked as not duplicates."""
+    return set(db.session.execute(db.select(DismissedDuplicate.contact_id, DismissedDuplicate.other_id)).all())
+
+
+def find_duplicates(limit: int = 200) -> list:
+    """Return suspected duplicate pairs as (score, contact_a, contact_b), best first."""
+    a = ContactMatchKey.__table__.alias('a')
+    b = ContactMatchKey.__table__.alias('b')
+    small_blocks = (
+        db.select(ContactMatchKey.key)
+        .group_by(ContactMatchKey.key)
+        .having(db.func.count() > 1, db.func.count() <= MAX_BLOCK_SIZE)
+    )
+    pairs = set(db.session.execute(
+        db.select(a.c.contact_id, b.c.contact_id)
+        .join(b, db.and_(a.c.key == b.c.key, a.c.contact_id < b.c.contact_id))
+        .where(a.c.key.in_(small_blocks))
+    ).all())
+    pairs -= _dismissed_pairs()
+
+    contacts = _load_contacts({cid for pair in pairs for cid in pair})
+    scored = []
+    for left, right in pairs:
+        score = score_pair(contacts[left], contacts[right])
+        if score >= MIN_SCORE:
+            scored.append((score, contacts[left], contacts[right]))
+    scored.sort(key=lambda item: (-item[0], item[1].id, item[2].id))
+    return scored[:limit]
+
+
+def find_candidates(contact_id: int) -> list:
+    """Return likely duplicates of one contact in bounded time, best first."""
+    keys = db.select(ContactMatchKey.key).where(ContactMatchKey.contact_id == contact_id)
+    candidate_ids = db.session.execute(
+        db.select(ContactMatchKey.contact_id)
+        .where(ContactMatchKey.key.in_(keys), ContactMatchKey.contact_id != contact_id)
+        .distinct()
+        .limit(MAX_CANDIDATES)
+    ).scalars().all()
+    if not candidate_ids:
+        return []
+
+    contacts = _load_contacts(candidate_ids + [contact_id])
+    me = contacts[contact_id]
+    dismissed = _dismissed_pairs()
+    scored = []
+    for cid in candidate_ids:
+        if (min(cid, contact_id), max(cid, contact_id)) in dismissed:
+            continue
+        score = score_pair(me, contacts[cid])
+        if score >= MIN_SCORE:
+            scored.append((score, contacts[cid]))
+    scored.sort(key=lambda item: -item[0])
+    return scored
+
+
+def dismiss_pair(contact_id: int, other_id: int):
+    """Record that two contacts are not duplicates."""
+    low, high = sorted((contact_id, other_id))
+    if not db.session.get(DismissedDuplicate, (low, high)):
+        db.session.add(DismissedDuplicate(contact_id=low, other_id=high))
+    db.session.commit()
+
+
+def merge_contacts(keep_id: int, merge_id: int):
+    """Fold merge_id into keep_id with set-based UPDATEs, then delete it."""
+    if keep_id == merge_id:
+        raise ValueError('Cannot merge a contact into itself')
+    keep = db.session.get(Contact, keep_id)
+    merged = db.session.get(Contact, merge_id)
+    if keep is None or merged is None:
+        raise ValueError('Contact not found')
+
+    # Drop ownerships that would duplicate ones the kept contact already has
+    kept_properties = db.select(PropertyOwner.property_id).where(PropertyOwner.contact_id == keep_id)
+    db.session.execute(
+        db.delete(PropertyOwner)
+        .where(PropertyOwner.contact_id == merge_id, PropertyOwner.property_id.in_(kept_properties))
+        .execution_options(synchronize_session=False)
+    )
+    # Likewise deal roles on deals the kept contact is already on
+    kept_deals = db.select(DealContactRole.deal_id).where(DealContactRole.contact_id == keep_id)
+    db.session.execute(
+        db.delete(DealContactRole)
+        .where(DealContactRole.contact_id == merge_id, DealContactRole.deal_id.in_(kept_deals))
+        .execution_options(synchronize_session=False)
+    )
+    # And imported emails both contacts were on
+    kept_messages = db.select(Touchpoint.message_id).where(
+        Touchpoint.contact_id == keep_id, Touchpoint.message_id.isnot(None))
+    db.session.execute(
+        db.delete(Touchpoint)
+        .where(Touchpoint.contact_id == merge_id, Touchpoint.message_id.in_(kept_messages))
+        .execution_options(synchronize_session=False)
+    )
+    now = datetime.utcnow()
+    for model in (PropertyOwner, DealContactRole, Touchpoint, Task):
+        db.session.execute(
+            db.update(model).where(model.contact_id == merge_id).values(contact_id=keep_id, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    reassign_contact(merge_id, keep_id)
+
+    # Fill gaps on the kept contact from the merged one
+    for field in ('company', 'role_type', 'phone', 'email', 'external_id'):
+        if not getattr(keep, field) and getattr(merged, field):
+            value = getattr(merged, field)
+            if field == 'external_id':
+                merged.external_id = None
+                db.session.flush()
+            setattr(keep, field, value)
+    if merged.notes:
+        keep.notes = f'{keep.notes}\n\n{merged.notes}' if keep.notes else merged.notes
+    if merged.tags:
+        tags = [t.strip() for t in (keep.tags or '').split(',') if t.strip()]
+        tags += [t.strip() for t in merged.tags.split(',') if t.strip() and t.strip() not in tags]
+        keep.tags = ', '.join(tags)
+
+    table = Contact.__table__
+    db.session.execute(DismissedDuplicate.__table__.delete().where(
+        db.or_(DismissedDuplicate.contact_id == merge_id, DismissedDuplicate.other_id == merge_id)))
+    db.session.execute(ContactMatchKey.__table__.delete().where(ContactMatchKey.contact_id == merge_id))
+    db.session.expunge(merged)
+    db.session.execute(table.delete().where(table.c.id == merge_id))
+    refresh_portfolios([keep_id, merge_id])
+    db.session.commit()
+    relationship_graph.invalidate()
@@ -0,0 +1,67 @@
+"""
+Set-based deletion of contacts, properties and deals.
+
+Related rows (ownerships, deal roles, touchpoints, tasks, deals of a
+property) are removed by the database's ON DELETE rules, so deleting any
+number of records costs one DELETE per chunk of ids instead of loading and
+deleting every child through the ORM. Derived data kept outside those
+foreign keys is refreshed here.
+"""
+from crm.comps import comps_index
+from crm.db import db
+from crm.geo import geocode_properties
+from crm.graph import relationship_graph
+from crm.models import Contact, Deal, Property, PropertyOwner
+from crm.portfolio import refresh_portfolios
+
+DELETABLE_MODELS = {
+    'contacts': Contact,
+    'properties': Property,
+    'deals': Deal,
+}
+
+# Ids per DELETE statement; keeps IN lists under SQLite limits
+CHUNK_SIZE = 500
+
+
+def _linked(column, key, ids: list) -> list:
+    """Distinct PropertyOwner column values for rows whose key is in ids."""
+    found = set()
+    for start in range(0, len(ids), CHUNK_SIZE):
+        found.update(db.session.execute(
+            db.select(column).where(key.in_(ids[start:start + CHUNK_SIZE]))
+        ).scalars())
+    return list(found)
+
+
+def delete_records(model, ids) -> int:
+    """Delete records of one model by id and commit. Returns rows deleted."""
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return 0
+
+    # Capture ownership links before the cascade removes them
+    if model is Contact:
+        touched_properties = _linked(PropertyOwner.property_id, PropertyOwner.contact_id, ids)
+    elif model is Property:
+        touched_contacts = _linked(PropertyOwner.contact_id, PropertyOwner.property_id, ids)
+
+    deleted = 0
+    for start in range(0, len(ids), CHUNK_SIZE):
+        deleted += db.session.execute(
+            db.delete(model).where(model.id.in_(ids[start:start + CHUNK_SIZE]))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    # Co-owners' shares change when an owner or property disappears
+    if model is Contact:
+        refresh_portfolios(property_ids=touched_properties)
+    elif model is Property:
+        refresh_portfolios(contact_ids=touched_contacts)
+        for property_id in ids:
+            comps_index.mark_dirty(property_id)
+        geocode_properties(ids)  # Drops R*Tree entries; commits
+    db.session.commit()
+    db.session.expire_all()
+    relationship_graph.invalidate()
+    return deleted
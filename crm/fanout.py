@@ -0,0 +1,78 @@
+"""
+Concurrent independent read queries.
+
+On a networked database each query of a page pays a full round trip, so a
+view running five small queries one after another waits for five round
+trips. ``fan_out`` runs independent read-only callables at the same time,
+each on its own pooled connection inside its own application context, and
+the view waits only for the slowest one.
+
+ORM objects returned from a worker thread are merged into the caller's
+session without reloading them, so templates can use them as usual.
+SQLite is in-process with no round trip to hide, so there the callables
+simply run one after another on the calling thread.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Flask, current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import InstanceState
+from crm.db import db, REPLICA_KEY
+
+# Worker threads per process; bounds the extra pooled connections fan-out uses
+FANOUT_WORKERS = int(os.environ.get('QUERY_FANOUT_WORKERS', 4))
+
+_executor = None
+
+
+def _start_executor():
+    global _executor
+    _executor = ThreadPoolExecutor(max_workers=max(FANOUT_WORKERS, 1), thread_name_prefix='crm-fanout')
+
+
+_start_executor()
+# Preforking servers copy this process without its threads
+os.register_at_fork(after_in_child=_start_executor)
+
+
+def _concurrent() -> bool:
+    return FANOUT_WORKERS > 0 and db.engine.dialect.name != 'sqlite'
+
+
+def _run(app: Flask, query, replica):
+    with app.app_context():
+        if replica is not None:
+            # Read from the same replica as the request
+            db.session.info[REPLICA_KEY] = replica
+        return query()
+
+
+def _attach(value):
+    """Merge ORM objects (also inside lists and tuples) into the current session."""
+    if isinstance(value, (list, tuple)):
+        return type(value)(_attach(v) for v in value)
+    if isinstance(inspect(value, raiseerr=False), InstanceState):
+        return db.session.merge(value, load=False)
+    return value
+
+
+def fan_out(*queries) -> list:
+    """Run independent read-only callables concurrently; return their results in order.
+
+    The first callable runs on the calling thread with the request's own
+    session, so put the query returning the most ORM objects first. Other
+    callables must not write or rely on ``g``/``request``; load the
+    relationships a template needs eagerly, since merged objects do not
+    share the worker's session. Exceptions (including ``abort``) propagate.
+    """
+    if len(queries) < 2 or not _concurrent():
+        return [query() for query in queries]
+    app = current_app._get_current_object()
+    replica = db.session.info.get(REPLICA_KEY)
+    futures = [_executor.submit(_run, app, query, replica) for query in queries[1:]]
+    try:
+        first = queries[0]()
+    finally:
+        # Never leave workers running past the request, even if the first query failed
+        wait(futures)
+    return [first] + [_attach(future.result()) for future in futures]
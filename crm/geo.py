@@ -0,0 +1,211 @@
+"""
+Offline geocoding and spatial lookups for properties.
+
+Coordinates come from the bundled ZIP centroid file (``crm/data``), so no
+network access is needed. Radius and bounding-box searches go through a
+SQLite R*Tree when available and fall back to a (latitude, longitude)
+btree index elsewhere (e.g. Postgres without PostGIS). Exact distances are
+computed only for the candidates inside the bounding box.
+"""
+import csv
+import gzip
+import math
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import event, text
+from crm.db import db
+from crm.models import Property
+
+ZIP_CENTROIDS_PATH = os.path.join(os.path.dirname(__file__), 'data', 'zip_centroids.csv.gz')
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.0
+
+_zip_lock = threading.Lock()
+_zip_centroids = None
+_rtree_by_url = {}  # Engine URL -> whether property_rtree exists
+
+
+def _centroids() -> dict:
+    """Load ZIP -> (lat, lon) once per process."""
+    global _zip_centroids
+    if _zip_centroids is None:
+        with _zip_lock:
+            if _zip_centroids is None:
+                with gzip.open(ZIP_CENTROIDS_PATH, 'rt', newline='') as f:
+                    _zip_centroids = {row['zip']: (float(row['lat']), float(row['lon']))
+                                      for row in csv.DictReader(f)}
+    return _zip_centroids
+
+
+def geocode_zip(zip_code: str):
+    """Return (lat, lon) for a US ZIP code (ZIP+4 allowed), or None."""
+    if not zip_code:
+        return None
+    digits = ''.join(ch for ch in zip_code if ch.isdigit())[:5]
+    if len(digits) != 5:
+        return None
+    return _centroids().get(digits)
+
+
+def haversine_miles(lat1, lon1, lat2, lon2) -> float:
+    """Great-circle distance between two points in miles."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlam = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+def bounding_box(lat: float, lon: float, miles: float) -> tuple:
+    """Return (min_lat, min_lon, max_lat, max_lon) enclosing a radius."""
+    dlat = miles / MILES_PER_DEGREE_LAT
+    dlon = miles / (MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def _has_rtree(connection) -> bool:
+    """Check if the property R*Tree exists on this (SQLite) database."""
+    if connection.dialect.name != 'sqlite':
+        return False
+    url = str(connection.engine.url)
+    if url not in _rtree_by_url:
+        _rtree_by_url[url] = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'property_rtree'"
+        )).first() is not None
+    return _rtree_by_url[url]
+
+
+def ensure_spatial_index(engine):
+    """Create the SQLite R*Tree (if supported) and backfill coordinates."""
+    if engine.dialect.name == 'sqlite':
+        try:
+            with engine.connect() as conn:
+                conn.execute(text(
+                    'CREATE VIRTUAL TABLE IF NOT EXISTS property_rtree '
+                    'USING rtree(id, min_lat, max_lat, min_lon, max_lon)'
+                ))
+                conn.commit()
+            _rtree_by_url.pop(str(engine.url), None)
+        except Exception as e:
+            # SQLite built without the R*Tree module; the btree index is used instead
+            print(f"Note: R*Tree unavailable, using btree bounding boxes: {e}")
+
+    try:
+        geocode_properties()
+    except Exception as e:
+        print(f"Note: Could not geocode properties: {e}")
+
+
+def geocode_properties(property_ids: list = None) -> int:
+    """Fill coordinates from ZIP codes and sync the R*Tree.
+
+    With no ids, processes every property missing coordinates (and seeds an
+    empty R*Tree). Used for backfills and rows written outside the ORM.
+    """
+    query = db.select(Property.id, Property.zip_code)
+    if property_ids is not None:
+        if not property_ids:
+            return 0
+        query = query.where(Property.id.in_(property_ids))
+    else:
+        query = query.where(Property.latitude.is_(None), Property.zip_code.isnot(None))
+
+    updates = []
+    for row in db.session.execute(query):
+        coords = geocode_zip(row.zip_code) or (None, None)
+        updates.append({'pid': row.id, 'latitude': coords[0], 'longitude': coords[1]})
+    if updates:
+        table = Property.__table__
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('pid'))
+            .values(latitude=db.bindparam('latitude'), longitude=db.bindparam('longitude'),
+                    updated_at=datetime.utcnow())
+            # Derived from zip_code, whose changes are audited
+            .execution_options(skip_audit=True),
+            updates
+        )
+
+    connection = db.session.connection()
+    if _has_rtree(connection):
+        if property_ids is None:
+            empty = connection.execute(text('SELECT 1 FROM property_rtree LIMIT 1')).first() is None
+            ids = None if empty else [u['pid'] for u in updates]
+        else:
+            ids = property_ids
+        _sync_rtree(connection, ids)
+    db.session.commit()
+    return len(updates)
+
+
+def _sync_rtree(connection, property_ids=None):
+    """Copy coordinates into the R*Tree for the given ids (or all)."""
+    if property_ids is not None and not property_ids:
+        return
+    table = Property.__table__
+    query = db.select(table.c.id, table.c.latitude, table.c.longitude)
+    if property_ids is not None:
+        query = query.where(table.c.id.in_(property_ids))
+        connection.execute(text('DELETE FROM property_rtree WHERE id IN ({})'.format(
+            ','.join(str(int(pid)) for pid in property_ids))))
+    rows = [{'id': r.id, 'lat': r.latitude, 'lon': r.longitude}
+            for r in connection.execute(query) if r.latitude is not None]
+    if rows:
+        connection.execute(text(
+            'INSERT OR REPLACE INTO property_rtree VALUES (:id, :lat, :lat, :lon, :lon)'
+        ), rows)
+
+
+@event.listens_for(Property, 'before_insert')
+@event.listens_for(Property, 'before_update')
+def _geocode_property(mapper, connection, prop):
+    """Derive coordinates from the ZIP code on every ORM write."""
+    coords = geocode_zip(prop.zip_code) or (None, None)
+    prop.latitude, prop.longitude = coords
+
+
+@event.listens_for(Property, 'after_insert')
+@event.listens_for(Property, 'after_update')
+def _index_property(mapper, connection, prop):
+    """Keep the R*Tree entry in step with ORM writes."""
+    if _has_rtree(connection):
+        connection.execute(text('DELETE FROM property_rtree WHERE id = :id'), {'id': prop.id})
+        if prop.latitude is not None:
+            connection.execute(text(
+                'INSERT INTO property_rtree VALUES (:id, :lat, :lat, :lon, :lon)'
+            ), {'id': prop.id, 'lat': prop.latitude, 'lon': prop.longitude})
+
+
+@event.listens_for(Property, 'after_delete')
+def _unindex_property(mapper, connection, prop):
+    """Drop the R*Tree entry of a deleted property."""
+    if _has_rtree(connection):
+        connection.execute(text('DELETE FROM property_rtree WHERE id = :id'), {'id': prop.id})
+
+
+def properties_in_bbox(min_lat, min_lon, max_lat, max_lon) -> list:
+    """Return (id, latitude, longitude) rows inside a bounding box."""
+    connection = db.session.connection()
+    if _has_rtree(connection):
+        return connection.execute(text(
+            'SELECT p.id, p.latitude, p.longitude FROM property_rtree r '
+            'JOIN properties p ON p.id = r.id '
+            'WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat '
+            'AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon'
+        ), {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon}).all()
+    return db.session.execute(
+        db.select(Property.id, Property.latitude, Property.longitude)
+        .where(Property.latitude.between(min_lat, max_lat),
+               Property.longitude.between(min_lon, max_lon))
+    ).all()
+
+
+def properties_within_radius(lat: float, lon: float, miles: float) -> dict:
+    """Return {property_id: distance_miles} for properties within a radius."""
+    found = {}
+    for row in properties_in_bbox(*bounding_box(lat, lon, miles)):
+        distance = haversine_miles(lat, lon, row.latitude, row.longitude)
+        if distance <= miles:
+            found[row.id] = distance
+    return found
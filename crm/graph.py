@@ -0,0 +1,272 @@
+"""
+In-memory relationship graph over contacts, properties and deals.
+
+Edges come from ``property_owners`` (contact-property), ``deal_contact_roles``
+(contact-deal) and ``deals.property_id`` (deal-property). The adjacency is
+held CSR-style in two integer arrays (row offsets and neighbour targets) so
+a breadth-first search touches no database rows. Committed ORM writes are
+applied as an overlay of edge deltas; the arrays are rebuilt when the
+overlay grows large or another process changed the tables.
+"""
+import threading
+import time
+from array import array
+from collections import Counter, deque
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from crm.db import db
+from crm.models import Deal, DealContactRole, PropertyOwner
+
+NODE_KINDS = ('contacts', 'properties', 'deals')
+
+# Junction models and the (kind, column) pairs their rows connect
+EDGE_SOURCES = (
+    (PropertyOwner, ('contacts', 'contact_id'), ('properties', 'property_id')),
+    (DealContactRole, ('contacts', 'contact_id'), ('deals', 'deal_id')),
+    (Deal, ('deals', 'id'), ('properties', 'property_id')),
+)
+
+# Upper bounds that keep a single query cheap
+MAX_HOPS = 4
+MAX_NODES = 5000
+
+# Overlay edge changes tolerated before the arrays are rebuilt
+COMPACT_AFTER = 2000
+
+# Seconds between checks for writes made by other processes
+SYNC_SECONDS = 5.0
+
+
+class RelationshipGraph:
+    """CSR adjacency with an overlay for recent edge changes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = {}  # (kind, id) -> node number
+        self._nodes = []  # node number -> (kind, id)
+        self._offsets = array('l', [0])
+        self._targets = array('l')
+        self._delta = Counter()  # (node, node) -> multiplicity change since the build
+        self._overlay = {}  # node -> neighbours with a pending delta
+        self._loaded = False
+        self._signature = None
+        self._last_sync = 0.0
+
+    def invalidate(self):
+        """Force a rebuild on the next query (after set-based writes)."""
+        with self._lock:
+            self._loaded = False
+
+    def apply(self, changes: list):
+        """Apply committed edge changes: [(+1 or -1, (kind, id), (kind, id))]."""
+        with self._lock:
+            if not self._loaded:
+                return
+            for sign, a, b in changes:
+                u, v = self._node(a), self._node(b)
+                for x, y in ((u, v), (v, u)):
+                    self._delta[(x, y)] += sign
+                    self._overlay.setdefault(x, set()).add(y)
+            if len(self._delta) > COMPACT_AFTER:
+                self._loaded = False
+
+    def _node(self, key) -> int:
+        """Node number for a (kind, id) key, allocating one if new."""
+        node = self._index.get(key)
+        if node is None:
+            node = self._index[key] = len(self._nodes)
+            self._nodes.append(key)
+        return node
+
+    def _rebuild(self):
+        """Load every edge and pack the adjacency into arrays."""
+        self._index, self._nodes = {}, []
+        edges = []
+        for model, (kind_a, col_a), (kind_b, col_b) in EDGE_SOURCES:
+            a, b = getattr(model, col_a), getattr(model, col_b)
+            for left, right in db.session.execute(db.select(a, b).where(a.isnot(None), b.isnot(None))):
+                edges.append((self._node((kind_a, left)), self._node((kind_b, right))))
+
+        # Counting sort by source node
+        degree = array('l', [0]) * (len(self._nodes) + 1)
+        for u, v in edges:
+            degree[u + 1] += 1
+            degree[v + 1] += 1
+        for i in range(1, len(degree)):
+            degree[i] += degree[i - 1]
+        offsets = array('l', degree)
+        targets = array('l', [0]) * (2 * len(edges))
+        fill = array('l', degree)
+        for u, v in edges:
+            targets[fill[u]] = v
+            fill[u] += 1
+            targets[fill[v]] = u
+            fill[v] += 1
+
+        self._offsets, self._targets = offsets, targets
+        self._delta.clear()
+        self._overlay.clear()
+        self._signature = self._current_signature()
+        self._loaded = True
+
+    def _current_signature(self) -> tuple:
+        """Cheap fingerprint of the edge tables (counts and id sums)."""
+        parts = []
+        for model, (_, col_a), (_, col_b) in EDGE_SOURCES:
+            a, b = getattr(model, col_a), getattr(model, col_b)
+            parts.extend([
+                db.select(db.func.count()).select_from(model).scalar_subquery(),
+                db.select(db.func.sum(a)).scalar_subquery(),
+                db.select(db.func.sum(b)).scalar_subquery(),
+            ])
+        return tuple(db.session.execute(db.select(*parts)).one())
+
+    def _sync(self):
+        """Rebuild when stale or when another process changed the edges."""
+        if self._loaded and time.monotonic() - self._last_sync >= SYNC_SECONDS:
+            self._last_sync = time.monotonic()
+            if self._current_signature() != self._signature:
+                self._loaded = False
+        if not self._loaded:
+            self._rebuild()
+            self._last_sync = time.monotonic()
+
+    def _neighbors(self, node: int):
+        """Neighbour node numbers, with overlay changes applied."""
+        base = self._targets[self._offsets[node]:self._offsets[node + 1]] if node + 1 < len(self._offsets) else ()
+        pending = self._overlay.get(node)
+        if not pending:
+            return base
+        counts = Counter(base)
+        for other in pending:
+            counts[other] += self._delta[(node, other)]
+        return [other for other, count in counts.items() if count > 0]
+
+    def _bfs(self, start: int, hops: int) -> dict:
+        """Distances from start to every node within the hop limit."""
+        distance = {start: 0}
+        queue = deque([start])
+        while queue and len(distance) <= MAX_NODES:
+            node = queue.popleft()
+            if distance[node] == hops:
+                continue
+            for other in self._neighbors(node):
+                if other not in distance:
+                    distance[other] = distance[node] + 1
+                    queue.append(other)
+        return distance
+
+    def neighborhood(self, kind: str, record_id: int, hops: int = 2, kinds=None) -> list:
+        """Return [((kind, id), hops)] reachable within the hop limit, nearest first."""
+        hops = max(1, min(hops, MAX_HOPS))
+        with self._lock:
+            self._sync()
+            start = self._index.get((kind, record_id))
+            if start is None:
+                return []
+            found = self._bfs(start, hops)
+            result = [(self._nodes[node], dist) for node, dist in found.items() if node != start]
+        if kinds:
+            result = [item for item in result if item[0][0] in kinds]
+        return sorted(result, key=lambda item: (item[1], item[0]))
+
+    def shortest_path(self, source: tuple, target: tuple, max_hops: int = 6) -> list:
+        """Return the (kind, id) nodes on a shortest path, or [] if none within max_hops."""
+        with self._lock:
+            self._sync()
+            start, goal = self._index.get(source), self._index.get(target)
+            if start is None or goal is None:
+                return []
+            if start == goal:
+                return [source]
+            parent = {start: None}
+            frontier = [start]
+            for _ in range(max_hops):
+                next_frontier = []
+                for node in frontier:
+                    for other in self._neighbors(node):
+                        if other in parent:
+                            continue
+                        parent[other] = node
+                        if other == goal:
+                            path = [other]
+                            while parent[path[-1]] is not None:
+                                path.append(parent[path[-1]])
+                            return [self._nodes[n] for n in reversed(path)]
+                        next_frontier.append(other)
+                if not next_frontier or len(parent) > MAX_NODES:
+                    break
+                frontier = next_frontier
+            return []
+
+    def related_contacts(self, contact_id: int, hops: int = 2, limit: int = 10) -> list:
+        """Return [(contact_id, hops, shared)] for contacts near a contact.
+
+        ``shared`` counts the properties and deals both contacts are linked
+        to directly (co-ownership, same deal).
+        """
+        hops = max(2, min(hops, MAX_HOPS))
+        with self._lock:
+            self._sync()
+            start = self._index.get(('contacts', contact_id))
+            if start is None:
+                return []
+            found = self._bfs(start, hops)
+            shared = Counter()
+            for middle in set(self._neighbors(start)):
+                for other in set(self._neighbors(middle)):
+                    if other != start:
+                        shared[other] += 1
+            result = [(self._nodes[node][1], dist, shared[node]) for node, dist in found.items()
+                      if node != start and self._nodes[node][0] == 'contacts']
+        result.sort(key=lambda item: (item[1], -item[2], item[0]))
+        return result[:limit]
+
+
+relationship_graph = RelationshipGraph()
+
+
+def _previous(obj, attr):
+    """Value of an attribute before this flush changed it."""
+    history = inspect(obj).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(obj, attr)
+
+
+def note_edge_changes(session, changes: list):
+    """Queue edge changes made with Core statements; applied on commit."""
+    if changes:
+        session.info.setdefault('graph_changes', []).extend(changes)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_edge_changes(session, flush_context):
+    """Record edge changes; they are applied to the graph on commit."""
+    changes = []
+    for obj in session.new | session.dirty | session.deleted:
+        for model, (kind_a, col_a), (kind_b, col_b) in EDGE_SOURCES:
+            if not isinstance(obj, model):
+                continue
+            old = ((kind_a, _previous(obj, col_a)), (kind_b, _previous(obj, col_b)))
+            new = ((kind_a, getattr(obj, col_a)), (kind_b, getattr(obj, col_b)))
+            if obj in session.new:
+                changes.append((1,) + new)
+            elif obj in session.deleted:
+                changes.append((-1,) + old)
+            elif old != new:
+                changes.append((-1,) + old)
+                changes.append((1,) + new)
+    note_edge_changes(session, [c for c in changes if c[1][1] is not None and c[2][1] is not None])
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_edge_changes(session):
+    """Publish committed edge changes to the in-memory graph."""
+    changes = session.info.pop('graph_changes', None)
+    if changes:
+        relationship_graph.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_edge_changes(session):
+    """Forget edge changes from a rolled-back transaction."""
+    session.info.pop('graph_changes', None)
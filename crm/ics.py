@@ -0,0 +1,151 @@
+"""
+ICS calendar feeds of tasks.
+
+Each ``CalendarFeed`` has a secret token URL that calendar apps poll. A
+poll first runs one query that looks up the feed and reads the task
+version: the newest ``updated_at`` of tasks and of the contacts,
+properties and deals named in events, plus the newest tombstone id. All of
+these are index lookups. The version is the feed's ETag, so an unchanged
+feed answers 304 (or a cached body) without reading tasks. Otherwise events
+are streamed from an indexed (status, due_date) range query.
+"""
+import hashlib
+import os
+from datetime import date, datetime, timedelta
+from flask import url_for
+from crm.db import db
+from crm.models import CalendarFeed, Contact, Deal, Property, Task, TaskStatus, Tombstone
+from crm.templating import FragmentCache
+
+# Due-date window of the feed, relative to today
+PAST_DAYS = int(os.environ.get('CALENDAR_PAST_DAYS', 90))
+FUTURE_DAYS = int(os.environ.get('CALENDAR_FUTURE_DAYS', 365))
+
+# Rendered feed bodies kept per process, for clients that do not send If-None-Match
+BODY_CACHE_SIZE = 64
+
+# Events per streamed chunk
+CHUNK_EVENTS = 200
+
+FEED_STATUSES = (TaskStatus.OPEN.value, TaskStatus.SNOOZED.value)
+
+_bodies = FragmentCache(BODY_CACHE_SIZE)
+
+
+def _newest(column):
+    return db.select(db.func.max(column)).scalar_subquery()
+
+
+def lookup_feed(token: str):
+    """The feed's filters and ETag in one query, or None for an unknown token."""
+    row = db.session.execute(
+        db.select(CalendarFeed.id, CalendarFeed.name, CalendarFeed.contact_id, CalendarFeed.property_id,
+                  CalendarFeed.deal_id, _newest(Task.updated_at), _newest(Contact.updated_at),
+                  _newest(Property.updated_at), _newest(Deal.updated_at), _newest(Tombstone.id))
+        .where(CalendarFeed.token == token)
+    ).first()
+    if row is None:
+        return None
+    # The due-date window moves daily, so the date is part of the version too
+    version = ':'.join(str(value) for value in row[5:]) + f':{date.today()}'
+    etag = hashlib.sha1(f'{row.id}:{version}'.encode()).hexdigest()[:20]
+    return row, etag
+
+
+def cached_body(etag: str):
+    return _bodies.get(etag)
+
+
+def _escape(value: str) -> str:
+    """Escape a TEXT value (RFC 5545 3.3.11)."""
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line: str) -> str:
+    """Split a content line into 75-octet pieces joined by CRLF + space."""
+    if len(line.encode('utf-8')) <= 75:
+        return line + '\r\n'
+    pieces, current, size = [], '', 0
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > (75 if not pieces else 74):
+            pieces.append(current)
+            current, size = '', 0
+        current += char
+        size += width
+    pieces.append(current)
+    return '\r\n '.join(pieces) + '\r\n'
+
+
+def _event(task) -> str:
+    details = [f'Priority: {task.priority}'] if task.priority else []
+    if task.contact_name:
+        details.append(f'Contact: {task.contact_name}')
+    if task.property_name:
+        details.append(f'Property: {task.property_name}')
+    if task.deal_name:
+        details.append(f'Deal: {task.deal_name}')
+    if task.status == TaskStatus.SNOOZED.value and task.snoozed_until:
+        details.append(f"Snoozed until {task.snoozed_until.strftime('%m/%d/%Y')}")
+    stamp = task.updated_at or task.created_at or datetime.utcnow()
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:task-{task.id}@multifamily-crm',
+        f"DTSTAMP:{stamp.strftime('%Y%m%dT%H%M%SZ')}",
+        f"DTSTART;VALUE=DATE:{task.due_date.strftime('%Y%m%d')}",
+        f"DTEND;VALUE=DATE:{(task.due_date + timedelta(days=1)).strftime('%Y%m%d')}",
+        f'SUMMARY:{_escape(task.description)}',
+        f"DESCRIPTION:{_escape(chr(10).join(details))}",
+        f"URL:{url_for('tasks.edit', task_id=task.id, _external=True)}",
+        'END:VEVENT',
+    ]
+    return ''.join(_fold(line) for line in lines)
+
+
+def _task_rows(feed):
+    """Open and snoozed tasks due in the window, streamed in due-date order."""
+    today = date.today()
+    stmt = (
+        db.select(Task.id, Task.description, Task.due_date, Task.status, Task.priority, Task.snoozed_until,
+                  Task.updated_at, Task.created_at, Contact.name.label('contact_name'),
+                  db.func.coalesce(Property.name, Property.address).label('property_name'),
+                  Deal.deal_name)
+        .outerjoin(Contact, Contact.id == Task.contact_id)
+        .outerjoin(Property, Property.id == Task.property_id)
+        .outerjoin(Deal, Deal.id == Task.deal_id)
+        .where(Task.status.in_(FEED_STATUSES),
+               Task.due_date.between(today - timedelta(days=PAST_DAYS), today + timedelta(days=FUTURE_DAYS)))
+        .order_by(Task.due_date, Task.id)
+    )
+    for column, value in ((Task.contact_id, feed.contact_id), (Task.property_id, feed.property_id),
+                          (Task.deal_id, feed.deal_id)):
+        if value is not None:
+            stmt = stmt.where(column == value)
+    return db.session.execute(stmt.execution_options(yield_per=CHUNK_EVENTS))
+
+
+def render_feed(feed, etag: str):
+    """Yield the ICS document in chunks; the complete body is cached under ``etag``."""
+    parts = [''.join(_fold(line) for line in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Multifamily CRM//Tasks//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escape(feed.name)}',
+        'REFRESH-INTERVAL;VALUE=DURATION:PT15M',
+        'X-PUBLISHED-TTL:PT15M',
+    ))]
+    yield parts[0]
+    chunk = []
+    for task in _task_rows(feed):
+        chunk.append(_event(task))
+        if len(chunk) >= CHUNK_EVENTS:
+            parts.append(''.join(chunk))
+            yield parts[-1]
+            chunk = []
+    chunk.append(_fold('END:VCALENDAR'))
+    parts.append(''.join(chunk))
+    yield parts[-1]
+    _bodies.set(etag, ''.join(parts))
@@ -0,0 +1,279 @@
+"""
+Lightweight background job runner.
+
+Jobs are stored in the ``jobs`` table so their status can be polled from any
+worker process. Work runs on a small thread pool inside the web process.
+Status polls only read: a watchdog thread in each process heartbeats the
+jobs that process is running, fails RUNNING jobs whose worker stopped
+heartbeating (it died mid-job), and hands jobs left QUEUED (their process
+died before a pool thread took them) to its own pool.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import text
+from crm.db import db, write_lock
+from crm.models import Job, JobStatus
+
+# Seconds between heartbeats of running jobs (and watchdog passes)
+HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', 15))
+
+# RUNNING jobs without a heartbeat for this long have lost their process
+STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', HEARTBEAT_SECONDS * 4))
+
+# Seconds a job may sit QUEUED before any process's watchdog picks it up
+PICKUP_AFTER_SECONDS = 30
+
+_handlers = {}
+_executor = None
+_app = None
+_defer_to_workers = False
+# Job ids this process has submitted to its pool, and those it is running
+_submitted = set()
+_running = set()
+_jobs_lock = threading.Lock()
+
+
+def job_handler(kind: str):
+    """Register a function as the handler for a job kind.
+
+    Handlers receive the decoded params dict and return a dict with any of
+    ``message``, ``data``, ``filename`` and ``mimetype``.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def init_jobs(app: Flask):
+    """Start the worker pool and the periodic maintenance scheduler."""
+    global _app
+    _app = app
+    # Preforking servers copy this process without its threads; each worker gets its own pool
+    os.register_at_fork(after_in_child=lambda: _start_executor(app))
+
+    # Import modules that register handlers
+    import crm.routes.backup  # noqa: F401
+    import crm.dedupe  # noqa: F401
+    import crm.portfolio  # noqa: F401
+    import crm.archive  # noqa: F401
+    import crm.activity  # noqa: F401
+    import crm.changes  # noqa: F401
+    import crm.mail  # noqa: F401
+
+    if not _defer_to_workers:
+        start_runner()
+
+
+def defer_to_workers():
+    """Run no jobs in this process (a preloading master); its forked workers call start_runner()."""
+    global _defer_to_workers
+    _defer_to_workers = True
+
+
+def start_runner():
+    """Pick up jobs left in the queue, start the watchdog and schedule maintenance in this process."""
+    if _executor is None:
+        _start_executor(_app)
+    with _app.app_context():
+        try:
+            pending = db.session.execute(
+                db.select(Job.id).where(Job.status == JobStatus.QUEUED.value)
+            ).scalars().all()
+        except Exception as e:
+            print(f"Note: Could not load pending jobs: {e}")
+            pending = []
+    # Every worker submits them; the atomic claim in run_job runs each once
+    _submit(pending)
+    threading.Thread(target=_watchdog_loop, args=(_app,), name='crm-job-watchdog', daemon=True).start()
+
+    interval_hours = float(os.environ.get('MAINTENANCE_INTERVAL_HOURS', 24))
+    if interval_hours > 0:
+        thread = threading.Thread(target=_maintenance_loop, args=(_app, interval_hours),
+                                  name='crm-maintenance', daemon=True)
+        thread.start()
+
+
+def enqueue(kind: str, **params) -> Job:
+    """Persist a job and hand it to the worker pool. Returns immediately."""
+    if kind not in _handlers:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job = Job(kind=kind, status=JobStatus.QUEUED.value, params=json.dumps(params))
+    db.session.add(job)
+    db.session.commit()
+    _submit([job.id])
+    return job
+
+
+def _submit(job_ids: list):
+    """Hand jobs to this process's pool, skipping ones it already holds."""
+    if _executor is None:
+        return
+    with _jobs_lock:
+        new = [job_id for job_id in job_ids if job_id not in _submitted]
+        _submitted.update(new)
+    for job_id in new:
+        _executor.submit(_run_in_context, job_id)
+
+
+def _worker_name() -> str:
+    """Identifies the process that claimed a job."""
+    return f'{socket.gethostname()}:{os.getpid()}'[:100]
+
+
+def recover_stalled_jobs() -> int:
+    """Heartbeat this process's jobs, fail ones whose worker died and pick up unclaimed ones.
+
+    Commits. Returns the number of jobs failed.
+    """
+    now = datetime.utcnow()
+    with _jobs_lock:
+        running = list(_running)
+    with write_lock():
+        if running:
+            db.session.execute(db.update(Job).where(Job.id.in_(running)).values(heartbeat_at=now))
+        # Jobs claimed before heartbeats existed have only started_at
+        failed = db.session.execute(
+            db.update(Job)
+            .where(Job.status == JobStatus.RUNNING.value,
+                   db.func.coalesce(Job.heartbeat_at, Job.started_at) < now - timedelta(seconds=STALE_SECONDS))
+            .values(status=JobStatus.FAILED.value, finished_at=now,
+                    message='Interrupted: the process running this job stopped before it finished.')
+        ).rowcount
+        db.session.commit()
+    pending = db.session.execute(
+        db.select(Job.id).where(Job.status == JobStatus.QUEUED.value,
+                                Job.created_at < now - timedelta(seconds=PICKUP_AFTER_SECONDS))
+    ).scalars().all()
+    _submit(pending)
+    return failed
+
+
+def run_job(job_id: int):
+    """Claim and execute a job. No-op if another worker already claimed it."""
+    # Atomic claim so multiple workers never run the same job twice
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        db.update(Job)
+        .where(Job.id == job_id, Job.status == JobStatus.QUEUED.value)
+        .values(status=JobStatus.RUNNING.value, started_at=now, heartbeat_at=now, claimed_by=_worker_name())
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return
+
+    with _jobs_lock:
+        _running.add(job_id)
+    try:
+        _execute(job_id)
+    finally:
+        with _jobs_lock:
+            _running.discard(job_id)
+
+
+def _execute(job_id: int):
+    """Run the handler of a claimed job and record its outcome."""
+    job = db.session.get(Job, job_id)
+    try:
+        handler = _handlers[job.kind]
+        outcome = handler(json.loads(job.params or '{}')) or {}
+        job.message = outcome.get('message')
+        job.result = outcome.get('data')
+        job.result_filename = outcome.get('filename')
+        job.result_mimetype = outcome.get('mimetype')
+        job.status = JobStatus.DONE.value
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.status = JobStatus.FAILED.value
+        job.message = f'{type(e).__name__}: {e}'
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def _start_executor(app: Flask):
+    """Create the job worker pool."""
+    global _executor
+    # A forked child inherits the sets but none of the threads behind them
+    _submitted.clear()
+    _running.clear()
+    workers = int(os.environ.get('JOB_WORKERS', app.config.get('JOB_WORKERS', 2)))
+    _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crm-job')
+
+
+def _run_in_context(job_id: int):
+    """Executor entry point: run a job inside an application context."""
+    with _app.app_context():
+        try:
+            run_job(job_id)
+        except Exception as e:
+            print(f"Job {job_id} crashed: {e}")
+        finally:
+            db.session.remove()
+            with _jobs_lock:
+                _submitted.discard(job_id)
+
+
+def _watchdog_loop(app: Flask):
+    """Run recover_stalled_jobs() every HEARTBEAT_SECONDS."""
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        with app.app_context():
+            try:
+                failed = recover_stalled_jobs()
+                if failed:
+                    print(f"Note: Failed {failed} jobs whose worker stopped responding")
+            except Exception as e:
+                print(f"Note: Could not check for stalled jobs: {e}")
+            finally:
+                db.session.remove()
+
+
+def _maintenance_loop(app: Flask, interval_hours: float):
+    """Enqueue database maintenance once per interval across all workers."""
+    interval = timedelta(hours=interval_hours)
+    while True:
+        with app.app_context():
+            try:
+                # Workers start together; on SQLite the lock lets only one of them enqueue
+                with write_lock():
+                    last = db.session.execute(
+                        db.select(db.func.max(Job.created_at)).where(Job.kind == 'maintenance')
+                    ).scalar()
+                    if last is None or datetime.utcnow() - last >= interval:
+                        enqueue('maintenance')
+                    db.session.commit()
+            except Exception as e:
+                print(f"Note: Could not schedule maintenance: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(min(interval.total_seconds(), 3600))
+
+
+@job_handler('maintenance')
+def maintenance(params: dict) -> dict:
+    """Archive old touchpoints and prune tombstones, then refresh statistics and reclaim space (VACUUM/ANALYZE)."""
+    # Archival and pruning first so VACUUM reclaims the pages they free
+    archive = _handlers.get('archive_touchpoints')
+    archived = archive({}) if archive else {}
+    prune = _handlers.get('prune_tombstones')
+    pruned = prune({}) if prune else {}
+    engine = db.engine
+    # VACUUM cannot run inside a transaction on either SQLite or Postgres
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if engine.dialect.name == 'sqlite':
+            conn.execute(text('VACUUM'))
+            conn.execute(text('ANALYZE'))
+        else:
+            conn.execute(text('VACUUM ANALYZE'))
+    message = f'VACUUM/ANALYZE completed on {engine.dialect.name}.'
+    for done in (pruned, archived):
+        if done.get('message'):
+            message = f"{done['message']} {message}"
+    return {'message': message}
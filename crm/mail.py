@@ -0,0 +1,190 @@
+"""
+Email archive import.
+
+Uploaded mbox files and .eml messages become Email touchpoints for every
+contact whose address is in a message's From, To or Cc. Runs of about
+CHUNK_BYTES of messages are parsed by crm.mailparse in a process pool;
+the job's own thread is the only writer. It matches addresses through an
+in-memory email -> contact id map and inserts touchpoints BATCH_SIZE rows
+per statement. A unique (message_id,
+contact_id) index skips messages already imported, so re-importing an
+archive (or an overlapping export) adds only the new mail.
+"""
+import multiprocessing
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from crm.archive import archive_table, archived_years
+from crm.audit import record_changes
+from crm.db import db, write_lock
+from crm.dedupe import normalize_email
+from crm.jobs import job_handler
+from crm.mailparse import CHUNK_BYTES, chunks, parse_spans
+from crm.models import Contact, Touchpoint, TouchpointType
+
+# Parser processes; 0 parses on the job's thread
+WORKERS = int(os.environ.get('MAIL_IMPORT_WORKERS', min(os.cpu_count() or 1, 4)))
+
+# Touchpoints per INSERT (and per transaction); keeps bound parameters under SQLite limits
+BATCH_SIZE = 400
+
+
+def _pool_context():
+    """Start method for parser processes, or None to parse on the job's thread.
+
+    Forked children would run every fork hook of the app, so parsers come
+    from a forkserver that has imported only crm.mailparse. Its children
+    still re-import the script that started this process; when that script
+    builds the app itself (``python app.py``), parsing stays in-thread.
+    """
+    if WORKERS <= 0 or 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+    if getattr(sys.modules['__main__'], 'app', None) is current_app._get_current_object():
+        return None
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['crm.mailparse'])
+    return context
+
+
+def _parsed_chunks(paths: list):
+    """Yield parsed chunks in file order, from the process pool when it is worth starting."""
+    work = ((path, spans) for path in paths for spans in chunks(path))
+    small = sum(os.path.getsize(path) for path in paths) <= CHUNK_BYTES
+    context = None if small else _pool_context()
+    if context is None:
+        for path, spans in work:
+            yield parse_spans(path, spans)
+        return
+    with ProcessPoolExecutor(WORKERS, mp_context=context) as pool:
+        # A bounded window of chunks in flight keeps memory flat when the writer is slower
+        pending = deque()
+        for path, spans in work:
+            pending.append(pool.submit(parse_spans, path, spans))
+            if len(pending) >= WORKERS * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _email_index() -> dict:
+    """Normalized address -> contact id; the oldest contact wins a shared address."""
+    index = {}
+    rows = db.session.execute(
+        db.select(Contact.id, Contact.email).where(Contact.email.isnot(None)).order_by(Contact.id)
+    )
+    for contact_id, emails in rows:
+        for address in re.split(r'[\s,;]+', emails):
+            address = normalize_email(address)
+            if address:
+                index.setdefault(address, contact_id)
+    return index
+
+
+def _insert_ignore(table):
+    """INSERT ... ON CONFLICT DO NOTHING for the current dialect."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    raise RuntimeError(f'Email import is not supported on {dialect}')
+
+
+def _archived(rows: list) -> set:
+    """(message_id, contact_id) pairs of ``rows`` that already sit in archive tables."""
+    years = set(archived_years())
+    by_year = {}
+    for row in rows:
+        if row['occurred_at'].year in years:
+            by_year.setdefault(row['occurred_at'].year, set()).add(row['message_id'])
+    found = set()
+    for year, message_ids in by_year.items():
+        table = archive_table(year)
+        found.update(tuple(pair) for pair in db.session.execute(
+            db.select(table.c.message_id, table.c.contact_id).where(table.c.message_id.in_(message_ids))
+        ))
+    return found
+
+
+def _write(rows: list) -> int:
+    """Insert a batch of touchpoints and commit, skipping imported ones. Returns rows added."""
+    with write_lock():
+        archived = _archived(rows)
+        rows = [row for row in rows if (row['message_id'], row['contact_id']) not in archived]
+        added = 0
+        if rows:
+            # Stamped inside the transaction, as the change feed requires
+            now = datetime.utcnow()
+            for row in rows:
+                row['created_at'] = row['updated_at'] = now
+            table = Touchpoint.__table__
+            ids = db.session.execute(_insert_ignore(table).values(rows).returning(table.c.id)).scalars().all()
+            record_changes(table, ids)
+            added = len(ids)
+        db.session.commit()
+    return added
+
+
+def import_mail(paths: list) -> dict:
+    """Create Email touchpoints from mbox/.eml files. Returns counts of what happened."""
+    contacts = _email_index()
+    # End the read transaction; each batch writes from a fresh snapshot
+    db.session.commit()
+    counts = {'messages': 0, 'unreadable': 0, 'unmatched': 0, 'rows': 0, 'added': 0}
+    now = datetime.utcnow()
+    batch = []
+    for parsed in _parsed_chunks(paths):
+        for message in parsed:
+            counts['messages'] += 1
+            if message is None:
+                counts['unreadable'] += 1
+                continue
+            message_id, occurred_at, sender, recipients, subject, snippet = message
+            contact_ids = {contacts[address] for address in (sender, *recipients) if address in contacts}
+            if not contact_ids:
+                counts['unmatched'] += 1
+                continue
+            summary = f"{subject or '(no subject)'} (from {sender or 'unknown sender'})"
+            if snippet:
+                summary = f'{summary}\n\n{snippet}'
+            for contact_id in sorted(contact_ids):
+                batch.append({
+                    'contact_id': contact_id,
+                    'touchpoint_type': TouchpointType.EMAIL.value,
+                    'occurred_at': occurred_at or now,
+                    'summary': summary,
+                    'message_id': message_id,
+                })
+            counts['rows'] += len(contact_ids)
+            if len(batch) >= BATCH_SIZE:
+                counts['added'] += _write(batch)
+                batch = []
+    if batch:
+        counts['added'] += _write(batch)
+    return counts
+
+
+@job_handler('import_email')
+def import_email_job(params: dict) -> dict:
+    """Import uploaded email archives as touchpoints, then delete the uploads."""
+    paths = params.get('paths') or []
+    try:
+        if not all(os.path.exists(path) for path in paths):
+            raise FileNotFoundError('The uploaded files are no longer on this server; upload them again.')
+        counts = import_mail(paths)
+    finally:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return {'message': (
+        f"Added {counts['added']} email touchpoints from {counts['messages']} messages "
+        f"({counts['rows'] - counts['added']} already imported, "
+        f"{counts['unmatched']} without a matching contact, {counts['unreadable']} unreadable)."
+    )}
@@ -0,0 +1,105 @@
+"""
+Email archive parsing for the import in crm.mail.
+
+Kept to the standard library so parser processes start without the app:
+they run from a forkserver that has imported only this module, so none of
+the app's fork hooks (job pool, audit and metrics threads, engine
+disposal) run in them. An mbox is memory-mapped and split on its "From "
+separator lines, so it is never read into memory whole.
+"""
+import hashlib
+import html
+import mmap
+import os
+import re
+from datetime import timezone
+from email import policy
+from email.parser import BytesParser
+from email.utils import getaddresses, parsedate_to_datetime
+
+# Bytes of mail handed to a parser process at a time
+CHUNK_BYTES = 4 * 1024 * 1024
+
+# Characters of the message body kept in the touchpoint summary
+SNIPPET_CHARS = 500
+
+_TAGS = re.compile(r'<[^>]*>')
+
+
+def _normalize(address: str) -> str:
+    """Lowercase and trim an address (as crm.dedupe.normalize_email does)."""
+    return (address or '').strip().lower()
+
+
+def chunks(path: str):
+    """Yield lists of (start, end) message byte ranges, about CHUNK_BYTES each."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:5] != b'From ':
+            # A single .eml message
+            yield [(0, size)]
+            return
+        chunk, chunk_bytes, start = [], 0, 0
+        while start < size:
+            end = mm.find(b'\nFrom ', start)
+            end = size if end < 0 else end + 1
+            # The message starts after its "From " envelope line
+            body = mm.find(b'\n', start, end) + 1
+            if body:
+                chunk.append((body, end))
+                chunk_bytes += end - body
+            if chunk_bytes >= CHUNK_BYTES:
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            start = end
+        if chunk:
+            yield chunk
+
+
+def _snippet(message) -> str:
+    """Start of the plain-text (or de-tagged HTML) body, without quoted replies."""
+    part = message.get_body(preferencelist=('plain', 'html'))
+    if part is None:
+        return ''
+    content = part.get_content()
+    if part.get_content_type() == 'text/html':
+        content = html.unescape(_TAGS.sub(' ', content))
+    lines = [line for line in content.splitlines() if not line.lstrip().startswith('>')]
+    return ' '.join(' '.join(lines).split())[:SNIPPET_CHARS]
+
+
+def _parse_message(message) -> tuple:
+    """(message_id, occurred_at, sender, recipients, subject, snippet) of a parsed message."""
+    sender = [_normalize(address) for _, address in getaddresses(message.get_all('From', []))]
+    recipients = [_normalize(address) for _, address in
+                  getaddresses(message.get_all('To', []) + message.get_all('Cc', []))]
+    subject = ' '.join(str(message.get('Subject', '')).split())
+    snippet = _snippet(message)
+    try:
+        occurred_at = parsedate_to_datetime(str(message['Date']))
+        if occurred_at.tzinfo is not None:
+            occurred_at = occurred_at.astimezone(timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        occurred_at = None
+    message_id = str(message.get('Message-ID', '')).strip()
+    if not message_id:
+        # Stable stand-in so re-imports of an id-less message still dedupe
+        fingerprint = '\0'.join((str(message.get('Date', '')), *sender, subject, snippet))
+        message_id = f'<sha1-{hashlib.sha1(fingerprint.encode()).hexdigest()}@import>'
+    return (message_id[:255], occurred_at, sender[0] if sender else '',
+            [address for address in recipients if address], subject, snippet)
+
+
+def parse_spans(path: str, spans: list) -> list:
+    """Parse the messages at the given byte ranges of a file; None for unreadable ones."""
+    parser = BytesParser(policy=policy.default)
+    parsed = []
+    with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for start, end in spans:
+            try:
+                parsed.append(_parse_message(parser.parsebytes(mm[start:end])))
+            except Exception:
+                parsed.append(None)
+    return parsed
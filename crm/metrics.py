@@ -0,0 +1,370 @@
+"""
+Runtime metrics in Prometheus text format at ``/metrics``.
+
+Request latency, DB statements and pool checkouts are counted in plain
+dicts owned by the recording thread, so the hot path takes no lock; a
+scrape copies and sums every thread's dicts. Gauges (pool state, RSS) and
+process totals (cache hits, CPU time, GC runs) are read at scrape time.
+
+Outside debug mode a scrape must send ``Authorization: Bearer
+<METRICS_TOKEN>``; without a token the endpoint answers 403 unless
+``METRICS_PUBLIC=1`` opts in to serving it unauthenticated.
+
+With ``PROMETHEUS_MULTIPROC_DIR`` set (e.g. under gunicorn), each worker
+also writes its totals to ``<dir>/crm_<pid>.json`` every few seconds and
+at exit, and a scrape served by any worker sums all files. Counters of
+exited workers are kept; their gauges are dropped.
+"""
+import atexit
+import bisect
+import gc
+import hmac
+import json
+import os
+import resource
+import threading
+import time
+import weakref
+from flask import Flask, Response, current_app, request
+from sqlalchemy import event
+from crm.db import db
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# Seconds between writes of this worker's totals in multiprocess mode
+DUMP_SECONDS = 5.0
+
+# Bearer token required to scrape outside debug mode
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Serve /metrics without a token (e.g. on a private network)
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '').lower() in ('1', 'true', 'yes')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+POOL_WAIT_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 5.0)
+
+HISTOGRAMS = {
+    'crm_http_request_duration_seconds': ('Request latency by blueprint and endpoint.', LATENCY_BUCKETS),
+    'crm_db_statement_duration_seconds': ('Time spent executing SQL statements.', DB_BUCKETS),
+    'crm_db_pool_checkout_wait_seconds': ('Time spent waiting for a pooled connection.', POOL_WAIT_BUCKETS),
+}
+COUNTERS = {
+    'crm_http_requests_total': 'Requests by endpoint, method and status.',
+    'crm_db_routed_requests_total': 'Read requests by the database they read from (replica or primary).',
+    'crm_cache_hits_total': 'Fragment cache lookups that found an entry.',
+    'crm_cache_misses_total': 'Fragment cache lookups that rendered the fragment.',
+    'crm_process_cpu_seconds_total': 'User and system CPU time of this process.',
+    'crm_gc_collections_total': 'Garbage collector runs by generation.',
+    'crm_gc_collected_objects_total': 'Objects freed by the garbage collector by generation.',
+}
+
+_local = threading.local()
+_registry = []  # (counters, histograms) of every live thread that recorded
+_retired = ({}, {})  # Totals folded in from threads that have exited
+_registry_lock = threading.Lock()
+
+
+def _thread_tables() -> tuple:
+    """This thread's (counters, histograms), registered on first use."""
+    tables = getattr(_local, 'tables', None)
+    if tables is None:
+        tables = _local.tables = ({}, {})
+        with _registry_lock:
+            _registry.append(tables)
+        # Threads come and go (e.g. one per request on the dev server)
+        weakref.finalize(threading.current_thread(), _retire, tables)
+    return tables
+
+
+def _add(target: tuple, source: tuple):
+    """Sum (counters, histograms) from source into target."""
+    for key, value in source[0].copy().items():
+        target[0][key] = target[0].get(key, 0.0) + value
+    for key, cells in source[1].copy().items():
+        total = target[1].setdefault(key, [0] * len(cells))
+        for i, cell in enumerate(list(cells)):
+            total[i] += cell
+
+
+def _retire(tables: tuple):
+    """Fold an exited thread's tables into the retired totals."""
+    with _registry_lock:
+        _add(_retired, tables)
+        _registry.remove(tables)
+
+
+def inc(name: str, labels: tuple = (), value: float = 1.0):
+    """Add to a counter."""
+    counters = _thread_tables()[0]
+    key = (name, labels)
+    counters[key] = counters.get(key, 0.0) + value
+
+
+def observe(name: str, labels: tuple, value: float):
+    """Record a histogram sample."""
+    histograms = _thread_tables()[1]
+    key = (name, labels)
+    buckets = HISTOGRAMS[name][1]
+    cells = histograms.get(key)
+    if cells is None:
+        # One cell per bucket plus +Inf, then sum
+        cells = histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+    cells[bisect.bisect_left(buckets, value)] += 1
+    cells[-1] += value
+
+
+def _merged() -> tuple:
+    """Sum every thread's tables (dict copies are atomic under the GIL)."""
+    merged = ({}, {})
+    with _registry_lock:
+        _add(merged, _retired)
+        for tables in _registry:
+            _add(merged, tables)
+    return merged
+
+
+def _gauges() -> dict:
+    """Values read at scrape time: {(name, labels): value}.
+
+    Names ending in ``_total`` are process totals and exposed as counters.
+    """
+    gauges = {}
+    pool = db.engine.pool
+    for stat in ('size', 'checkedout', 'overflow', 'checkedin'):
+        method = getattr(pool, stat, None)
+        if callable(method):
+            gauges[(f'crm_db_pool_{stat}', ())] = float(method())
+
+    from crm.templating import fragment_cache
+    gauges[('crm_cache_hits_total', (('cache', 'fragments'),))] = float(fragment_cache.hits)
+    gauges[('crm_cache_misses_total', (('cache', 'fragments'),))] = float(fragment_cache.misses)
+
+    from crm.audit import _queue
+    gauges[('crm_audit_queue_depth', ())] = float(_queue.qsize())
+
+    gauges[('crm_process_resident_memory_bytes', ())] = float(rss_bytes())
+    gauges[('crm_process_cpu_seconds_total', ())] = sum(os.times()[:2])
+    gauges[('crm_process_threads', ())] = float(threading.active_count())
+    for generation, stats in enumerate(gc.get_stats()):
+        labels = (('generation', str(generation)),)
+        gauges[('crm_gc_collections_total', labels)] = float(stats['collections'])
+        gauges[('crm_gc_collected_objects_total', labels)] = float(stats['collected'])
+    for generation, count in enumerate(gc.get_count()):
+        gauges[('crm_gc_pending_objects', (('generation', str(generation)),))] = float(count)
+    return gauges
+
+
+def rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# -- Multiprocess mode --------------------------------------------------------
+
+def _encode(table: dict) -> list:
+    return [[name, [list(pair) for pair in labels], value] for (name, labels), value in table.items()]
+
+
+def _decode(rows: list) -> dict:
+    return {(name, tuple(tuple(pair) for pair in labels)): value for name, labels, value in rows}
+
+
+def _dump():
+    """Write this worker's totals for the other workers' scrapes."""
+    counters, histograms = _merged()
+    payload = {'pid': os.getpid(), 'counters': _encode(counters),
+               'histograms': _encode(histograms), 'gauges': _encode(_gauges())}
+    path = os.path.join(MULTIPROC_DIR, f'crm_{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(payload, f)
+    os.replace(path + '.tmp', path)
+
+
+def _dump_loop(app: Flask):
+    while True:
+        time.sleep(DUMP_SECONDS)
+        with app.app_context():
+            try:
+                _dump()
+            except Exception as e:
+                print(f"Note: Could not write metrics: {e}")
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _collect_multiprocess() -> tuple:
+    """Sum the files of every worker; gauges only from live ones (labelled by pid)."""
+    _dump()
+    counters, histograms, gauges = {}, {}, {}
+    for filename in os.listdir(MULTIPROC_DIR):
+        if not (filename.startswith('crm_') and filename.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(MULTIPROC_DIR, filename)) as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            continue
+        _add((counters, histograms), (_decode(payload['counters']), _decode(payload['histograms'])))
+        if _alive(payload['pid']):
+            for (name, labels), value in _decode(payload['gauges']).items():
+                gauges[(name, labels + (('pid', str(payload['pid'])),))] = value
+    return counters, histograms, gauges
+
+
+# -- Exposition ---------------------------------------------------------------
+
+def _number(value) -> str:
+    """Sample value without losing precision on large counters."""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render_metrics() -> str:
+    """All metrics in Prometheus text exposition format."""
+    if MULTIPROC_DIR:
+        counters, histograms, gauges = _collect_multiprocess()
+    else:
+        (counters, histograms), gauges = _merged(), _gauges()
+
+    lines = []
+    for name in sorted({key[0] for key in counters}):
+        lines.append(f'# HELP {name} {COUNTERS.get(name, name)}')
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        series = sorted((labels, cells) for (metric, labels), cells in histograms.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, cells in series:
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), cells):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{name}_bucket{_labels(labels, (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(cells[-1])}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    for name in sorted({key[0] for key in gauges}):
+        if name.endswith('_total'):
+            lines.append(f'# HELP {name} {COUNTERS.get(name, name)}')
+            lines.append(f'# TYPE {name} counter')
+        else:
+            lines.append(f'# TYPE {name} gauge')
+        for (metric, labels), value in sorted(gauges.items()):
+            if metric == name:
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# -- Instrumentation ----------------------------------------------------------
+
+def _start_timer():
+    request.environ['crm.started'] = time.perf_counter()
+
+
+def _record_request(response):
+    started = request.environ.get('crm.started')
+    if started is not None:
+        route = (('blueprint', request.blueprint or ''), ('endpoint', request.endpoint or 'unmatched'))
+        inc('crm_http_requests_total', route + (('method', request.method), ('status', str(response.status_code))))
+        observe('crm_http_request_duration_seconds', route, time.perf_counter() - started)
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['crm.query_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('crm.query_started', None)
+    if started is not None:
+        observe('crm_db_statement_duration_seconds', (), time.perf_counter() - started)
+
+
+def _instrument_pool(pool):
+    """Time Pool.connect(), which blocks while the pool is exhausted."""
+    if getattr(pool, '_crm_timed', False):
+        return
+    connect = pool.connect
+
+    def timed_connect(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return connect(*args, **kwargs)
+        finally:
+            observe('crm_db_pool_checkout_wait_seconds', (), time.perf_counter() - started)
+
+    pool.connect = timed_connect
+    pool._crm_timed = True
+
+
+def _instrument_new_pool(engine):
+    """dispose() (e.g. the after-fork hook in crm.db) swaps in a fresh, unpatched pool."""
+    _instrument_pool(engine.pool)
+
+
+def _reset_after_fork(app: Flask):
+    """Drop counts inherited from the parent process."""
+    global _local, _registry, _retired, _registry_lock
+    _local = threading.local()
+    _registry, _retired = [], ({}, {})
+    _registry_lock = threading.Lock()
+    if MULTIPROC_DIR:
+        threading.Thread(target=_dump_loop, args=(app,), name='crm-metrics', daemon=True).start()
+
+
+def metrics_view():
+    """Prometheus scrape endpoint."""
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+            return Response('Unauthorized', status=401)
+    elif not (METRICS_PUBLIC or current_app.debug):
+        return Response('Set METRICS_TOKEN (or METRICS_PUBLIC=1) to enable /metrics', status=403)
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8',
+                    headers={'Cache-Control': 'no-store'})
+
+
+def init_metrics(app: Flask):
+    """Instrument requests and the database engine and serve ``/metrics``."""
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        _instrument_pool(engine.pool)
+        event.listen(engine, 'engine_disposed', _instrument_new_pool)
+    # Forked workers start from zero and run their own dump thread
+    os.register_at_fork(after_in_child=lambda: _reset_after_fork(app))
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        threading.Thread(target=_dump_loop, args=(app,), name='crm-metrics', daemon=True).start()
+
+        def dump_at_exit():
+            with app.app_context():
+                _dump()
+        atexit.register(dump_at_exit)
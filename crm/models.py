@@ -32,6 +32,13 @@ class TaskPriority(Enum):
     HIGH = "High"
 
 
+class RecurrenceUnit(Enum):
+    """Units for recurring task intervals (relativedelta keyword names)."""
+    DAYS = "days"
+    WEEKS = "weeks"
+    MONTHS = "months"
+
+
 class TouchpointType(Enum):
     """Types of touchpoints."""
     CALL = "Call"
@@ -41,6 +48,14 @@ class TouchpointType(Enum):
     NOTE = "Note"
 
 
+class JobStatus(Enum):
+    """Background job lifecycle states."""
+    QUEUED = "Queued"
+    RUNNING = "Running"
+    DONE = "Done"
+    FAILED = "Failed"
+
+
 class ContactRole(Enum):
     """Roles a contact can have in relation to a deal."""
     LISTING_BROKER = "Listing_Broker"
@@ -63,19 +78,58 @@ class Contact(db.Model):
     email = db.Column(db.String(200))
     notes = db.Column(db.Text)
     tags = db.Column(db.String(500))  # Comma-separated tags
+    external_id = db.Column(db.String(100), unique=True)  # Key used by sync integrations
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_contacts_updated_at_id', 'updated_at', 'id'),
+    )
+    
     # Relationships
-    deal_roles = db.relationship('DealContactRole', back_populates='contact', cascade='all, delete-orphan')
-    property_ownerships = db.relationship('PropertyOwner', back_populates='contact', cascade='all, delete-orphan')
-    touchpoints = db.relationship('Touchpoint', back_populates='contact', cascade='all, delete-orphan')
-    tasks = db.relationship('Task', back_populates='contact', cascade='all, delete-orphan')
+    deal_roles = db.relationship('DealContactRole', back_populates='contact', cascade='all, delete-orphan', passive_deletes=True)
+    property_ownerships = db.relationship('PropertyOwner', back_populates='contact', cascade='all, delete-orphan', passive_deletes=True)
+    touchpoints = db.relationship('Touchpoint', back_populates='contact', cascade='all, delete-orphan', passive_deletes=True)
+    tasks = db.relationship('Task', back_populates='contact', cascade='all, delete-orphan', passive_deletes=True)
+    portfolio = db.relationship('OwnerPortfolio', uselist=False, viewonly=True)
     
     def __repr__(self):
         return f'<Contact {self.name}>'
 
 
+class ContactMatchKey(db.Model):
+    """Blocking key used to find duplicate contacts without comparing every pair."""
+    __tablename__ = 'contact_match_keys'
+    
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id', ondelete='CASCADE'), primary_key=True)
+    key = db.Column(db.String(220), primary_key=True, index=True)  # e.g. 'e:jane@x.com', 'p:5551234567'
+
+
+class DismissedDuplicate(db.Model):
+    """Contact pair a user confirmed is not a duplicate (contact_id < other_id)."""
+    __tablename__ = 'dismissed_duplicates'
+    
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id', ondelete='CASCADE'), primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey('contacts.id', ondelete='CASCADE'), primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class OwnerPortfolio(db.Model):
+    """Per-contact ownership rollup, weighted by ownership percentage (see crm.portfolio)."""
+    __tablename__ = 'owner_portfolios'
+    
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id', ondelete='CASCADE'), primary_key=True)
+    property_count = db.Column(db.Integer, nullable=False, default=0)
+    total_units = db.Column(db.Float, nullable=False, default=0)  # Fractional when ownership is partial
+    total_value = db.Column(db.Float, nullable=False, default=0)  # Midpoint of the estimated value range
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_owner_portfolios_value', 'total_value', 'contact_id'),
+        db.Index('ix_owner_portfolios_units', 'total_units', 'contact_id'),
+    )
+
+
 class Property(db.Model):
     """Property model for multifamily properties."""
     __tablename__ = 'properties'
@@ -94,12 +148,20 @@ class Property(db.Model):
     buyer_interest = db.Column(db.Integer)  # 1-10 scale
     seller_motivation = db.Column(db.Integer)  # 1-10 scale
     notes = db.Column(db.Text)
+    external_id = db.Column(db.String(100), unique=True)  # Key used by sync integrations
+    latitude = db.Column(db.Float)  # Geocoded from zip_code (see crm.geo)
+    longitude = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_properties_lat_lon', 'latitude', 'longitude'),
+        db.Index('ix_properties_updated_at', 'updated_at'),
+    )
+    
     # Relationships
-    deals = db.relationship('Deal', back_populates='property', cascade='all, delete-orphan')
-    owners = db.relationship('PropertyOwner', back_populates='property', cascade='all, delete-orphan')
+    deals = db.relationship('Deal', back_populates='property', cascade='all, delete-orphan', passive_deletes=True)
+    owners = db.relationship('PropertyOwner', back_populates='property', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Property {self.address}>'
@@ -110,16 +172,22 @@ class PropertyOwner(db.Model):
     __tablename__ = 'property_owners'
     
     id = db.Column(db.Integer, primary_key=True)
-    property_id = db.Column(db.Integer, db.ForeignKey('properties.id'), nullable=False)
-    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), nullable=False)
+    property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), nullable=False)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id', ondelete='CASCADE'), nullable=False)
     ownership_percentage = db.Column(db.Numeric(5, 2))  # e.g., 50.00
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     property = db.relationship('Property', back_populates='owners')
     contact = db.relationship('Contact', back_populates='property_ownerships')
     
+    __table_args__ = (
+        db.Index('uq_property_owners_property_contact', 'property_id', 'contact_id', unique=True),
+        db.Index('ix_property_owners_updated_at_id', 'updated_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<PropertyOwner property={self.property_id} contact={self.contact_id}>'
 
@@ -130,7 +198,7 @@ class Deal(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     deal_name = db.Column(db.String(200), nullable=False)
-    property_id = db.Column(db.Integer, db.ForeignKey('properties.id'), nullable=False)
+    property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), nullable=False)
     stage = db.Column(db.String(50), default=DealStage.LEAD.value, nullable=False)
     target_close_date = db.Column(db.Date)
     asking_price = db.Column(db.Numeric(15, 2))  # Optional
@@ -139,11 +207,15 @@ class Deal(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_deals_updated_at_id', 'updated_at', 'id'),
+    )
+    
     # Relationships
     property = db.relationship('Property', back_populates='deals')
-    contact_roles = db.relationship('DealContactRole', back_populates='deal', cascade='all, delete-orphan')
-    touchpoints = db.relationship('Touchpoint', back_populates='deal', cascade='all, delete-orphan')
-    tasks = db.relationship('Task', back_populates='deal', cascade='all, delete-orphan')
+    contact_roles = db.relationship('DealContactRole', back_populates='deal', cascade='all, delete-orphan', passive_deletes=True)
+    touchpoints = db.relationship('Touchpoint', back_populates='deal', cascade='all, delete-orphan', passive_deletes=True)
+    tasks = db.relationship('Task', back_populates='deal', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Deal {self.deal_name}>'
@@ -154,11 +226,16 @@ class DealContactRole(db.Model):
     __tablename__ = 'deal_contact_roles'
     
     id = db.Column(db.Integer, primary_key=True)
-    deal_id = db.Column(db.Integer, db.ForeignKey('deals.id'), nullable=False)
-    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), nullable=False)
+    deal_id = db.Column(db.Integer, db.ForeignKey('deals.id', ondelete='CASCADE'), nullable=False)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id', ondelete='CASCADE'), nullable=False)
     role = db.Column(db.String(50), nullable=False)  # ContactRole enum value
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_deal_contact_roles_updated_at_id', 'updated_at', 'id'),
+    )
     
     # Relationships
     deal = db.relationship('Deal', back_populates='contact_roles')
@@ -173,13 +250,23 @@ class Touchpoint(db.Model):
     __tablename__ = 'touchpoints'
     
     id = db.Column(db.Integer, primary_key=True)
-    deal_id = db.Column(db.Integer, db.ForeignKey('deals.id'))
-    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'))
+    deal_id = db.Column(db.Integer, db.ForeignKey('deals.id', ondelete='CASCADE'))
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id', ondelete='CASCADE'))
     touchpoint_type = db.Column(db.String(20), nullable=False)  # TouchpointType enum value
     occurred_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     summary = db.Column(db.Text, nullable=False)
     next_step = db.Column(db.Text)  # Optional next action noted during touchpoint
+    external_id = db.Column(db.String(100), unique=True)  # Key used by sync integrations
+    message_id = db.Column(db.String(255))  # Message-ID of an imported email
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_touchpoints_contact_occurred_at', 'contact_id', 'occurred_at'),
+        db.Index('uq_touchpoints_message_contact', 'message_id', 'contact_id', unique=True),
+        db.Index('ix_touchpoints_occurred_at', 'occurred_at'),
+        db.Index('ix_touchpoints_updated_at_id', 'updated_at', 'id'),
+    )
     
     # Relationships
     deal = db.relationship('Deal', back_populates='touchpoints')
@@ -198,13 +285,29 @@ class Task(db.Model):
     due_date = db.Column(db.Date, nullable=False)
     status = db.Column(db.String(20), default=TaskStatus.OPEN.value, nullable=False)
     priority = db.Column(db.String(20), default=TaskPriority.MEDIUM.value)
-    deal_id = db.Column(db.Integer, db.ForeignKey('deals.id'))
-    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'))
-    property_id = db.Column(db.Integer, db.ForeignKey('properties.id'))
+    deal_id = db.Column(db.Integer, db.ForeignKey('deals.id', ondelete='CASCADE'))
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id', ondelete='CASCADE'))
+    property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='SET NULL'))
     completed_at = db.Column(db.DateTime)
+    snoozed_until = db.Column(db.DateTime, index=True)  # Snoozed tasks reopen after this time
+    external_id = db.Column(db.String(100), unique=True)  # Key used by sync integrations
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Recurrence: the first task of a series carries the rule; later
+    # occurrences are materialized lazily and point back via series_id.
+    recurrence_interval = db.Column(db.Integer)
+    recurrence_unit = db.Column(db.String(10))  # RecurrenceUnit enum value
+    recurrence_count = db.Column(db.Integer)  # Occurrences materialized so far
+    recurrence_next = db.Column(db.Date, index=True)  # Next unmaterialized due date
+    series_id = db.Column(db.Integer, db.ForeignKey('tasks.id', ondelete='SET NULL'))
+    
+    __table_args__ = (
+        db.Index('ix_tasks_status_due_date', 'status', 'due_date'),
+        db.Index('ix_tasks_contact_id', 'contact_id'),
+        db.Index('ix_tasks_updated_at_id', 'updated_at', 'id'),
+    )
+    
     # Relationships
     deal = db.relationship('Deal', back_populates='tasks')
     contact = db.relationship('Contact', back_populates='tasks')
@@ -226,6 +329,111 @@ class Task(db.Model):
         if self.status == TaskStatus.DONE.value:
             return False
         return self.due_date == datetime.utcnow().date()
+    
+    @property
+    def is_recurring(self):
+        """Check if task is the root of a recurring series."""
+        return bool(self.recurrence_interval and self.recurrence_unit)
+
+
+class Job(db.Model):
+    """Background job persisted so status can be polled from any worker."""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), default=JobStatus.QUEUED.value, nullable=False, index=True)
+    params = db.Column(db.Text)  # JSON-encoded handler arguments
+    message = db.Column(db.Text)  # Human readable outcome or error
+    result = db.Column(db.LargeBinary)  # Downloadable output, e.g. CSV bytes
+    result_filename = db.Column(db.String(200))
+    result_mimetype = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    claimed_by = db.Column(db.String(100))  # host:pid of the process running the job
+    heartbeat_at = db.Column(db.DateTime)  # Refreshed while the job runs
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+    
+    @property
+    def is_finished(self):
+        """Check if the job has stopped running."""
+        return self.status in (JobStatus.DONE.value, JobStatus.FAILED.value)
+
+
+class AuditEntry(db.Model):
+    """Field-level change to a record, written in batches by crm.audit."""
+    __tablename__ = 'audit_log'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    occurred_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    entity = db.Column(db.String(50), nullable=False)  # Table name, e.g. 'contacts'
+    entity_id = db.Column(db.Integer)
+    action = db.Column(db.String(10), nullable=False)  # insert, update or delete
+    changes = db.Column(db.Text)  # JSON {field: [old, new]}
+    actor = db.Column(db.String(100))  # Client address or background thread
+    
+    __table_args__ = (
+        db.Index('ix_audit_log_entity', 'entity', 'entity_id', 'occurred_at', 'id'),
+        db.Index('ix_audit_log_occurred_at', 'occurred_at', 'id'),
+    )
+
+
+
+class CalendarFeed(db.Model):
+    """Secret-URL ICS feed of open and snoozed tasks, optionally filtered (see crm.ics)."""
+    __tablename__ = 'calendar_feeds'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(64), nullable=False, unique=True)
+    name = db.Column(db.String(200), nullable=False)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id', ondelete='CASCADE'))
+    property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'))
+    deal_id = db.Column(db.Integer, db.ForeignKey('deals.id', ondelete='CASCADE'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    contact = db.relationship('Contact')
+    related_property = db.relationship('Property')
+    deal = db.relationship('Deal')
+
+
+class TouchpointActivity(db.Model):
+    """Touchpoint count per period bucket, type and contact, kept by database triggers (see crm.activity)."""
+    __tablename__ = 'touchpoint_activity'
+    
+    period = db.Column(db.String(5), primary_key=True)  # 'week' or 'month'
+    bucket = db.Column(db.Date, primary_key=True)  # First day of the week (Monday) or month
+    touchpoint_type = db.Column(db.String(20), primary_key=True)
+    contact_id = db.Column(db.Integer, primary_key=True)  # 0 for touchpoints without a contact
+    touchpoints = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_touchpoint_activity_contact', 'contact_id', 'period', 'bucket'),
+    )
+
+
+class Tombstone(db.Model):
+    """Record of a deleted row, written by a database trigger (see crm.changes)."""
+    __tablename__ = 'tombstones'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(50), nullable=False)  # Table name, e.g. 'contacts'
+    entity_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False)  # UTC, from the database clock
+    
+    __table_args__ = (
+        db.Index('ix_tombstones_entity_deleted_at_id', 'entity', 'deleted_at', 'id'),
+    )
+
+
+class ReplicaHeartbeat(db.Model):
+    """Single row rewritten on the primary every second; its copy on a replica shows the lag."""
+    __tablename__ = 'replica_heartbeat'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.Float, nullable=False)  # Unix time of the last write on the primary
 
 
 def seed_initial_data():
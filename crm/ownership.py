@@ -0,0 +1,67 @@
+"""
+Set-based maintenance of property ownership links.
+
+A contact's ownerships are synced to a target list of property ids with a
+constant number of statements: one validation SELECT, one
+``DELETE ... WHERE property_id NOT IN (...)`` and one multi-row
+``INSERT ... ON CONFLICT DO NOTHING`` backed by the unique
+(property_id, contact_id) index.
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+from crm.audit import record_changes
+from crm.db import db
+from crm.graph import note_edge_changes
+from crm.models import Property, PropertyOwner
+from crm.portfolio import refresh_portfolios
+
+# Rows per INSERT statement; keeps bound parameters under SQLite limits
+CHUNK_SIZE = 400
+
+
+def _insert_ignore(table):
+    """INSERT ... ON CONFLICT DO NOTHING for the current dialect."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    raise RuntimeError(f'Ownership sync is not supported on {dialect}')
+
+
+def sync_contact_properties(contact_id: int, property_ids) -> tuple:
+    """Make the contact own exactly the given properties. Does not commit.
+
+    Raises ValueError if any property id does not exist. Returns the
+    (added, removed) property id lists.
+    """
+    wanted = sorted({int(pid) for pid in property_ids})
+    if wanted:
+        found = set(db.session.execute(
+            db.select(Property.id).where(Property.id.in_(wanted))
+        ).scalars())
+        missing = [pid for pid in wanted if pid not in found]
+        if missing:
+            raise ValueError(f"Unknown property id(s): {', '.join(map(str, missing))}")
+
+    table = PropertyOwner.__table__
+    stale = table.delete().where(table.c.contact_id == contact_id)
+    if wanted:
+        stale = stale.where(table.c.property_id.notin_(wanted))
+    removed = db.session.execute(stale.returning(table.c.property_id)).scalars().all()
+
+    added = []
+    for start in range(0, len(wanted), CHUNK_SIZE):
+        inserted = db.session.execute(
+            _insert_ignore(table)
+            .values([{'property_id': pid, 'contact_id': contact_id} for pid in wanted[start:start + CHUNK_SIZE]])
+            .returning(table.c.id, table.c.property_id)
+        ).all()
+        record_changes(table, [row.id for row in inserted])
+        added += [row.property_id for row in inserted]
+
+    # Core statements bypass the ORM hooks that maintain derived data
+    if added or removed:
+        refresh_portfolios(contact_ids=[contact_id], property_ids=added + removed)
+        note_edge_changes(db.session, [(-1, ('contacts', contact_id), ('properties', pid)) for pid in removed]
+                          + [(1, ('contacts', contact_id), ('properties', pid)) for pid in added])
+    return added, removed
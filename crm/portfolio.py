@@ -0,0 +1,169 @@
+"""
+Owner portfolio rollups.
+
+``owner_portfolios`` holds one row per owning contact with property count,
+units and estimated value weighted by ownership percentage. Rows are
+recomputed with a single grouped INSERT ... SELECT for just the contacts
+touched by a flush, so reads (contact detail, largest-owners ranking) never
+aggregate ``property_owners`` themselves.
+"""
+from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from crm.db import db
+from crm.jobs import job_handler
+from crm.models import Contact, OwnerPortfolio, Property, PropertyOwner
+
+# Property columns that feed the rollup
+ROLLUP_PROPERTY_COLUMNS = ('units', 'estimated_value_min', 'estimated_value_max')
+
+# Contacts refreshed per statement; keeps IN lists under SQLite limits
+CHUNK_SIZE = 500
+
+# Rows per page on the largest-owners view
+PAGE_SIZE = 50
+
+RANKINGS = {
+    'value': OwnerPortfolio.total_value,
+    'units': OwnerPortfolio.total_units,
+}
+
+
+def _rollup_select(contact_ids=None):
+    """Grouped per-contact aggregates over property_owners."""
+    # Owners with no percentage split the property evenly
+    owner_counts = (
+        db.select(PropertyOwner.property_id, db.func.count().label('owners'))
+        .group_by(PropertyOwner.property_id)
+        .subquery()
+    )
+    share = db.func.coalesce(
+        db.cast(PropertyOwner.ownership_percentage, db.Float),
+        100.0 / owner_counts.c.owners
+    ) / 100.0
+    value = (db.cast(db.func.coalesce(Property.estimated_value_min, Property.estimated_value_max), db.Float)
+             + db.cast(db.func.coalesce(Property.estimated_value_max, Property.estimated_value_min), db.Float)) / 2
+
+    query = (
+        db.select(
+            PropertyOwner.contact_id,
+            db.func.count(db.distinct(PropertyOwner.property_id)),
+            db.func.coalesce(db.func.sum(db.func.coalesce(Property.units, 0) * share), 0),
+            db.func.coalesce(db.func.sum(value * share), 0),
+            db.literal(datetime.utcnow(), db.DateTime),
+        )
+        .join(Property, Property.id == PropertyOwner.property_id)
+        .join(owner_counts, owner_counts.c.property_id == PropertyOwner.property_id)
+        .group_by(PropertyOwner.contact_id)
+    )
+    if contact_ids is not None:
+        query = query.where(PropertyOwner.contact_id.in_(contact_ids))
+    return query
+
+
+def _refresh(connection, contact_ids=None):
+    """Replace rollup rows for the given contacts (or all) on a connection."""
+    table = OwnerPortfolio.__table__
+    columns = ['contact_id', 'property_count', 'total_units', 'total_value', 'refreshed_at']
+    if contact_ids is None:
+        connection.execute(table.delete())
+        connection.execute(table.insert().from_select(columns, _rollup_select()))
+        return
+    contact_ids = sorted(contact_ids)
+    for start in range(0, len(contact_ids), CHUNK_SIZE):
+        chunk = contact_ids[start:start + CHUNK_SIZE]
+        connection.execute(table.delete().where(table.c.contact_id.in_(chunk)))
+        connection.execute(table.insert().from_select(columns, _rollup_select(chunk)))
+
+
+def _owners_of(connection, property_ids) -> set:
+    """Contact ids owning any of the given properties."""
+    owners = set()
+    property_ids = list(property_ids)
+    for start in range(0, len(property_ids), CHUNK_SIZE):
+        owners.update(connection.execute(
+            db.select(PropertyOwner.contact_id)
+            .where(PropertyOwner.property_id.in_(property_ids[start:start + CHUNK_SIZE]))
+        ).scalars())
+    return owners
+
+
+def refresh_portfolios(contact_ids=None, property_ids=None):
+    """Refresh rollups after writes made outside the ORM (bulk updates, upserts).
+
+    With neither argument, every rollup is rebuilt. Does not commit.
+    """
+    connection = db.session.connection()
+    if contact_ids is None and property_ids is None:
+        _refresh(connection)
+        return
+    contacts = set(contact_ids or ())
+    if property_ids:
+        contacts |= _owners_of(connection, property_ids)
+    if contacts:
+        _refresh(connection, contacts)
+
+
+def ensure_portfolios():
+    """Build the rollups once on databases that predate them."""
+    try:
+        if (db.session.query(PropertyOwner.id).limit(1).first()
+                and not db.session.query(OwnerPortfolio.contact_id).limit(1).first()):
+            refresh_portfolios()
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Note: Could not build owner portfolios: {e}")
+
+
+@job_handler('rebuild_portfolios')
+def rebuild_portfolios_job(params: dict) -> dict:
+    """Recompute every owner rollup."""
+    refresh_portfolios()
+    db.session.commit()
+    count = db.session.query(db.func.count(OwnerPortfolio.contact_id)).scalar()
+    return {'message': f'Rebuilt portfolios for {count} owners.'}
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_after_flush(session, flush_context):
+    """Recompute rollups for contacts whose ownerships or properties changed."""
+    contacts, properties = set(), set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, PropertyOwner):
+            contacts.add(obj.contact_id)
+            # Ownership moved to another contact: refresh the previous one too
+            contacts.update(inspect(obj).attrs.contact_id.history.deleted or ())
+            # Co-owners without a percentage share the property evenly
+            properties.add(obj.property_id)
+            properties.update(inspect(obj).attrs.property_id.history.deleted or ())
+        elif isinstance(obj, Property) and obj not in session.new:
+            state = inspect(obj)
+            if obj in session.deleted or any(state.attrs[c].history.has_changes() for c in ROLLUP_PROPERTY_COLUMNS):
+                properties.add(obj.id)
+        elif isinstance(obj, Contact) and obj in session.deleted:
+            contacts.add(obj.id)
+    contacts.discard(None)
+    properties.discard(None)
+    if not contacts and not properties:
+        return
+
+    connection = session.connection()
+    if properties:
+        contacts |= _owners_of(connection, properties)
+    if contacts:
+        _refresh(connection, contacts)
+
+
+def largest_owners(rank_by: str = 'value', page: int = 1) -> tuple:
+    """Return ([(portfolio, contact)], total) for one page of the ranking."""
+    column = RANKINGS.get(rank_by, OwnerPortfolio.total_value)
+    total = db.session.query(db.func.count(OwnerPortfolio.contact_id)).scalar()
+    rows = db.session.execute(
+        db.select(OwnerPortfolio, Contact)
+        .join(Contact, Contact.id == OwnerPortfolio.contact_id)
+        .order_by(column.desc(), OwnerPortfolio.contact_id.desc())
+        .limit(PAGE_SIZE)
+        .offset((max(page, 1) - 1) * PAGE_SIZE)
+    ).all()
+    return rows, total
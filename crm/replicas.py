@@ -0,0 +1,124 @@
+"""
+Read-replica routing.
+
+With ``DATABASE_REPLICA_URLS`` set (comma-separated), GET and HEAD requests
+run their SELECTs on a replica; other requests, writes and views marked
+``@primary_only`` use the primary (``DATABASE_URL``).
+
+Lag is measured with a heartbeat: a background thread rewrites one row on
+the primary every second, and a replica whose copy of that row is more than
+REPLICA_MAX_LAG_SECONDS old (or that cannot be reached) is skipped. After a
+write request the client's session records when it wrote, and its reads
+stay on the primary until a replica's heartbeat has passed that time, so a
+redirect after a POST shows the change.
+
+To try it locally, point ``DATABASE_REPLICA_URLS`` at a second SQLite file
+and copy the primary file over it to "replicate".
+"""
+import os
+import random
+import threading
+import time
+from flask import Flask, current_app, request, session
+from sqlalchemy.exc import SQLAlchemyError
+from crm.db import db, REPLICA_KEY, REPLICA_URLS, WROTE_KEY, WRITE_METHODS
+from crm.metrics import inc
+from crm.models import ReplicaHeartbeat
+
+# Replicas further behind the primary than this are not read from
+MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+
+# How often the primary's heartbeat row is rewritten
+HEARTBEAT_SECONDS = 1.0
+
+# How long a replica's heartbeat reading is reused before asking it again
+CHECK_SECONDS = 1.0
+
+# Flask session key holding the time of the client's last write
+STICKY_KEY = 'wrote_at'
+
+READ_METHODS = {'GET', 'HEAD'}
+
+_keys = []
+_beats = {}  # bind key -> (checked at, replica's heartbeat or None)
+
+
+def primary_only(view):
+    """Keep a GET view on the primary (it writes, or shows rows written moments ago)."""
+    view.primary_only = True
+    return view
+
+
+def _heartbeat_loop(engine):
+    while True:
+        try:
+            with engine.begin() as conn:
+                table = ReplicaHeartbeat.__table__
+                now = time.time()
+                if not conn.execute(table.update().where(table.c.id == 1).values(beat_at=now)).rowcount:
+                    conn.execute(table.insert().values(id=1, beat_at=now))
+        except SQLAlchemyError as e:
+            print(f"Note: Could not write replica heartbeat: {getattr(e, 'orig', e)}")
+        time.sleep(HEARTBEAT_SECONDS)
+
+
+def replica_heartbeat(key: str):
+    """Primary time the replica has replicated up to, or None when it is unreachable."""
+    checked = _beats.get(key)
+    if checked is not None and time.monotonic() - checked[0] < CHECK_SECONDS:
+        return checked[1]
+    table = ReplicaHeartbeat.__table__
+    try:
+        with db.engines[key].connect() as conn:
+            beat = conn.execute(db.select(table.c.beat_at).where(table.c.id == 1)).scalar()
+    except SQLAlchemyError as e:
+        if checked is None or checked[1] is not None:
+            print(f"Note: Replica {key} unavailable, reading from the primary: {getattr(e, 'orig', e)}")
+        beat = None
+    _beats[key] = (time.monotonic(), beat)
+    return beat
+
+
+def choose_replica(newer_than: float):
+    """Engine of a random replica whose heartbeat is at least ``newer_than``, or None."""
+    fresh = [key for key in _keys if (replica_heartbeat(key) or 0) >= newer_than]
+    return db.engines[random.choice(fresh)] if fresh else None
+
+
+def _route_reads():
+    """Point the session's SELECTs at a replica that is fresh enough for this client."""
+    view = current_app.view_functions.get(request.endpoint)
+    if request.method not in READ_METHODS or view is None or getattr(view, 'primary_only', False):
+        return
+    newer_than = time.time() - MAX_LAG_SECONDS
+    wrote_at = session.get(STICKY_KEY)
+    if wrote_at is not None:
+        if wrote_at < newer_than:
+            # Any replica within the lag limit has this write by now
+            session.pop(STICKY_KEY)
+        else:
+            newer_than = wrote_at
+    replica = choose_replica(newer_than)
+    if replica is not None:
+        db.session.info[REPLICA_KEY] = replica
+    inc('crm_db_routed_requests_total', (('target', 'replica' if replica is not None else 'primary'),))
+
+
+def _remember_writes(response):
+    if request.method in WRITE_METHODS or db.session.info.get(WROTE_KEY):
+        session[STICKY_KEY] = time.time()
+    return response
+
+
+def init_replicas(app: Flask):
+    """Route GET reads to replicas when DATABASE_REPLICA_URLS is set."""
+    global _keys
+    _keys = [f'replica_{i}' for i in range(len(REPLICA_URLS))]
+    if not _keys:
+        return
+    with app.app_context():
+        engine = db.engine
+    # One heartbeat per host is enough; preforked workers leave it to the parent
+    threading.Thread(target=_heartbeat_loop, args=(engine,), name='crm-heartbeat', daemon=True).start()
+    app.before_request(_route_reads)
+    app.after_request(_remember_writes)
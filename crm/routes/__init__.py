@@ -9,6 +9,9 @@ from crm.routes.touchpoints import touchpoints_bp
 from crm.routes.search import search_bp
 from crm.routes.properties import properties_bp
 from crm.routes.backup import backup_bp
+from crm.routes.jobs import jobs_bp
+from crm.routes.api import api_bp
+from crm.routes.health import health_bp
 
 
 def register_routes(app: Flask):
@@ -20,4 +23,7 @@ def register_routes(app: Flask):
     app.register_blueprint(search_bp)
     app.register_blueprint(properties_bp)
     app.register_blueprint(backup_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(health_bp)
 
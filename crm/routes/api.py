@@ -0,0 +1,468 @@
+"""
+Versioned JSON API for integrations.
+
+List and detail endpoints read with Core selects into row tuples instead of
+building ORM objects. Supported query parameters:
+
+- ``fields=a,b`` picks the columns returned for the primary resource and
+  ``fields[<resource>]=a,b`` for included resources
+- ``include=x,y`` embeds related records, loaded with one IN query each
+- ``limit`` and ``after`` page through lists by id (keyset pagination)
+
+``POST /api/v1/batch`` upserts many records in one transaction,
+``GET /api/v1/geo/properties`` runs radius or bounding-box searches and
+``/api/v1/graph/...`` answers multi-hop relationship queries,
+``GET /api/v1/audit`` pages through the change log,
+``GET /api/v1/changes`` streams rows changed since a sync cursor as NDJSON and
+``GET /api/v1/reports/activity`` reads touchpoint counts from the activity rollups.
+"""
+import json
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Blueprint, request, Response, stream_with_context
+from crm.activity import GROUPS, PERIODS, activity_counts, bucket_start, default_start
+from crm.audit import query_audit
+from crm.batch import apply_batch, MAX_BATCH_SIZE
+from crm.changes import (changed_rows, deleted_rows, encode_cursor, decode_cursor, cursor_expired,
+                         settled_until, FEED_TABLES)
+from crm.db import db
+from crm.deletes import delete_records, DELETABLE_MODELS
+from crm.geo import geocode_zip, properties_in_bbox, properties_within_radius
+from crm.graph import relationship_graph, NODE_KINDS, MAX_HOPS
+from crm.models import Contact, Property, Task, Touchpoint, Deal, PropertyOwner, DealContactRole
+from crm.replicas import primary_only
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; fall back to the standard library
+    orjson = None
+
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Change feed rows per resource per page
+DEFAULT_FEED_LIMIT = 1000
+MAX_FEED_LIMIT = 10000
+
+# local_key on this row matches remote_key on the included resource;
+# many=True embeds a list, otherwise a single object (or null)
+Include = namedtuple('Include', 'resource local_key remote_key many')
+
+RESOURCES = {
+    'contacts': (Contact, {
+        'ownerships': Include('ownerships', 'id', 'contact_id', True),
+        'deal_roles': Include('deal_roles', 'id', 'contact_id', True),
+        'tasks': Include('tasks', 'id', 'contact_id', True),
+        'touchpoints': Include('touchpoints', 'id', 'contact_id', True),
+    }),
+    'properties': (Property, {
+        'owners': Include('ownerships', 'id', 'property_id', True),
+        'deals': Include('deals', 'id', 'property_id', True),
+        'tasks': Include('tasks', 'id', 'property_id', True),
+    }),
+    'tasks': (Task, {
+        'contact': Include('contacts', 'contact_id', 'id', False),
+        'property': Include('properties', 'property_id', 'id', False),
+        'deal': Include('deals', 'deal_id', 'id', False),
+    }),
+    'touchpoints': (Touchpoint, {
+        'contact': Include('contacts', 'contact_id', 'id', False),
+        'deal': Include('deals', 'deal_id', 'id', False),
+    }),
+    'deals': (Deal, {
+        'property': Include('properties', 'property_id', 'id', False),
+        'contact_roles': Include('deal_roles', 'id', 'deal_id', True),
+        'tasks': Include('tasks', 'id', 'deal_id', True),
+        'touchpoints': Include('touchpoints', 'id', 'deal_id', True),
+    }),
+    'ownerships': (PropertyOwner, {
+        'contact': Include('contacts', 'contact_id', 'id', False),
+        'property': Include('properties', 'property_id', 'id', False),
+    }),
+    'deal_roles': (DealContactRole, {
+        'contact': Include('contacts', 'contact_id', 'id', False),
+        'deal': Include('deals', 'deal_id', 'id', False),
+    }),
+}
+
+
+class ApiError(Exception):
+    """Client error reported as a JSON body with an HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _json_default(value):
+    """Serialize types the JSON encoders do not handle natively."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def _dumps(payload) -> bytes:
+    """Encode a payload with orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default)
+    return json.dumps(payload, default=_json_default, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(payload, status=200) -> Response:
+    """Encode a payload as a JSON response."""
+    return Response(_dumps(payload), status=status, mimetype='application/json')
+
+
+@api_bp.errorhandler(ApiError)
+def handle_api_error(error):
+    """Render client errors as JSON."""
+    return json_response({'error': error.message}, error.status)
+
+
+def _columns(resource: str) -> dict:
+    """Map column name to Column for a resource's table."""
+    model = RESOURCES[resource][0]
+    return model.__table__.columns
+
+
+def _parse_fields(resource: str, raw) -> list:
+    """Validate a comma-separated field list; default to every column."""
+    columns = _columns(resource)
+    if not raw:
+        return list(columns.keys())
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in columns]
+    if unknown:
+        raise ApiError(f"Unknown field(s) for {resource}: {', '.join(unknown)}")
+    return fields
+
+
+def _parse_includes(resource: str) -> list:
+    """Validate the include parameter against a resource's relations."""
+    raw = request.args.get('include', '')
+    names = [n.strip() for n in raw.split(',') if n.strip()]
+    relations = RESOURCES[resource][1]
+    unknown = [n for n in names if n not in relations]
+    if unknown:
+        raise ApiError(f"Unknown include(s) for {resource}: {', '.join(unknown)}")
+    return [(name, relations[name]) for name in names]
+
+
+def _select_rows(resource: str, fields: list, *conditions, order_by=None, limit=None) -> list:
+    """Run a Core select and return plain dicts keyed by field name."""
+    columns = _columns(resource)
+    stmt = db.select(*[columns[f] for f in fields]).where(*conditions)
+    if order_by is not None:
+        stmt = stmt.order_by(order_by)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return [dict(zip(fields, row)) for row in db.session.execute(stmt)]
+
+
+def _attach_includes(resource: str, rows: list, includes: list, hidden: set):
+    """Embed related records with one IN query per include."""
+    for name, inc in includes:
+        keys = {row[inc.local_key] for row in rows if row.get(inc.local_key) is not None}
+        fields = _parse_fields(inc.resource, request.args.get(f'fields[{inc.resource}]'))
+        query_fields = fields if inc.remote_key in fields else fields + [inc.remote_key]
+        related = []
+        if keys:
+            remote = _columns(inc.resource)[inc.remote_key]
+            related = _select_rows(inc.resource, query_fields, remote.in_(keys), order_by=_columns(inc.resource)['id'])
+
+        grouped = {}
+        for item in related:
+            key = item[inc.remote_key] if inc.remote_key in fields else item.pop(inc.remote_key)
+            grouped.setdefault(key, []).append(item)
+        for row in rows:
+            matches = grouped.get(row.get(inc.local_key), [])
+            row[name] = matches if inc.many else (matches[0] if matches else None)
+
+    for row in rows:
+        for key in hidden:
+            row.pop(key, None)
+
+
+def _fetch(resource: str, *conditions, limit=None) -> tuple:
+    """Load rows honoring fields and include parameters; return (rows, next_cursor)."""
+    if resource not in RESOURCES:
+        raise ApiError(f'Unknown resource: {resource}', 404)
+    fields = _parse_fields(resource, request.args.get('fields'))
+    includes = _parse_includes(resource)
+
+    # Keys needed to resolve includes or paginate but not requested by the client
+    needed = {'id'} | {inc.local_key for _, inc in includes}
+    hidden = {key for key in needed if key not in fields}
+    query_fields = fields + sorted(hidden)
+
+    rows = _select_rows(resource, query_fields, *conditions,
+                        order_by=_columns(resource)['id'], limit=limit)
+    next_cursor = rows[-1]['id'] if limit is not None and len(rows) == limit else None
+    _attach_includes(resource, rows, includes, hidden)
+    return rows, next_cursor
+
+
+@api_bp.route('/<resource>')
+def list_resource(resource):
+    """List records ordered by id, one keyset page at a time."""
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_LIMIT))
+    after = request.args.get('after', type=int)
+
+    conditions = []
+    if resource in RESOURCES and after is not None:
+        conditions.append(_columns(resource)['id'] > after)
+    rows, next_cursor = _fetch(resource, *conditions, limit=limit)
+    return json_response({'data': rows, 'next_cursor': next_cursor})
+
+
+@api_bp.route('/<resource>/<int:record_id>')
+def get_resource(resource, record_id):
+    """Return a single record."""
+    if resource not in RESOURCES:
+        raise ApiError(f'Unknown resource: {resource}', 404)
+    rows, _ = _fetch(resource, _columns(resource)['id'] == record_id)
+    if not rows:
+        raise ApiError(f'{resource} {record_id} not found', 404)
+    return json_response({'data': rows[0]})
+
+
+def _parse_timestamp(name: str):
+    """Read an ISO-8601 query parameter."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'{name} must be an ISO-8601 timestamp')
+
+
+def _parse_date(name: str):
+    """Read a YYYY-MM-DD query parameter."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'{name} must be a YYYY-MM-DD date')
+
+
+@api_bp.route('/audit')
+def audit_log():
+    """Change history filtered by entity (and id) and time range, newest first.
+
+    Page with ``before=<cursor>`` using ``next_cursor`` from the previous page.
+    """
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    before = None
+    if request.args.get('before'):
+        stamp, _, last_id = request.args['before'].rpartition('~')
+        try:
+            before = (datetime.fromisoformat(stamp), int(last_id))
+        except ValueError:
+            raise ApiError('Invalid before cursor')
+
+    entries = query_audit(entity=request.args.get('entity'),
+                          entity_id=request.args.get('entity_id', type=int),
+                          since=_parse_timestamp('since'), until=_parse_timestamp('until'),
+                          before=before, limit=limit)
+    data = [{'id': e.id, 'occurred_at': e.occurred_at, 'entity': e.entity, 'entity_id': e.entity_id,
+             'action': e.action, 'actor': e.actor, 'changes': json.loads(e.changes or '{}')}
+            for e in entries]
+    next_cursor = f'{entries[-1].occurred_at.isoformat()}~{entries[-1].id}' if len(entries) == limit else None
+    return json_response({'data': data, 'next_cursor': next_cursor})
+
+
+@api_bp.route('/changes')
+@primary_only
+def changes():
+    """Stream records created, updated or deleted since ``cursor`` as NDJSON.
+
+    Each line is ``{"resource", "op": "upsert", "data"}`` or ``{"resource",
+    "op": "delete", "id", "deleted_at"}``; the last line is ``{"cursor",
+    "has_more"}``. Without a cursor every current record is sent once, except
+    archived touchpoints, which the feed does not read. Pass
+    ``resources=a,b`` to sync a subset and ``limit`` (per resource) to size
+    pages; keep requesting with the returned cursor while ``has_more``.
+    A page without its cursor line was cut short and should be retried.
+
+    Reads stop at ``settled_until()``. On SQLite that is FEED_SETTLE_SECONDS
+    ago, so a write transaction left open longer than that may be skipped.
+    """
+    feed = {name: model for name, (model, _) in RESOURCES.items() if model.__tablename__ in FEED_TABLES}
+    names = [n.strip() for n in request.args.get('resources', '').split(',') if n.strip()] or list(feed)
+    unknown = [n for n in names if n not in feed]
+    if unknown:
+        raise ApiError(f"Unknown resource(s): {', '.join(unknown)}")
+    limit = max(1, min(request.args.get('limit', DEFAULT_FEED_LIMIT, type=int), MAX_FEED_LIMIT))
+    try:
+        positions = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        raise ApiError('Invalid cursor')
+    if cursor_expired(positions):
+        raise ApiError('Cursor is older than the tombstone retention period; resync without a cursor', 410)
+
+    until = settled_until()
+
+    def generate():
+        has_more = False
+        for name in names:
+            # A first sync sends current rows, so only later deletes matter
+            updated, deleted = positions.get(name, (None, (until, 0)))
+            count = 0
+            for row in changed_rows(feed[name], updated, until, limit):
+                yield _dumps({'resource': name, 'op': 'upsert', 'data': row._asdict()}) + b'\n'
+                updated = (row.updated_at, row.id)
+                count += 1
+            has_more |= count == limit
+            count = 0
+            for stone in deleted_rows(feed[name], deleted, until, limit):
+                yield _dumps({'resource': name, 'op': 'delete', 'id': stone.entity_id,
+                              'deleted_at': stone.deleted_at}) + b'\n'
+                deleted = (stone.deleted_at, stone.id)
+                count += 1
+            if count == limit:
+                has_more = True
+            elif deleted < (until, 0):
+                # Drained: move up so a quiet resource's cursor does not expire
+                deleted = (until, 0)
+            if updated is not None:
+                positions[name] = (updated, deleted)
+        yield _dumps({'cursor': encode_cursor(positions), 'has_more': has_more}) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-store'})
+
+
+@api_bp.route('/reports/activity')
+def activity_report():
+    """Touchpoint counts per week or month, read from the activity rollups.
+
+    ``group_by`` takes any of bucket, type and contact (default bucket,type);
+    ``type`` and ``contact_id`` filter, ``start`` and ``end`` bound the buckets.
+    """
+    period = request.args.get('period', 'month')
+    if period not in PERIODS:
+        raise ApiError(f"period must be one of: {', '.join(PERIODS)}")
+    group_by = [name for name in request.args.get('group_by', 'bucket,type').split(',') if name]
+    if not group_by or set(group_by) - set(GROUPS):
+        raise ApiError(f"group_by must be a subset of: {', '.join(GROUPS)}")
+    end = _parse_date('end') or date.today()
+    start = bucket_start(period, _parse_date('start') or default_start(period, end))
+    limit = request.args.get('limit', type=int)
+    rows = activity_counts(period, start, end, group_by,
+                           contact_id=request.args.get('contact_id', type=int),
+                           touchpoint_type=request.args.get('type') or None,
+                           limit=max(1, min(limit, MAX_LIMIT)) if limit else None)
+    return json_response({'period': period, 'start': start, 'end': end,
+                          'data': [dict(row._mapping) for row in rows]})
+
+
+@api_bp.route('/batch', methods=['POST'])
+def batch():
+    """Create or update many records keyed on external_id in one transaction."""
+    payload = request.get_json(silent=True)
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise ApiError('Body must be {"operations": [...]} with at least one operation')
+    if len(operations) > MAX_BATCH_SIZE:
+        raise ApiError(f'At most {MAX_BATCH_SIZE} operations per batch')
+
+    try:
+        results = apply_batch(operations)
+    except Exception as e:
+        raise ApiError(f'Batch rolled back: {e}', 409)
+    failed = sum(1 for r in results if r['status'] == 'error')
+    return json_response({'results': results, 'failed': failed}, 207 if failed else 200)
+
+
+@api_bp.route('/<resource>/bulk_delete', methods=['POST'])
+def bulk_delete(resource):
+    """Delete many records by id (``{"ids": [...]}``); related rows cascade."""
+    if resource not in DELETABLE_MODELS:
+        raise ApiError(f"Bulk delete supports: {', '.join(DELETABLE_MODELS)}", 404)
+    payload = request.get_json(silent=True) or {}
+    ids = payload.get('ids')
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        raise ApiError('Body must be {"ids": [<int>, ...]}')
+    if len(ids) > MAX_BATCH_SIZE:
+        raise ApiError(f'At most {MAX_BATCH_SIZE} ids per request')
+    try:
+        deleted = delete_records(DELETABLE_MODELS[resource], ids)
+    except Exception as e:
+        db.session.rollback()
+        raise ApiError(f'Delete failed: {e}', 409)
+    return json_response({'deleted': deleted})
+
+
+@api_bp.route('/geo/properties')
+def geo_properties():
+    """Find properties by radius (zip or lat/lon plus radius) or bbox."""
+    bbox = request.args.get('bbox')
+    if bbox:
+        try:
+            min_lat, min_lon, max_lat, max_lon = [float(v) for v in bbox.split(',')]
+        except ValueError:
+            raise ApiError('bbox must be min_lat,min_lon,max_lat,max_lon')
+        rows = properties_in_bbox(min_lat, min_lon, max_lat, max_lon)
+        return json_response({'data': [{'id': r.id, 'latitude': r.latitude, 'longitude': r.longitude}
+                                       for r in rows]})
+
+    radius = request.args.get('radius', 5.0, type=float)
+    if request.args.get('zip'):
+        center = geocode_zip(request.args['zip'])
+        if center is None:
+            raise ApiError(f"Unknown ZIP code: {request.args['zip']}", 404)
+    else:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        if lat is None or lon is None:
+            raise ApiError('Provide zip, lat and lon, or bbox')
+        center = (lat, lon)
+
+    found = properties_within_radius(center[0], center[1], radius)
+    data = [{'id': pid, 'distance_miles': round(dist, 3)}
+            for pid, dist in sorted(found.items(), key=lambda item: item[1])]
+    return json_response({'center': list(center), 'radius_miles': radius, 'data': data})
+
+
+def _parse_node(value: str) -> tuple:
+    """Parse a 'kind:id' node reference such as 'contacts:12'."""
+    kind, _, record_id = (value or '').partition(':')
+    if kind not in NODE_KINDS or not record_id.isdigit():
+        raise ApiError(f"Node must look like <{'|'.join(NODE_KINDS)}>:<id>")
+    return kind, int(record_id)
+
+
+@api_bp.route('/graph/<kind>/<int:record_id>/neighbors')
+def graph_neighbors(kind, record_id):
+    """Records within ``hops`` (default 2) of a contact, property or deal."""
+    if kind not in NODE_KINDS:
+        raise ApiError(f'Unknown node type: {kind}', 404)
+    hops = request.args.get('hops', 2, type=int)
+    kinds = [k for k in request.args.get('types', '').split(',') if k] or None
+    if kinds and set(kinds) - set(NODE_KINDS):
+        raise ApiError(f"types must be a subset of: {', '.join(NODE_KINDS)}")
+    found = relationship_graph.neighborhood(kind, record_id, hops, kinds)
+    return json_response({'node': {'type': kind, 'id': record_id}, 'hops': min(max(hops, 1), MAX_HOPS),
+                          'data': [{'type': k, 'id': i, 'hops': d} for (k, i), d in found]})
+
+
+@api_bp.route('/graph/path')
+def graph_path():
+    """Shortest relationship path between two nodes (``from`` and ``to``)."""
+    source = _parse_node(request.args.get('from'))
+    target = _parse_node(request.args.get('to'))
+    max_hops = max(1, min(request.args.get('max_hops', 6, type=int), 12))
+    path = relationship_graph.shortest_path(source, target, max_hops)
+    if not path:
+        raise ApiError(f'No path within {max_hops} hops', 404)
+    return json_response({'hops': len(path) - 1, 'path': [{'type': k, 'id': i} for k, i in path]})
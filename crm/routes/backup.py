@@ -1,11 +1,16 @@
 """
 Backup and export routes.
 """
-from flask import Blueprint, send_file, Response
+from datetime import datetime
+from flask import Blueprint, send_file, request, redirect, url_for, flash
+from crm.audit import record_changes
 from crm.db import db
 import os
 import csv
+import tempfile
 from io import StringIO
+from crm.dedupe import index_contacts
+from crm.jobs import enqueue, job_handler
 from crm.models import Contact, Property, Task, Touchpoint
 
 backup_bp = Blueprint('backup', __name__, url_prefix='/backup')
@@ -24,10 +29,62 @@ def download_db():
     return "Database file not found", 404
 
 
-@backup_bp.route('/export_contacts')
+@backup_bp.route('/export_contacts', methods=['POST'])
 def export_contacts():
+    """Queue a contacts CSV export."""
+    job = enqueue('export_contacts')
+    return redirect(url_for('jobs.detail', job_id=job.id))
+
+
+@backup_bp.route('/export_properties', methods=['POST'])
+def export_properties():
+    """Queue a properties CSV export."""
+    job = enqueue('export_properties')
+    return redirect(url_for('jobs.detail', job_id=job.id))
+
+
+@backup_bp.route('/import_contacts', methods=['POST'])
+def import_contacts():
+    """Queue a bulk contact import from an uploaded CSV file."""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Please choose a CSV file to import.', 'error')
+        return redirect(url_for('jobs.index'))
+    
+    try:
+        content = upload.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        flash('CSV file must be UTF-8 encoded.', 'error')
+        return redirect(url_for('jobs.index'))
+    
+    job = enqueue('import_contacts', csv=content)
+    return redirect(url_for('jobs.detail', job_id=job.id))
+
+
+@backup_bp.route('/import_email', methods=['POST'])
+def import_email():
+    """Queue an import of uploaded mbox/.eml files as Email touchpoints."""
+    uploads = [upload for upload in request.files.getlist('files') if upload.filename]
+    if not uploads:
+        flash('Please choose an mbox or .eml file to import.', 'error')
+        return redirect(url_for('jobs.index'))
+    
+    # Archives can be large: stream them to disk and pass the job their paths
+    paths = []
+    for upload in uploads:
+        handle, path = tempfile.mkstemp(prefix='crm-mail-', suffix=os.path.splitext(upload.filename)[1])
+        with os.fdopen(handle, 'wb') as out:
+            upload.save(out)
+        paths.append(path)
+    
+    job = enqueue('import_email', paths=paths)
+    return redirect(url_for('jobs.detail', job_id=job.id))
+
+
+@job_handler('export_contacts')
+def build_contacts_csv(params: dict) -> dict:
     """Export contacts as CSV."""
-    contacts = Contact.query.all()
+    contacts = Contact.query.order_by(Contact.id).all()
     contacts_csv = StringIO()
     writer = csv.writer(contacts_csv)
     writer.writerow(['ID', 'Name', 'Company', 'Role', 'Phone', 'Email', 'Tags', 'Created'])
@@ -43,17 +100,18 @@ def export_contacts():
             contact.created_at.strftime('%Y-%m-%d %H:%M:%S')
         ])
     
-    return Response(
-        contacts_csv.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=contacts_export.csv'}
-    )
+    return {
+        'data': contacts_csv.getvalue().encode('utf-8'),
+        'filename': 'contacts_export.csv',
+        'mimetype': 'text/csv',
+        'message': f'Exported {len(contacts)} contacts.'
+    }
 
 
-@backup_bp.route('/export_properties')
-def export_properties():
+@job_handler('export_properties')
+def build_properties_csv(params: dict) -> dict:
     """Export properties as CSV."""
-    properties = Property.query.all()
+    properties = Property.query.order_by(Property.id).all()
     properties_csv = StringIO()
     writer = csv.writer(properties_csv)
     writer.writerow(['ID', 'Name', 'Address', 'City', 'State', 'Zip', 'Units', 'Year Built', 'Class', 'Est. Value Min', 'Est. Value Max', 'Created'])
@@ -73,9 +131,42 @@ def export_properties():
             prop.created_at.strftime('%Y-%m-%d %H:%M:%S')
         ])
     
-    return Response(
-        properties_csv.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=properties_export.csv'}
-    )
+    return {
+        'data': properties_csv.getvalue().encode('utf-8'),
+        'filename': 'properties_export.csv',
+        'mimetype': 'text/csv',
+        'message': f'Exported {len(properties)} properties.'
+    }
+
 
+@job_handler('import_contacts')
+def import_contacts_csv(params: dict) -> dict:
+    """Import contacts from CSV using the same columns as the export."""
+    reader = csv.DictReader(StringIO(params.get('csv', '')))
+    rows = []
+    skipped = 0
+    now = datetime.utcnow()
+    for row in reader:
+        name = (row.get('Name') or '').strip()
+        if not name:
+            skipped += 1
+            continue
+        rows.append({
+            'name': name,
+            'company': (row.get('Company') or '').strip() or None,
+            'role_type': (row.get('Role') or '').strip() or None,
+            'phone': (row.get('Phone') or '').strip() or None,
+            'email': (row.get('Email') or '').strip() or None,
+            'tags': (row.get('Tags') or '').strip() or None,
+            'created_at': now,
+            'updated_at': now,
+        })
+    
+    # One multi-row INSERT instead of a flush per contact
+    if rows:
+        new_ids = db.session.execute(db.insert(Contact).returning(Contact.id), rows).scalars().all()
+        record_changes(Contact.__table__, new_ids)
+        index_contacts(new_ids)
+    db.session.commit()
+    
+    return {'message': f'Imported {len(rows)} contacts, skipped {skipped} rows without a name.'}
@@ -2,8 +2,16 @@
 Contact routes for CRUD operations.
 """
 from flask import Blueprint, request, render_template, redirect, url_for, flash
+from crm.archive import contact_touchpoints
 from crm.db import db
-from crm.models import Contact, Task, Touchpoint, PropertyOwner, Property
+from crm.dedupe import find_duplicates, find_candidates, merge_contacts, dismiss_pair, rebuild_match_keys
+from crm.deletes import delete_records
+from crm.fanout import fan_out
+from crm.jobs import enqueue
+from crm.ownership import sync_contact_properties
+from crm.models import Contact, ContactMatchKey, Task, PropertyOwner, Property
+from crm.graph import relationship_graph
+from crm.portfolio import largest_owners, PAGE_SIZE, RANKINGS
 
 contacts_bp = Blueprint('contacts', __name__, url_prefix='/contacts')
 
@@ -18,27 +26,38 @@ def list_contacts():
 @contacts_bp.route('/<int:contact_id>')
 def detail(contact_id):
     """Show contact detail page."""
-    contact = Contact.query.get_or_404(contact_id)
-    
-    # Get properties this contact owns
-    property_ownerships = PropertyOwner.query.filter_by(contact_id=contact_id).all()
+    touchpoint_limit = min(max(request.args.get('touchpoints', 20, type=int), 1), 500)
     
-    # Get open tasks for this contact
-    open_tasks = Task.query.filter_by(
-        contact_id=contact_id,
-        status='Open'
-    ).order_by(Task.due_date).all()
+    def related_contacts():
+        # Co-owners and deal counterparties from the in-memory graph
+        related = relationship_graph.related_contacts(contact_id)
+        names = dict(db.session.execute(
+            db.select(Contact.id, Contact.name).where(Contact.id.in_([r[0] for r in related]))
+        ).all()) if related else {}
+        return [(cid, names[cid], hops, shared) for cid, hops, shared in related if cid in names]
     
-    # Get recent touchpoints
-    touchpoints = Touchpoint.query.filter_by(contact_id=contact_id).order_by(
-        Touchpoint.occurred_at.desc()
-    ).limit(20).all()
+    # Independent queries run concurrently; each loads what the template needs
+    contact, property_ownerships, open_tasks, touchpoints, related_contacts = fan_out(
+        # Portfolio rollup is loaded in the same query
+        lambda: Contact.query.options(db.joinedload(Contact.portfolio)).filter_by(id=contact_id).first_or_404(),
+        # Properties this contact owns
+        lambda: PropertyOwner.query.options(db.joinedload(PropertyOwner.property)).filter_by(
+            contact_id=contact_id
+        ).all(),
+        # Open tasks for this contact
+        lambda: Task.query.filter_by(contact_id=contact_id, status='Open').order_by(Task.due_date).all(),
+        # Recent touchpoints; archive years are only read when paging further back
+        lambda: contact_touchpoints(contact_id, touchpoint_limit),
+        related_contacts,
+    )
     
     return render_template('contacts/detail.html',
                          contact=contact,
                          property_ownerships=property_ownerships,
                          open_tasks=open_tasks,
-                         touchpoints=touchpoints)
+                         touchpoints=touchpoints,
+                         touchpoint_limit=touchpoint_limit,
+                         related_contacts=related_contacts)
 
 
 @contacts_bp.route('/create', methods=['GET', 'POST'])
@@ -61,7 +80,7 @@ def create():
         tags = request.form.get('tags', '').strip() or None
         
         # Get selected property IDs (multi-select)
-        property_ids = request.form.getlist('properties')
+        property_ids = [int(pid) for pid in request.form.getlist('properties') if pid]
         
         if not name:
             flash('Name is required.', 'error')
@@ -81,17 +100,16 @@ def create():
         db.session.flush()  # Get the contact ID before committing
         
         # Create property ownership relationships
-        for prop_id in property_ids:
-            if prop_id:
-                ownership = PropertyOwner(
-                    property_id=int(prop_id),
-                    contact_id=contact.id
-                )
-                db.session.add(ownership)
+        sync_contact_properties(contact.id, property_ids)
         
         db.session.commit()
         
         flash('Contact created successfully.', 'success')
+        
+        # Incremental duplicate check against contacts sharing a blocking key
+        for score, other in find_candidates(contact.id)[:3]:
+            flash(f'Possible duplicate of {other.name} (contact #{other.id}, {score:.0%} match). '
+                  f'Review it under Contacts > Duplicates.', 'warning')
         return redirect(url_for('contacts.detail', contact_id=contact.id))
     
     except Exception as e:
@@ -109,7 +127,9 @@ def edit(contact_id):
     properties = Property.query.order_by(Property.name, Property.address).all()
     
     # Get currently owned property IDs for pre-selecting in the form
-    owned_property_ids = [po.property_id for po in contact.property_ownerships]
+    owned_property_ids = db.session.execute(
+        db.select(PropertyOwner.property_id).where(PropertyOwner.contact_id == contact_id)
+    ).scalars().all()
     
     if request.method == 'GET':
         return render_template('contacts/edit.html', 
@@ -134,19 +154,9 @@ def edit(contact_id):
             flash('Name is required.', 'error')
             return redirect(url_for('contacts.edit', contact_id=contact_id))
         
-        # Update property ownerships: remove old ones not in the new list
-        for ownership in contact.property_ownerships[:]:
-            if ownership.property_id not in property_ids:
-                db.session.delete(ownership)
-        
-        # Add new property ownerships
-        for prop_id in property_ids:
-            if prop_id not in owned_property_ids:
-                ownership = PropertyOwner(
-                    property_id=prop_id,
-                    contact_id=contact.id
-                )
-                db.session.add(ownership)
+        # Update property ownerships with one DELETE and one INSERT
+        db.session.flush()
+        sync_contact_properties(contact.id, property_ids)
         
         db.session.commit()
         
@@ -162,11 +172,94 @@ def edit(contact_id):
 @contacts_bp.route('/<int:contact_id>/delete', methods=['POST'])
 def delete(contact_id):
     """Delete a contact."""
-    contact = Contact.query.get_or_404(contact_id)
+    Contact.query.get_or_404(contact_id)
     
-    db.session.delete(contact)
-    db.session.commit()
+    # Related rows are removed by ON DELETE CASCADE
+    delete_records(Contact, [contact_id])
     
     flash('Contact deleted.', 'success')
     return redirect(url_for('contacts.list_contacts'))
 
+
+@contacts_bp.route('/bulk_delete', methods=['POST'])
+def bulk_delete():
+    """Delete the selected contacts with set-based statements."""
+    contact_ids = [int(cid) for cid in request.form.getlist('contact_ids') if cid.isdigit()]
+    if not contact_ids:
+        flash('Select at least one contact.', 'error')
+        return redirect(url_for('contacts.list_contacts'))
+    
+    try:
+        count = delete_records(Contact, contact_ids)
+        flash(f'Deleted {count} contact(s).', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error deleting contacts: {str(e)}', 'error')
+    return redirect(url_for('contacts.list_contacts'))
+
+
+
+@contacts_bp.route('/duplicates')
+def duplicates():
+    """List suspected duplicate contacts."""
+    # Existing databases start with an empty blocking index
+    if not db.session.query(ContactMatchKey.key).limit(1).first() and Contact.query.limit(1).first():
+        rebuild_match_keys()
+    
+    pairs = find_duplicates()
+    return render_template('contacts/duplicates.html', pairs=pairs)
+
+
+@contacts_bp.route('/duplicates/merge', methods=['POST'])
+def merge():
+    """Merge one contact into another."""
+    keep_id = request.form.get('keep_id', type=int)
+    merge_id = request.form.get('merge_id', type=int)
+    
+    try:
+        merge_contacts(keep_id, merge_id)
+        flash('Contacts merged.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error merging contacts: {str(e)}', 'error')
+    
+    return redirect(request.referrer or url_for('contacts.duplicates'))
+
+
+@contacts_bp.route('/duplicates/dismiss', methods=['POST'])
+def dismiss():
+    """Mark a suspected pair as not duplicates."""
+    contact_id = request.form.get('contact_id', type=int)
+    other_id = request.form.get('other_id', type=int)
+    
+    if contact_id and other_id:
+        dismiss_pair(contact_id, other_id)
+        flash('Pair dismissed.', 'success')
+    return redirect(url_for('contacts.duplicates'))
+
+
+@contacts_bp.route('/duplicates/rebuild', methods=['POST'])
+def rebuild_duplicate_index():
+    """Rebuild the duplicate blocking index in the background."""
+    job = enqueue('rebuild_match_keys')
+    return redirect(url_for('jobs.detail', job_id=job.id))
+
+
+@contacts_bp.route('/owners')
+def owners():
+    """Rank owners by portfolio value or units."""
+    rank_by = request.args.get('rank_by', 'value')
+    if rank_by not in RANKINGS:
+        rank_by = 'value'
+    page = max(request.args.get('page', 1, type=int), 1)
+    rows, total = largest_owners(rank_by, page)
+    pages = max((total + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    return render_template('contacts/owners.html', rows=rows, rank_by=rank_by,
+                           page=page, pages=pages, offset=(page - 1) * PAGE_SIZE)
+
+
+@contacts_bp.route('/owners/rebuild', methods=['POST'])
+def rebuild_owner_portfolios():
+    """Recompute every owner rollup in the background."""
+    job = enqueue('rebuild_portfolios')
+    return redirect(url_for('jobs.detail', job_id=job.id))
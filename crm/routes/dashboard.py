@@ -4,7 +4,9 @@ Dashboard routes.
 from datetime import date, datetime
 from flask import Blueprint, render_template, request
 from crm.db import db
+from crm.fanout import fan_out
 from crm.models import Task, TaskStatus, Contact, Property, Touchpoint
+from crm.scheduling import materialize_recurring_tasks, wake_snoozed_tasks
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -15,26 +17,53 @@ def index():
     today = date.today()
     status_filter = request.args.get('status', 'Open')
     
-    # Calculate statistics for dashboard cards
-    all_tasks = Task.query.all()
-    open_tasks = [t for t in all_tasks if t.status == TaskStatus.OPEN.value]
-    overdue_count = sum(1 for t in open_tasks if t.due_date < today)
-    due_today_count = sum(1 for t in open_tasks if t.due_date == today)
-    snoozed_count = sum(1 for t in all_tasks if t.status == TaskStatus.SNOOZED.value)
-    completed_count = sum(1 for t in all_tasks if t.status == TaskStatus.DONE.value)
+    # Reopen tasks whose snooze has expired (cached, usually no query)
+    wake_snoozed_tasks()
     
-    # Get entity counts
-    contact_count = Contact.query.count()
-    property_count = Property.query.count()
+    # Create upcoming occurrences of recurring tasks (indexed, usually a no-op)
+    materialize_recurring_tasks(today)
     
-    # Get recent touchpoints for activity feed
-    recent_touchpoints = Touchpoint.query.order_by(
-        Touchpoint.occurred_at.desc()
-    ).limit(5).all()
+    # Filter tasks for display; rows are cached on their related records'
+    # versions, so load those with the tasks rather than one query per row
+    query = Task.query.options(
+        db.joinedload(Task.contact), db.joinedload(Task.deal), db.joinedload(Task.related_property)
+    )
+    
+    if status_filter == 'All':
+        pass
+    elif status_filter in [s.value for s in TaskStatus]:
+        query = query.filter(Task.status == status_filter)
+    else:
+        query = query.filter(Task.status == TaskStatus.OPEN.value)
+        status_filter = 'Open'
+    
+    def task_counts():
+        # Statistics for dashboard cards, counted in the database
+        is_open = Task.status == TaskStatus.OPEN.value
+        return db.session.execute(db.select(
+            db.func.count().filter(is_open),
+            db.func.count().filter(is_open, Task.due_date < today),
+            db.func.count().filter(is_open, Task.due_date == today),
+            db.func.count().filter(Task.status == TaskStatus.SNOOZED.value),
+            db.func.count().filter(Task.status == TaskStatus.DONE.value),
+        )).one()
+    
+    # Independent queries run concurrently; the task list stays on this thread
+    tasks, counts, contact_count, property_count, recent_touchpoints = fan_out(
+        lambda: query.order_by(Task.due_date, Task.priority.desc()).all(),
+        task_counts,
+        lambda: Contact.query.count(),
+        lambda: Property.query.count(),
+        # Recent touchpoints for activity feed
+        lambda: Touchpoint.query.options(db.joinedload(Touchpoint.contact)).order_by(
+            Touchpoint.occurred_at.desc()
+        ).limit(5).all(),
+    )
     
     # Build stats dictionary
+    open_count, overdue_count, due_today_count, snoozed_count, completed_count = counts
     stats = {
-        'open': len(open_tasks),
+        'open': open_count,
         'overdue': overdue_count,
         'due_today': due_today_count,
         'snoozed': snoozed_count,
@@ -43,19 +72,6 @@ def index():
         'properties': property_count,
     }
     
-    # Filter tasks for display
-    query = Task.query
-    
-    if status_filter == 'All':
-        pass
-    elif status_filter in [s.value for s in TaskStatus]:
-        query = query.filter(Task.status == status_filter)
-    else:
-        query = query.filter(Task.status == TaskStatus.OPEN.value)
-        status_filter = 'Open'
-        
-    tasks = query.order_by(Task.due_date, Task.priority.desc()).all()
-    
     return render_template('dashboard.html', 
                          tasks=tasks,
                          today=today,
@@ -0,0 +1,30 @@
+"""
+Health check for load balancers and the process supervisor.
+"""
+import os
+import time
+from flask import Blueprint, jsonify
+from sqlalchemy.exc import SQLAlchemyError
+from crm.db import db
+from crm.replicas import primary_only
+
+health_bp = Blueprint('health', __name__)
+
+# A database round trip slower than this marks the worker unhealthy
+MAX_DB_MS = float(os.environ.get('HEALTHZ_MAX_DB_MS', 1000))
+
+
+@health_bp.route('/healthz')
+@primary_only
+def healthz():
+    """Report whether this worker can reach the database, and how fast."""
+    started = time.perf_counter()
+    try:
+        db.session.execute(db.text('SELECT 1'))
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'error': type(e).__name__, 'pid': os.getpid()}), 503
+    latency_ms = round((time.perf_counter() - started) * 1000, 2)
+    status = 'ok' if latency_ms <= MAX_DB_MS else 'slow'
+    body = {'status': status, 'db_latency_ms': latency_ms, 'pid': os.getpid()}
+    return jsonify(body), 200 if status == 'ok' else 503
@@ -0,0 +1,72 @@
+"""
+Background job routes: status polling and result download.
+
+Job pages read the primary: workers update jobs while clients poll them.
+"""
+from flask import Blueprint, render_template, redirect, url_for, jsonify, Response
+from crm.db import db
+from crm.jobs import enqueue
+from crm.models import Job, JobStatus
+from crm.replicas import primary_only
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+
+@jobs_bp.route('/')
+def index():
+    """List recent jobs with import and maintenance actions."""
+    jobs = Job.query.with_entities(
+        Job.id, Job.kind, Job.status, Job.message, Job.created_at, Job.finished_at
+    ).order_by(Job.created_at.desc()).limit(50).all()
+    return render_template('jobs/list.html', jobs=jobs)
+
+
+@jobs_bp.route('/<int:job_id>')
+@primary_only
+def detail(job_id):
+    """Show a job status page that polls until the job finishes."""
+    job = Job.query.get_or_404(job_id)
+    return render_template('jobs/detail.html', job=job)
+
+
+@jobs_bp.route('/<int:job_id>/status')
+@primary_only
+def status(job_id):
+    """Return job status as JSON for polling."""
+    job = Job.query.get_or_404(job_id)
+    return jsonify({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'message': job.message,
+        'finished': job.is_finished,
+        'download_url': url_for('jobs.download', job_id=job.id) if job.result_filename else None,
+    })
+
+
+@jobs_bp.route('/<int:job_id>/download')
+@primary_only
+def download(job_id):
+    """Download the output produced by a finished job."""
+    job = Job.query.get_or_404(job_id)
+    if job.status != JobStatus.DONE.value or job.result is None:
+        return "Job result not available", 404
+    return Response(
+        job.result,
+        mimetype=job.result_mimetype or 'application/octet-stream',
+        headers={'Content-Disposition': f'attachment; filename={job.result_filename}'}
+    )
+
+
+@jobs_bp.route('/maintenance', methods=['POST'])
+def maintenance():
+    """Queue database maintenance (VACUUM/ANALYZE)."""
+    job = enqueue('maintenance')
+    return redirect(url_for('jobs.detail', job_id=job.id))
+
+
+@jobs_bp.route('/archive', methods=['POST'])
+def archive():
+    """Queue archival of touchpoints past the retention horizon."""
+    job = enqueue('archive_touchpoints')
+    return redirect(url_for('jobs.detail', job_id=job.id))
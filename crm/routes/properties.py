@@ -2,8 +2,12 @@
 Property routes for CRUD operations.
 """
 from decimal import Decimal, InvalidOperation
-from flask import Blueprint, request, render_template, redirect, url_for, flash
+from flask import Blueprint, request, render_template, redirect, url_for, flash, jsonify
+from crm.comps import comps_index, DEFAULT_WEIGHTS
 from crm.db import db
+from crm.deletes import delete_records
+from crm.fanout import fan_out
+from crm.geo import geocode_zip, properties_within_radius, properties_in_bbox
 from crm.models import Property, Contact, PropertyOwner
 from sqlalchemy.orm import joinedload
 
@@ -135,6 +139,9 @@ def list_properties():
     city = request.args.get('city', '').strip()
     min_units_str = request.args.get('min_units', '').strip()
     max_units_str = request.args.get('max_units', '').strip()
+    near = request.args.get('near', '').strip()
+    radius_str = request.args.get('radius', '').strip()
+    bbox_str = request.args.get('bbox', '').strip()
     
     # Sorting parameters
     sort_by = request.args.get('sort_by', 'created_at')
@@ -161,6 +168,28 @@ def list_properties():
         min_units = None
         max_units = None
 
+    # Resolve location filters to candidate ids via the spatial index
+    distances = None
+    if near:
+        try:
+            radius = float(radius_str) if radius_str else 5.0
+        except ValueError:
+            flash('Radius must be a number of miles.', 'error')
+            radius = 5.0
+        center = geocode_zip(near)
+        if center:
+            distances = properties_within_radius(center[0], center[1], radius)
+        else:
+            flash(f'Unknown ZIP code: {near}', 'error')
+    
+    bbox_ids = None
+    if bbox_str:
+        try:
+            min_lat, min_lon, max_lat, max_lon = [float(v) for v in bbox_str.split(',')]
+            bbox_ids = [row.id for row in properties_in_bbox(min_lat, min_lon, max_lat, max_lon)]
+        except ValueError:
+            flash('Bounding box must be min_lat,min_lon,max_lat,max_lon.', 'error')
+    
     # Define sortable fields
     valid_sort_fields = {
         'name': Property.name,
@@ -192,6 +221,10 @@ def list_properties():
         query = query.filter(Property.units >= min_units)
     if max_units is not None:
         query = query.filter(Property.units <= max_units)
+    if distances is not None:
+        query = query.filter(Property.id.in_(list(distances)))
+    if bbox_ids is not None:
+        query = query.filter(Property.id.in_(bbox_ids))
         
     # Apply sorting
     if sort_order == 'asc':
@@ -204,11 +237,15 @@ def list_properties():
     # Add owner information to each property for convenience in template
     for prop in properties:
         prop.owners_list = [ownership.contact.name for ownership in prop.owners]
+        prop.distance_miles = distances.get(prop.id) if distances is not None else None
 
     query_filters = {
         'city': city,
         'min_units': min_units_str,
         'max_units': max_units_str,
+        'near': near,
+        'radius': radius_str,
+        'bbox': bbox_str,
         'sort_by': sort_by,
         'sort_order': sort_order
     }
@@ -218,16 +255,54 @@ def list_properties():
 @properties_bp.route('/<int:property_id>')
 def detail(property_id):
     """Show property detail page."""
-    property_obj = Property.query.get_or_404(property_id)
-
-    # Get owners and all contacts for dropdown
-    owners = property_obj.owners
-    all_contacts = Contact.query.order_by(Contact.name).all()
+    def similar_properties():
+        # Most similar properties for underwriting
+        comp_scores = dict(comps_index.find(property_id, k=5))
+        return sorted(Property.query.filter(Property.id.in_(comp_scores)).all(),
+                      key=lambda p: comp_scores[p.id]) if comp_scores else []
+
+    # Independent queries run concurrently; the contact dropdown stays on this thread
+    all_contacts, property_obj, owners, comps = fan_out(
+        lambda: Contact.query.order_by(Contact.name).all(),
+        lambda: db.get_or_404(Property, property_id),
+        lambda: PropertyOwner.query.options(joinedload(PropertyOwner.contact)).filter_by(
+            property_id=property_id
+        ).all(),
+        similar_properties,
+    )
 
     return render_template('properties/detail.html',
                          property=property_obj,
                          owners=owners,
-                         all_contacts=all_contacts)
+                         all_contacts=all_contacts,
+                         comps=comps)
+
+
+@properties_bp.route('/<int:property_id>/comps')
+def comps(property_id):
+    """Return the most comparable properties as JSON.
+
+    Query parameters: k (default 10, max 100) and optional weights
+    w_units, w_year_built, w_property_class, w_value, w_location.
+    """
+    Property.query.get_or_404(property_id)
+    k = max(1, min(request.args.get('k', 10, type=int), 100))
+    weights = {}
+    for feature in DEFAULT_WEIGHTS:
+        value = request.args.get(f'w_{feature}', type=float)
+        if value is not None:
+            weights[feature] = value
+    
+    results = comps_index.find(property_id, k=k, weights=weights)
+    rows = {row.id: row for row in db.session.execute(
+        db.select(Property.id, Property.name, Property.address, Property.city, Property.state,
+                  Property.units, Property.year_built, Property.property_class)
+        .where(Property.id.in_([pid for pid, _ in results]))
+    )} if results else {}
+    return jsonify({
+        'property_id': property_id,
+        'comps': [{**rows[pid]._asdict(), 'distance': round(score, 4)} for pid, score in results if pid in rows],
+    })
 
 
 @properties_bp.route('/<int:property_id>/edit', methods=['GET', 'POST'])
@@ -352,11 +427,11 @@ def edit(property_id):
 @properties_bp.route('/<int:property_id>/delete', methods=['POST'])
 def delete(property_id):
     """Delete a property."""
-    property_obj = Property.query.get_or_404(property_id)
+    Property.query.get_or_404(property_id)
 
     try:
-        db.session.delete(property_obj)
-        db.session.commit()
+        # Owners, deals and their children are removed by ON DELETE CASCADE
+        delete_records(Property, [property_id])
 
         flash('Property deleted successfully.', 'success')
         return redirect(url_for('properties.list_properties'))
@@ -367,6 +442,23 @@ def delete(property_id):
         return redirect(url_for('properties.detail', property_id=property_id))
 
 
+@properties_bp.route('/bulk_delete', methods=['POST'])
+def bulk_delete():
+    """Delete the selected properties with set-based statements."""
+    property_ids = [int(pid) for pid in request.form.getlist('property_ids') if pid.isdigit()]
+    if not property_ids:
+        flash('Select at least one property.', 'error')
+        return redirect(url_for('properties.list_properties'))
+
+    try:
+        count = delete_records(Property, property_ids)
+        flash(f'Deleted {count} propert{"y" if count == 1 else "ies"}.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error deleting properties: {str(e)}', 'error')
+    return redirect(url_for('properties.list_properties'))
+
+
 @properties_bp.route('/<int:property_id>/add_owner', methods=['POST'])
 def add_owner(property_id):
     """Add an owner to a property."""
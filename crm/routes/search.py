@@ -2,6 +2,7 @@
 Search routes for global search functionality.
 """
 from flask import Blueprint, render_template, request
+from crm.archive import search_touchpoints
 from crm.db import db
 from crm.models import Contact, Property
 
@@ -10,13 +11,14 @@ search_bp = Blueprint('search', __name__, url_prefix='/search')
 
 @search_bp.route('/')
 def search():
-    """Global search across contacts and properties."""
+    """Global search across contacts, properties and touchpoints."""
     query = request.args.get('q', '').strip()
     
     if not query:
         return render_template('search/results.html', 
                              contacts=[], 
                              properties=[], 
+                             touchpoints=[],
                              query='')
     
     # Search contacts
@@ -37,8 +39,12 @@ def search():
         )
     ).limit(20).all()
     
+    # Search touchpoint notes, including archived years
+    touchpoints = search_touchpoints(query)
+    
     return render_template('search/results.html',
                          contacts=contacts,
                          properties=properties,
+                         touchpoints=touchpoints,
                          query=query)
 
@@ -1,10 +1,13 @@
 """
 Task routes for CRUD operations.
 """
+import secrets
 from datetime import date, datetime
-from flask import Blueprint, request, redirect, url_for, flash, render_template
+from flask import Blueprint, Response, request, redirect, url_for, flash, render_template, stream_with_context
 from crm.db import db
-from crm.models import Task, TaskStatus, TaskPriority, Deal, Contact, Property
+from crm.ics import cached_body, lookup_feed, render_feed
+from crm.models import Task, TaskStatus, TaskPriority, RecurrenceUnit, Deal, Contact, Property, CalendarFeed
+from crm.scheduling import start_recurrence, snooze_until_from, note_snooze, occurrence_date
 
 tasks_bp = Blueprint('tasks', __name__, url_prefix='/tasks')
 
@@ -30,6 +33,7 @@ def create():
                              contacts=contacts,
                              deals=deals,
                              properties=properties,
+                             recurrence_units=RecurrenceUnit,
                              today=date.today())
     
     # POST - create task
@@ -40,6 +44,8 @@ def create():
         deal_id = request.form.get('deal_id', type=int) or None
         contact_id = request.form.get('contact_id', type=int) or None
         property_id = request.form.get('property_id', type=int) or None
+        recurrence_interval = request.form.get('recurrence_interval', type=int) or None
+        recurrence_unit = request.form.get('recurrence_unit', '').strip() or None
         
         if not description:
             flash('Task description is required.', 'error')
@@ -64,6 +70,7 @@ def create():
             property_id=property_id,
             status=TaskStatus.OPEN.value
         )
+        start_recurrence(task, recurrence_interval, recurrence_unit)
         
         db.session.add(task)
         db.session.commit()
@@ -91,7 +98,8 @@ def edit(task_id):
                              task=task,
                              contacts=contacts,
                              deals=deals,
-                             properties=properties)
+                             properties=properties,
+                             recurrence_units=RecurrenceUnit)
     
     # POST - update task
     try:
@@ -114,6 +122,22 @@ def edit(task_id):
                 flash('Invalid date format.', 'error')
                 return redirect(url_for('tasks.edit', task_id=task_id))
         
+        if task.status == TaskStatus.SNOOZED.value:
+            try:
+                task.snoozed_until = snooze_until_from(request.form.get('snooze_until', '').strip())
+            except ValueError:
+                flash('Invalid snooze date.', 'error')
+                return redirect(url_for('tasks.edit', task_id=task_id))
+            note_snooze(task.snoozed_until)
+        else:
+            task.snoozed_until = None
+        
+        # Only the series root carries the recurrence rule
+        if task.series_id is None:
+            start_recurrence(task,
+                             request.form.get('recurrence_interval', type=int) or None,
+                             request.form.get('recurrence_unit', '').strip() or None)
+        
         db.session.commit()
         flash('Task updated successfully.', 'success')
         return redirect(url_for('dashboard.index'))
@@ -130,6 +154,7 @@ def complete(task_id):
     task = Task.query.get_or_404(task_id)
     task.status = TaskStatus.DONE.value
     task.completed_at = datetime.utcnow()
+    task.snoozed_until = None
     db.session.commit()
     
     flash('Task marked as complete.', 'success')
@@ -138,12 +163,19 @@ def complete(task_id):
 
 @tasks_bp.route('/<int:task_id>/snooze', methods=['POST'])
 def snooze(task_id):
-    """Snooze a task (mark as snoozed)."""
+    """Snooze a task until a date (tomorrow by default)."""
     task = Task.query.get_or_404(task_id)
+    try:
+        until = snooze_until_from(request.form.get('snooze_until', '').strip())
+    except ValueError:
+        flash('Invalid snooze date.', 'error')
+        return redirect(request.referrer or url_for('dashboard.index'))
     task.status = TaskStatus.SNOOZED.value
+    task.snoozed_until = until
     db.session.commit()
+    note_snooze(until)
     
-    flash('Task snoozed.', 'success')
+    flash(f"Task snoozed until {until.strftime('%m/%d/%Y')}.", 'success')
     return redirect(request.referrer or url_for('dashboard.index'))
 
 
@@ -153,6 +185,7 @@ def reopen(task_id):
     task = Task.query.get_or_404(task_id)
     task.status = TaskStatus.OPEN.value
     task.completed_at = None
+    task.snoozed_until = None
     db.session.commit()
     
     flash('Task reopened.', 'success')
@@ -169,3 +202,143 @@ def delete(task_id):
     flash('Task deleted.', 'success')
     return redirect(request.referrer or url_for('dashboard.index'))
 
+
+
+@tasks_bp.route('/bulk', methods=['POST'])
+def bulk():
+    """Apply one action to many tasks with a single UPDATE/DELETE statement.
+
+    Tasks are chosen either explicitly (task_ids) or by a filter scope
+    ('overdue' or 'open') optionally narrowed by contact, property or deal.
+    """
+    action = request.form.get('action', '')
+    scope = request.form.get('scope', 'selected')
+    today = date.today()
+    
+    conditions = []
+    if scope == 'selected':
+        task_ids = [int(tid) for tid in request.form.getlist('task_ids') if tid.isdigit()]
+        if not task_ids:
+            flash('No tasks selected.', 'error')
+            return redirect(request.referrer or url_for('dashboard.index'))
+        conditions.append(Task.id.in_(task_ids))
+    elif scope == 'overdue':
+        conditions += [Task.status == TaskStatus.OPEN.value, Task.due_date < today]
+    elif scope == 'open':
+        conditions.append(Task.status == TaskStatus.OPEN.value)
+    else:
+        flash('Invalid task selection.', 'error')
+        return redirect(request.referrer or url_for('dashboard.index'))
+    
+    for field, column in (('contact_id', Task.contact_id), ('property_id', Task.property_id), ('deal_id', Task.deal_id)):
+        value = request.form.get(field, type=int)
+        if value:
+            conditions.append(column == value)
+    
+    now = datetime.utcnow()
+    if action == 'complete':
+        values = {'status': TaskStatus.DONE.value, 'completed_at': now, 'snoozed_until': None}
+    elif action == 'snooze':
+        try:
+            until = snooze_until_from(request.form.get('date', '').strip())
+        except ValueError:
+            flash('Invalid snooze date.', 'error')
+            return redirect(request.referrer or url_for('dashboard.index'))
+        values = {'status': TaskStatus.SNOOZED.value, 'snoozed_until': until}
+        note_snooze(until)
+    elif action == 'reopen':
+        values = {'status': TaskStatus.OPEN.value, 'completed_at': None, 'snoozed_until': None}
+    elif action == 'reschedule':
+        try:
+            due_date = datetime.strptime(request.form.get('date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            flash('A valid date is required to reschedule.', 'error')
+            return redirect(request.referrer or url_for('dashboard.index'))
+        values = {'due_date': due_date}
+        # Series roots count their occurrences from due_date; move their next one with it
+        roots = db.session.execute(
+            db.select(Task.id, Task.recurrence_interval, Task.recurrence_unit, Task.recurrence_count)
+            .where(*conditions, Task.recurrence_next.isnot(None))
+        ).all()
+        if roots:
+            values['recurrence_next'] = db.case(
+                {root.id: occurrence_date(due_date, root.recurrence_interval, root.recurrence_unit,
+                                          max(root.recurrence_count or 1, 1)) for root in roots},
+                value=Task.id, else_=Task.recurrence_next)
+    elif action == 'delete':
+        values = None
+    else:
+        flash('Invalid bulk action.', 'error')
+        return redirect(request.referrer or url_for('dashboard.index'))
+    
+    try:
+        if values is None:
+            stmt = db.delete(Task).where(*conditions)
+        else:
+            values['updated_at'] = now
+            stmt = db.update(Task).where(*conditions).values(**values)
+        count = db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error updating tasks: {str(e)}', 'error')
+        return redirect(request.referrer or url_for('dashboard.index'))
+    
+    past_tense = {'complete': 'completed', 'snooze': 'snoozed', 'reopen': 'reopened',
+                  'reschedule': 'rescheduled', 'delete': 'deleted'}
+    flash(f'{count} task(s) {past_tense[action]}.', 'success')
+    return redirect(request.referrer or url_for('dashboard.index'))
+
+
+@tasks_bp.route('/calendar', methods=['GET', 'POST'])
+def calendar_feeds():
+    """List calendar feed URLs and create new ones."""
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        if not name:
+            flash('Feed name is required.', 'error')
+            return redirect(url_for('tasks.calendar_feeds'))
+        feed = CalendarFeed(
+            token=secrets.token_urlsafe(24),
+            name=name,
+            contact_id=request.form.get('contact_id', type=int) or None,
+            property_id=request.form.get('property_id', type=int) or None,
+            deal_id=request.form.get('deal_id', type=int) or None,
+        )
+        db.session.add(feed)
+        db.session.commit()
+        flash('Calendar feed created. Subscribe to its URL from your calendar app.', 'success')
+        return redirect(url_for('tasks.calendar_feeds'))
+    
+    feeds = CalendarFeed.query.order_by(CalendarFeed.created_at.desc()).all()
+    contacts = Contact.query.order_by(Contact.name).all()
+    deals = Deal.query.order_by(Deal.deal_name).all()
+    properties = Property.query.order_by(Property.name, Property.address).all()
+    return render_template('tasks/calendar.html', feeds=feeds, contacts=contacts, deals=deals,
+                           properties=properties)
+
+
+@tasks_bp.route('/calendar/<int:feed_id>/delete', methods=['POST'])
+def delete_calendar_feed(feed_id):
+    """Revoke a calendar feed URL."""
+    feed = CalendarFeed.query.get_or_404(feed_id)
+    db.session.delete(feed)
+    db.session.commit()
+    flash('Calendar feed revoked.', 'success')
+    return redirect(url_for('tasks.calendar_feeds'))
+
+
+@tasks_bp.route('/calendar/<token>.ics')
+def calendar_feed(token):
+    """ICS feed of open and snoozed tasks; unchanged feeds answer 304."""
+    found = lookup_feed(token)
+    if found is None:
+        return 'Unknown calendar feed', 404
+    feed, etag = found
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'private, no-cache'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    body = cached_body(etag)
+    if body is None:
+        body = stream_with_context(render_feed(feed, etag))
+    return Response(body, mimetype='text/calendar', headers=headers)
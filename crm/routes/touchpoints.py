@@ -1,14 +1,20 @@
 """
 Touchpoint routes for logging interactions.
 """
-from datetime import datetime
+from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
 from flask import Blueprint, request, redirect, url_for, flash, render_template
+from crm.activity import (PERIODS, activity_counts, bucket_start, buckets_between, contact_names,
+                          default_start)
 from crm.db import db
+from crm.jobs import enqueue
 from crm.models import Touchpoint, TouchpointType, Task, TaskPriority, Contact
 
 touchpoints_bp = Blueprint('touchpoints', __name__, url_prefix='/touchpoints')
 
+# Contacts listed in the activity report's busiest-contacts table
+TOP_CONTACTS = 15
+
 
 @touchpoints_bp.route('/')
 def index():
@@ -118,3 +124,53 @@ def create():
         db.session.rollback()
         flash(f'Error logging touchpoint: {str(e)}', 'error')
         return redirect(request.referrer or url_for('dashboard.index'))
+
+
+def _date_arg(name: str):
+    """Read a YYYY-MM-DD query parameter; None when missing or invalid."""
+    try:
+        return datetime.strptime(request.args.get(name, ''), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+@touchpoints_bp.route('/activity')
+def activity():
+    """Touchpoint volume per week or month, by type and by contact, from the activity rollups."""
+    period = request.args.get('period', 'month')
+    if period not in PERIODS:
+        period = 'month'
+    end = _date_arg('end') or date.today()
+    start = bucket_start(period, _date_arg('start') or default_start(period, end))
+    touchpoint_type = request.args.get('type') or None
+    contact_id = request.args.get('contact_id', type=int)
+    
+    counts = activity_counts(period, start, end, ('bucket', 'type'),
+                             contact_id=contact_id, touchpoint_type=touchpoint_type)
+    # One chart column per bucket, quiet ones included
+    columns = {bucket: {} for bucket in buckets_between(period, start, end)}
+    type_totals = {}
+    for row in counts:
+        columns.setdefault(row.bucket, {})[row.touchpoint_type] = row.touchpoints
+        type_totals[row.touchpoint_type] = type_totals.get(row.touchpoint_type, 0) + row.touchpoints
+    columns = [(bucket, by_type, sum(by_type.values())) for bucket, by_type in sorted(columns.items())]
+    types = [t.value for t in TouchpointType]
+    types += sorted(set(type_totals) - set(types))
+    
+    top = activity_counts(period, start, end, ('contact',), contact_id=contact_id,
+                          touchpoint_type=touchpoint_type, limit=TOP_CONTACTS)
+    names = contact_names([row.contact_id for row in top] + [contact_id])
+    
+    return render_template('touchpoints/activity.html',
+                         period=period, start=start, end=end,
+                         touchpoint_type=touchpoint_type, contact_id=contact_id,
+                         columns=columns, peak=max((total for _, _, total in columns), default=0),
+                         types=types, type_totals=type_totals, top=top, names=names,
+                         contacts=Contact.query.order_by(Contact.name).all())
+
+
+@touchpoints_bp.route('/activity/rebuild', methods=['POST'])
+def rebuild_activity():
+    """Recompute the activity rollups in the background."""
+    job = enqueue('rebuild_activity')
+    return redirect(url_for('jobs.detail', job_id=job.id))
@@ -0,0 +1,198 @@
+"""
+Task scheduling helpers: lazy materialization of recurring tasks and
+waking snoozed tasks once their snooze-until time has passed.
+"""
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from dateutil.relativedelta import relativedelta
+from flask import Flask
+from crm.audit import record_changes
+from crm.db import db
+from crm.models import Task, TaskStatus, RecurrenceUnit
+
+# How far ahead recurring occurrences are created
+HORIZON_DAYS = 30
+
+# Upper bound on rows inserted per call so a page load stays cheap
+MAX_OCCURRENCES_PER_PASS = 500
+
+# Snoozing without an explicit date hides a task until this many days from today
+DEFAULT_SNOOZE_DAYS = 1
+
+# Seconds a worker trusts its cached next wake-up time before re-reading it,
+# so snoozes made by other workers are noticed
+WAKE_RECHECK_SECONDS = 60
+
+_wake_lock = threading.Lock()
+_next_wake_at = None  # Earliest known snoozed_until, or None when unknown
+_next_wake_checked = 0.0
+
+
+def occurrence_date(start: date, interval: int, unit: str, index: int) -> date:
+    """Return the due date of the index-th occurrence (0 is the series root).
+
+    Offsets are computed from the start date rather than the previous
+    occurrence so month-end dates do not drift (Jan 31 -> Feb 28 -> Mar 31).
+    """
+    return start + relativedelta(**{unit: interval * index})
+
+
+def start_recurrence(task: Task, interval, unit):
+    """Attach (or clear) a recurrence rule on a series root task."""
+    if not interval or unit not in [u.value for u in RecurrenceUnit]:
+        task.recurrence_interval = None
+        task.recurrence_unit = None
+        task.recurrence_next = None
+        return
+    task.recurrence_interval = interval
+    task.recurrence_unit = unit
+    task.recurrence_count = max(task.recurrence_count or 1, 1)
+    task.recurrence_next = occurrence_date(task.due_date, interval, unit, task.recurrence_count)
+
+
+def materialize_recurring_tasks(today: date = None, horizon_days: int = HORIZON_DAYS) -> int:
+    """Create occurrences of recurring tasks due within the horizon window.
+
+    Only series whose next occurrence falls inside the window are touched
+    (indexed on recurrence_next), so calling this on every dashboard load is
+    cheap. Returns the number of tasks created.
+    """
+    horizon = (today or date.today()) + timedelta(days=horizon_days)
+    series = db.session.execute(
+        db.select(Task.id, Task.description, Task.due_date, Task.priority, Task.deal_id,
+                  Task.contact_id, Task.property_id, Task.recurrence_interval,
+                  Task.recurrence_unit, Task.recurrence_count, Task.recurrence_next)
+        .where(Task.recurrence_next.isnot(None), Task.recurrence_next <= horizon)
+        .order_by(Task.recurrence_next)
+        .limit(MAX_OCCURRENCES_PER_PASS)
+    ).all()
+
+    created = 0
+    now = datetime.utcnow()
+    for root in series:
+        rows = []
+        count = root.recurrence_count or 1
+        next_due = root.recurrence_next
+        while next_due <= horizon and created + len(rows) < MAX_OCCURRENCES_PER_PASS:
+            rows.append({
+                'description': root.description,
+                'due_date': next_due,
+                'priority': root.priority,
+                'deal_id': root.deal_id,
+                'contact_id': root.contact_id,
+                'property_id': root.property_id,
+                'status': TaskStatus.OPEN.value,
+                'series_id': root.id,
+                'created_at': now,
+                'updated_at': now,
+            })
+            count += 1
+            next_due = occurrence_date(root.due_date, root.recurrence_interval, root.recurrence_unit, count)
+        if not rows:
+            break
+
+        # Advance the series only if no other worker already did
+        claimed = db.session.execute(
+            db.update(Task)
+            .where(Task.id == root.id, Task.recurrence_next == root.recurrence_next)
+            .values(recurrence_count=count, recurrence_next=next_due, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if claimed:
+            new_ids = db.session.execute(db.insert(Task).returning(Task.id), rows).scalars().all()
+            record_changes(Task.__table__, new_ids)
+            created += len(rows)
+
+    db.session.commit()
+    return created
+
+
+def snooze_until_from(value: str = None) -> datetime:
+    """Parse a YYYY-MM-DD snooze date (start of that day, UTC); default to tomorrow.
+
+    Snooze times are compared with ``datetime.utcnow()``, so they are built
+    on the UTC calendar too.
+    """
+    if value:
+        return datetime.strptime(value, '%Y-%m-%d')
+    start_of_today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    return start_of_today + timedelta(days=DEFAULT_SNOOZE_DAYS)
+
+
+def note_snooze(until: datetime):
+    """Tell this worker's wake-up cache about a newly snoozed task."""
+    global _next_wake_at
+    with _wake_lock:
+        if _next_wake_at is None or until < _next_wake_at:
+            _next_wake_at = until
+
+
+def wake_snoozed_tasks(now: datetime = None) -> int:
+    """Reopen snoozed tasks whose snooze-until time has passed.
+
+    The earliest pending wake-up time is cached per process, so most calls
+    return without touching the database. When it is due, a single indexed
+    UPDATE reopens every task that is ready. Returns the number reopened.
+    """
+    global _next_wake_at, _next_wake_checked
+    now = now or datetime.utcnow()
+    with _wake_lock:
+        cache_fresh = time.monotonic() - _next_wake_checked < WAKE_RECHECK_SECONDS
+        if cache_fresh and (_next_wake_at is None or _next_wake_at > now):
+            return 0
+
+    woken = db.session.execute(
+        db.update(Task)
+        .where(Task.status == TaskStatus.SNOOZED.value, Task.snoozed_until <= now)
+        .values(status=TaskStatus.OPEN.value, snoozed_until=None, updated_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    next_wake = db.session.execute(
+        db.select(db.func.min(Task.snoozed_until)).where(Task.status == TaskStatus.SNOOZED.value)
+    ).scalar()
+    db.session.commit()
+
+    with _wake_lock:
+        _next_wake_at = next_wake
+        _next_wake_checked = time.monotonic()
+    return woken
+
+
+def init_scheduling(app: Flask):
+    """Wake due tasks now (covers serverless cold starts) and on a timer."""
+    with app.app_context():
+        try:
+            # Tasks snoozed before snooze-until times existed have none; wake them now
+            db.session.execute(
+                db.update(Task)
+                .where(Task.status == TaskStatus.SNOOZED.value, Task.snoozed_until.is_(None))
+                .values(snoozed_until=datetime.utcnow(), updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            wake_snoozed_tasks()
+        except Exception as e:
+            print(f"Note: Could not wake snoozed tasks: {e}")
+        finally:
+            db.session.remove()
+
+    interval = int(os.environ.get('WAKE_INTERVAL_SECONDS', WAKE_RECHECK_SECONDS))
+    if interval > 0:
+        thread = threading.Thread(target=_wake_loop, args=(app, interval),
+                                  name='crm-snooze-wake', daemon=True)
+        thread.start()
+
+
+def _wake_loop(app: Flask, interval: int):
+    """Background timer that periodically reopens due snoozed tasks."""
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                wake_snoozed_tasks()
+            except Exception as e:
+                print(f"Note: Could not wake snoozed tasks: {e}")
+            finally:
+                db.session.remove()
@@ -0,0 +1,167 @@
+"""
+Template compilation and fragment caching.
+
+Compiled template bytecode is kept on disk so a cold start (e.g. a new
+serverless instance) loads templates instead of recompiling them. Run
+``flask --app app compile-templates`` before deploying to ship the cache in
+``crm/.jinja_cache``; when that directory is read-only at runtime, newly
+compiled templates go to the system temp directory instead.
+
+``{% cache 'name', part, ... %}...{% endcache %}`` stores rendered HTML in
+an in-process LRU keyed by every part. Parts should include the versions
+of the records the fragment shows (``entity_version(obj, ...)``), so edits
+produce a new key and stale fragments simply age out.
+"""
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from flask import Flask
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import inspect
+
+BUNDLED_CACHE_DIR = os.path.join(os.path.dirname(__file__), '.jinja_cache')
+
+# Rendered fragments kept per process (roughly 1-2 KB each for table rows)
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+
+
+class _BytecodeCache(FileSystemBytecodeCache):
+    """Bytecode cache that falls back to a writable directory."""
+
+    def __init__(self, directory: str, fallback: str):
+        super().__init__(directory)
+        self._fallback = FileSystemBytecodeCache(fallback)
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        if bucket.code is None:
+            self._fallback.load_bytecode(bucket)
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            # Read-only deploy artifact: keep new bytecode in the temp directory
+            try:
+                self._fallback.dump_bytecode(bucket)
+            except OSError:
+                pass
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered template fragments."""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache(FRAGMENT_CACHE_SIZE)
+
+
+def _freeze(value):
+    """Make a key part hashable (lists and dicts from templates)."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def entity_version(*objs) -> tuple:
+    """Version key for ORM objects: id and ``updated_at``, or a hash of the columns.
+
+    ``None`` is allowed for missing related records.
+    """
+    version = []
+    for obj in objs:
+        if obj is None:
+            version.append(None)
+            continue
+        mapper = inspect(obj).mapper
+        if 'updated_at' in mapper.columns:
+            version.append((mapper.local_table.name, obj.id, obj.updated_at))
+        else:
+            # Models without updated_at: any column change changes the hash
+            values = tuple(getattr(obj, attr.key) for attr in mapper.column_attrs)
+            version.append((mapper.local_table.name, obj.id, hash(values)))
+    return tuple(version)
+
+
+class CacheExtension(Extension):
+    """``{% cache key, version, ... %}`` fragment caching."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.Const(parser.name), nodes.List(parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, template_name, parts, caller):
+        key = (template_name,) + _freeze(parts)
+        html = fragment_cache.get(key)
+        if html is None:
+            html = Markup(caller())
+            fragment_cache.set(key, html)
+        return html
+
+
+def precompile_templates(app: Flask) -> int:
+    """Compile every template into the bytecode cache. Returns the count."""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def init_templating(app: Flask):
+    """Enable the bytecode cache and the ``{% cache %}`` tag."""
+    directory = os.environ.get('JINJA_CACHE_DIR', BUNDLED_CACHE_DIR)
+    fallback = os.path.join(tempfile.gettempdir(), 'crm-jinja-cache')
+    for path in (directory, fallback):
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError:
+            pass
+    app.jinja_env.bytecode_cache = _BytecodeCache(directory, fallback)
+    app.jinja_env.add_extension(CacheExtension)
+    app.jinja_env.globals['entity_version'] = entity_version
+
+    @app.cli.command('compile-templates')
+    def compile_templates_command():
+        """Precompile templates into the bytecode cache for deployment."""
+        count = precompile_templates(app)
+        print(f"Compiled {count} templates into {directory}")
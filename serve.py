@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Production server for the CRM application.
+
+Runs the app under gunicorn with several worker processes, each serving
+requests on a few threads. The app is loaded once in the master and forked,
+so workers start instantly and share its memory pages. The master runs no
+background jobs; each worker picks up queued jobs once it is forked.
+Gunicorn restarts workers that crash and recycles them after MAX_REQUESTS
+requests or once their memory passes MAX_WORKER_MEMORY_MB.
+
+``kill -HUP <master pid>`` retires the workers gracefully and forks fresh
+ones from the same preloaded code, so it applies settings but not code
+changes. To deploy new code, restart the master, or send ``kill -USR2``
+to start a new master beside the old one and then ``kill -TERM`` the old
+master once the new workers are up.
+
+Where gunicorn is unavailable (Windows) the app runs on Werkzeug's threaded
+server instead, without debug mode.
+
+Settings (environment):
+    HOST, PORT               bind address (127.0.0.1:5001)
+    WEB_CONCURRENCY          worker processes (2 x CPUs + 1, at most 12)
+    GUNICORN_THREADS         threads per worker (4)
+    MAX_REQUESTS             requests before a worker is recycled (1000, 0 disables)
+    MAX_WORKER_MEMORY_MB     RSS at which a worker is recycled (512, 0 disables)
+    GRACEFUL_TIMEOUT         seconds workers get to finish requests on restart (30)
+"""
+import os
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # Windows, or gunicorn not installed
+    BaseApplication = None
+
+HOST = os.environ.get('HOST', '127.0.0.1')
+PORT = int(os.environ.get('PORT', 5001))
+
+# Workers beyond this mostly contend for the database
+MAX_WORKERS = 12
+
+MAX_REQUESTS = int(os.environ.get('MAX_REQUESTS', 1000))
+MAX_WORKER_MEMORY_MB = int(os.environ.get('MAX_WORKER_MEMORY_MB', 512))
+
+
+def worker_count() -> int:
+    """Worker processes: WEB_CONCURRENCY, else 2 x CPUs + 1 (at least 2)."""
+    configured = os.environ.get('WEB_CONCURRENCY')
+    if configured:
+        return max(1, int(configured))
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    return max(2, min(cpus * 2 + 1, MAX_WORKERS))
+
+
+def _start_worker_jobs(server, worker):
+    """Run background jobs in each worker rather than in the preloading master."""
+    from crm.jobs import start_runner
+    start_runner()
+
+
+def _recycle_large_worker(worker, req, environ, resp):
+    """Retire a worker after this request once its memory passes the limit."""
+    from crm.metrics import rss_bytes
+    rss_mb = rss_bytes() / (1024 * 1024)
+    if rss_mb > MAX_WORKER_MEMORY_MB:
+        worker.log.info("Worker %s using %.0f MB, recycling", worker.pid, rss_mb)
+        worker.alive = False
+
+
+if BaseApplication is not None:
+    class CRMServer(BaseApplication):
+        """Gunicorn application running the preloaded CRM app."""
+
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from crm.jobs import defer_to_workers
+            defer_to_workers()
+            from app import app
+            return app
+
+
+def options() -> dict:
+    """Gunicorn settings derived from the environment."""
+    settings = {
+        'bind': f'{HOST}:{PORT}',
+        'workers': worker_count(),
+        'worker_class': 'gthread',
+        'threads': int(os.environ.get('GUNICORN_THREADS', 4)),
+        'preload_app': True,
+        'post_fork': _start_worker_jobs,
+        'max_requests': MAX_REQUESTS,
+        # Spread recycling out so workers do not all restart together
+        'max_requests_jitter': MAX_REQUESTS // 10,
+        'graceful_timeout': int(os.environ.get('GRACEFUL_TIMEOUT', 30)),
+        'timeout': 60,
+        'accesslog': '-',
+        'errorlog': '-',
+    }
+    if MAX_WORKER_MEMORY_MB > 0:
+        settings['post_request'] = _recycle_large_worker
+    return settings
+
+
+def main():
+    if BaseApplication is None:
+        print("Note: gunicorn is not available; serving with the threaded development server")
+        from app import app
+        app.run(host=HOST, port=PORT, threaded=True, debug=False, use_reloader=False)
+        return
+    CRMServer(options()).run()
+
+
+if __name__ == '__main__':
+    main()